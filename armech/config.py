@@ -2,10 +2,27 @@
 #
 # Constants used by the program to identify settings and other configurations
 
+from math import pi
+from os.path import join, expanduser
+
 # Joint Type Constants
 JOINT_REVOLUTE = 1
 JOINT_PRISMATIC = 2
 
+# Default joint limits (radians for revolute, meters for prismatic joints)
+JOINT_LIMITS_REVOLUTE = (-pi, pi)
+JOINT_LIMITS_PRISMATIC = (-1.0, 1.0)
+
+# Gravitational acceleration in global coordinates (m/s^2)
+GRAVITY = (0.0, 0.0, -9.81)
+
+# Integrator Constants
+INTEGRATOR_EULER = 201
+INTEGRATOR_RK4 = 202
+
 # Unit Constants
 UNIT_M = 101
-UNIT_MM = 102
\ No newline at end of file
+UNIT_MM = 102
+
+# Directory for generated code and other cached data
+CACHE_DIR = join(expanduser('~'), '.cache', 'armech')
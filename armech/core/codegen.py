@@ -0,0 +1,272 @@
+# codegen.py
+#
+# Generates flat, unrolled forward kinematics and jacobian functions for a
+# specific SerialLink robot from its DH table. The symbolic chain is composed
+# with SymPy, common subexpressions are eliminated and the result is written
+# as a python module that is cached on disk, keyed by the DH table.
+
+from hashlib import sha1
+from importlib.util import spec_from_file_location, module_from_spec
+from os import makedirs, replace, getpid
+from os.path import join, isfile, abspath
+
+from sympy import symbols, Matrix, Float, Integer, cos, sin, cse, zeros, eye
+
+from armech.config import JOINT_REVOLUTE, CACHE_DIR
+
+# Bump when the generated code changes so old cache files are not reused
+GENERATOR_VERSION = 1
+
+# Generated modules that have already been loaded, by cache directory and
+# DH key
+_loaded_modules = {}
+
+
+def dh_table(robot):
+    """Get the DH table of a robot.
+
+    Args:
+        robot: SerialLink object
+
+    Returns: list of (joint_type, a, alpha, d, theta) tuples, one per link
+    """
+    return [
+        (link.joint_type, float(link.a), float(link.alpha), float(link.d),
+         float(link.theta))
+        for link in robot.links
+    ]
+
+
+def dh_key(robot):
+    """Get a key that uniquely identifies the DH table of a robot.
+
+    Args:
+        robot: SerialLink object
+
+    Returns: hex string
+    """
+    table = repr((GENERATOR_VERSION, dh_table(robot)))
+    return sha1(table.encode('ascii')).hexdigest()
+
+
+def generate_kinematics(robot, cache_dir=None):
+    """Get a module with kinematics functions specialized for the robot.
+
+    The module has the functions tool_trans(q), jacobian(q) and
+    tool_trans_jacobian(q) which match SerialLink.get_tool_trans (local)
+    and the geometric jacobian [v; w] of the tool expressed in the robot
+    base frame. q can be a single state vector or an [N x num_links] array.
+
+    Args:
+        robot: SerialLink object
+        cache_dir: directory where generated modules are stored, defaults to
+                   config.CACHE_DIR
+
+    Returns: the generated python module
+    """
+
+    key = dh_key(robot)
+    if cache_dir is None:
+        cache_dir = join(CACHE_DIR, 'kinematics')
+    module_key = (abspath(cache_dir), key)
+    if module_key in _loaded_modules:
+        return _loaded_modules[module_key]
+
+    # Generate the source if it has not been cached yet
+    file_name = join(cache_dir, 'dh_{}.py'.format(key[0:16]))
+    if not isfile(file_name):
+        source = kinematics_source(robot, key)
+        makedirs(cache_dir, exist_ok=True)
+        temp_file_name = '{}.{}.tmp'.format(file_name, getpid())
+        with open(temp_file_name, 'w') as source_file:
+            source_file.write(source)
+        replace(temp_file_name, file_name)
+
+    # Import the generated module
+    spec = spec_from_file_location('armech_dh_{}'.format(key[0:16]),
+                                   file_name)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if module.DH_KEY != key:
+        raise ImportError(
+            'Generated kinematics in "{}" do not match the robot'.format(
+                file_name)
+        )
+    _loaded_modules[module_key] = module
+
+    return module
+
+
+def kinematics_source(robot, key=None):
+    """Get the source code of the specialized kinematics module of a robot.
+
+    Args:
+        robot: SerialLink object
+        key: DH key of the robot, calculated if not given
+
+    Returns: string of python source code
+    """
+
+    if key is None:
+        key = dh_key(robot)
+    q = symbols('q0:{}'.format(robot.num_links))
+    tool, jacobian = symbolic_kinematics(robot, q)
+
+    lines = [
+        '# Generated by armech.core.codegen, do not edit.',
+        '#',
+        '# DH table (joint_type, a, alpha, d, theta):',
+    ]
+    for row in dh_table(robot):
+        lines.append('#   {!r}'.format(row))
+    lines += [
+        '',
+        'from numpy import cos, sin, empty, float_',
+        '',
+        'DH_KEY = {!r}'.format(key),
+        'NUM_LINKS = {}'.format(robot.num_links),
+    ]
+    lines += _function_source(
+        'tool_trans', q, [('out', tool)],
+        'Get the 4x4 tool transform local to the robot.'
+    )
+    lines += _function_source(
+        'jacobian', q, [('jac', jacobian)],
+        'Get the 6 x num_links geometric jacobian of the tool.'
+    )
+    lines += _function_source(
+        'tool_trans_jacobian', q, [('out', tool), ('jac', jacobian)],
+        'Get the tool transform and jacobian with shared subexpressions.'
+    )
+
+    return '\n'.join(lines) + '\n'
+
+
+def symbolic_kinematics(robot, q):
+    """Compose the symbolic tool transform and geometric jacobian.
+
+    Args:
+        robot: SerialLink object
+        q: list of sympy symbols, one for each link
+
+    Returns: 4x4 sympy Matrix of the tool transform and 6 x num_links sympy
+             Matrix of the jacobian
+    """
+
+    # Compose the chain, keeping the joint axis and origin of each link
+    transform = eye(4)
+    axes = []
+    for k, link in enumerate(robot.links):
+        state, link_transform = symbolic_link_transforms(link, q[k])
+        frame = transform*state
+        axes.append((link.joint_type, frame[0:3, 2], frame[0:3, 3]))
+        transform = transform*link_transform
+
+    # Geometric jacobian of the tool point, in this DH convention a revolute
+    # joint rotates about the negative z axis of its frame
+    jacobian = zeros(6, robot.num_links)
+    position = transform[0:3, 3]
+    for k, (joint_type, z, origin) in enumerate(axes):
+        if joint_type == JOINT_REVOLUTE:
+            w = -z
+            v = w.cross(position - origin)
+        else:
+            w = zeros(3, 1)
+            v = z
+        jacobian[0:3, k] = v
+        jacobian[3:6, k] = w
+
+    return transform, jacobian
+
+
+def symbolic_link_transforms(link, q):
+    """Get the symbolic state transform and full link transform of a link.
+
+    Args:
+        link: LinkDH object
+        q: sympy symbol of the general coordinate of the link
+
+    Returns: state transform and link transform as 4x4 sympy Matrix objects
+    """
+
+    if link.joint_type == JOINT_REVOLUTE:
+        angle = q + _constant(link.theta) if link.theta != 0.0 else q
+        c = cos(angle)
+        s = sin(angle)
+        d = _constant(link.d)
+    else:
+        c = _constant(link.cos_theta)
+        s = _constant(link.sin_theta)
+        d = _constant(link.d) + q
+    a = _constant(link.a)
+    ca = _constant(link.cos_alpha)
+    sa = _constant(link.sin_alpha)
+
+    state = Matrix([
+        [c,  s, 0, 0],
+        [-s, c, 0, 0],
+        [0,  0, 1, d],
+        [0,  0, 0, 1],
+    ])
+    link_transform = Matrix([
+        [c,  s*ca, -s*sa, a*c],
+        [-s, c*ca, -c*sa, -a*s],
+        [0,  sa,   ca,    d],
+        [0,  0,    0,     1],
+    ])
+
+    return state, link_transform
+
+
+def _constant(value, tolerance=1e-12):
+    """Convert a DH constant to sympy, snapping values that are numerically
+    0 or +-1 (e.g. cos(pi/2)) to exact integers so they simplify away."""
+    value = float(value)
+    if abs(value) < tolerance:
+        return Integer(0)
+    if abs(abs(value) - 1.0) < tolerance:
+        return Integer(1) if value > 0 else Integer(-1)
+    return Float(value)
+
+
+def _function_source(name, q, outputs, docstring):
+    """Get the source lines of a generated function.
+
+    Args:
+        name: name of the function
+        q: list of sympy symbols of the general coordinates
+        outputs: list of (variable name, sympy Matrix) to calculate
+        docstring: one line docstring of the function
+
+    Returns: list of source lines
+    """
+
+    # Eliminate common subexpressions over all non constant entries
+    entries = []
+    for variable, matrix in outputs:
+        for i in range(matrix.rows):
+            for j in range(matrix.cols):
+                entries.append((variable, i, j, matrix[i, j]))
+    replacements, reduced = cse([entry[3] for entry in entries])
+
+    lines = [
+        '',
+        '',
+        'def {}(q):'.format(name),
+        '    """{}"""'.format(docstring),
+        '    q = float_(q)',
+    ]
+    for k, symbol in enumerate(q):
+        lines.append('    {} = q[..., {}]'.format(symbol, k))
+    for symbol, expression in replacements:
+        lines.append('    {} = {}'.format(symbol, expression))
+    for variable, matrix in outputs:
+        lines.append('    {} = empty(q.shape[:-1] + ({}, {}))'.format(
+            variable, matrix.rows, matrix.cols))
+    for (variable, i, j, _), expression in zip(entries, reduced):
+        lines.append('    {}[..., {}, {}] = {}'.format(
+            variable, i, j, expression))
+    lines.append('    return {}'.format(
+        ', '.join(variable for variable, _ in outputs)))
+
+    return lines
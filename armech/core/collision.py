@@ -0,0 +1,798 @@
+# collision.py
+#
+# Collision checking between triangle meshes. Each mesh gets a bounding
+# volume hierarchy (an AABB tree) that is built once in body coordinates.
+# Two meshes are compared by walking both trees at once, with the boxes of
+# one tree moved into the frame of the other, so only the few triangles in
+# overlapping leaves are ever transformed. All stages work on whole arrays
+# of node or triangle pairs at a time.
+
+from multiprocessing import Pool
+
+from numpy import float_, int_, empty, zeros, full, arange, argmax, \
+    argpartition, concatenate, cross, einsum, abs, dot, roll, newaxis, \
+    argsort, searchsorted, repeat, broadcast_to, tile, stack, where, \
+    minimum, maximum, nonzero, array_split, array, inf
+from numpy.linalg import norm
+
+# Default number of triangles in a leaf of the tree
+LEAF_SIZE = 4
+
+# Default number of bounding spheres fitted to a mesh
+N_SPHERES = 16
+
+# Distance (m) by which projections must be apart to count as separated
+SEPARATION_TOLERANCE = 1e-9
+
+
+class BVH:
+
+    def __init__(self, vertices, faces, leaf_size=LEAF_SIZE,
+                 n_spheres=N_SPHERES):
+        """
+        Build an axis aligned bounding box tree over the triangles of a
+        mesh. Nodes are split at the median triangle centroid along their
+        longest axis, so the tree is balanced. A small set of spheres that
+        together contain all triangles is fitted as a cheap proxy of the
+        mesh (see fit_spheres).
+        :param vertices: float[3xN] vertices in body coordinates
+        :param faces: int[3xM] vertex indices of the triangles
+        :param leaf_size: int, maximum number of triangles in a leaf
+        :param n_spheres: int, maximum number of proxy spheres
+        :return: BVH object
+        """
+
+        triangles = float_(vertices).T[int_(faces).T]
+        centroids = triangles.mean(axis=1)
+        order = arange(triangles.shape[0])
+        self.leaf_size = leaf_size
+        self.n_triangles = triangles.shape[0]
+
+        # Node arrays, a leaf has child -1 and owns the triangles
+        # start:start + count of the reordered triangle array
+        n_max = max(2*self.n_triangles, 1)
+        self.lower = empty((n_max, 3))
+        self.upper = empty((n_max, 3))
+        self.children = empty((n_max, 2), dtype=int)
+        self.start = empty(n_max, dtype=int)
+        self.count = empty(n_max, dtype=int)
+
+        n_nodes = 1
+        stack = [(0, 0, self.n_triangles)]
+        while stack:
+            node, start, end = stack.pop()
+            node_triangles = triangles[order[start:end]]
+            self.start[node] = start
+            self.count[node] = end - start
+            if end > start:
+                self.lower[node] = node_triangles.min(axis=(0, 1))
+                self.upper[node] = node_triangles.max(axis=(0, 1))
+            else:
+                self.lower[node] = self.upper[node] = 0.0
+            if end - start <= leaf_size:
+                self.children[node] = -1
+                continue
+
+            # Split at the median centroid along the longest axis
+            node_centroids = centroids[order[start:end]]
+            axis = argmax(node_centroids.max(axis=0) -
+                          node_centroids.min(axis=0))
+            middle = (end - start)//2
+            order[start:end] = order[start:end][
+                argpartition(node_centroids[:, axis], middle)
+            ]
+            self.children[node] = (n_nodes, n_nodes + 1)
+            stack.append((n_nodes, start, start + middle))
+            stack.append((n_nodes + 1, start + middle, end))
+            n_nodes += 2
+
+        self.n_nodes = n_nodes
+        self.lower = self.lower[0:n_nodes]
+        self.upper = self.upper[0:n_nodes]
+        self.children = self.children[0:n_nodes]
+        self.start = self.start[0:n_nodes]
+        self.count = self.count[0:n_nodes]
+        self.is_leaf = self.children[:, 0] < 0
+        self.center = (self.lower + self.upper)/2.0
+        self.half_size = (self.upper - self.lower)/2.0
+        self.triangles = triangles[order]
+        self.sphere_centers, self.sphere_radii = self.fit_spheres(n_spheres)
+
+    def fit_spheres(self, n_spheres):
+        """
+        Fit bounding spheres to the mesh. Starting from the root, the node
+        with the largest sphere is replaced by its children until there are
+        n_spheres nodes. Each node gets a sphere at the center of its box
+        that contains all its triangles, so the spheres together contain
+        the mesh.
+        :param n_spheres: int, maximum number of spheres
+        :return: float[Kx3] centers and float[K] radii of the spheres in
+        body coordinates
+        """
+
+        if self.n_triangles == 0:
+            return zeros((0, 3)), zeros(0)
+
+        nodes = [0]
+        radii = [self._node_radius(0)]
+        while len(nodes) < n_spheres:
+            splittable = [k for k, node in enumerate(nodes)
+                          if not self.is_leaf[node]]
+            if not splittable:
+                break
+            k = max(splittable, key=lambda k: radii[k])
+            children = self.children[nodes[k]]
+            nodes[k:k + 1] = children
+            radii[k:k + 1] = [self._node_radius(child) for child in children]
+
+        return self.center[nodes], float_(radii).reshape(-1)
+
+    def _node_radius(self, node):
+        """Get the radius of the sphere at the center of a node that
+        contains the triangles of the node."""
+        triangles = self.triangles[
+            self.start[node]:self.start[node] + self.count[node]
+        ]
+        return norm(triangles - self.center[node], axis=2).max()
+
+    def get_bounds(self, rotation, translation):
+        """
+        Get an axis aligned box around the mesh after it is moved by a
+        transform. Only the root box is transformed, so the box can be
+        larger than the tightest box around the moved mesh.
+        :param rotation: float[3x3] rotation from the body to world
+        :param translation: float[3] translation of the body
+        :return: float[3] lower and float[3] upper corner of the box
+        """
+        center = dot(rotation, self.center[0]) + translation
+        half_size = dot(abs(rotation), self.half_size[0])
+        return center - half_size, center + half_size
+
+
+def meshes_collide(bvh_a, rotation_a, translation_a,
+                   bvh_b, rotation_b, translation_b):
+    """
+    Check if two meshes intersect. Touching counts as an intersection. Only
+    the surfaces are tested, a mesh completely inside the other is not
+    reported.
+    :param bvh_a: BVH of the first mesh
+    :param rotation_a: float[3x3] rotation of the first mesh
+    :param translation_a: float[3] translation of the first mesh
+    :param bvh_b: BVH of the second mesh
+    :param rotation_b: float[3x3] rotation of the second mesh
+    :param translation_b: float[3] translation of the second mesh
+    :return: bool, True if any pair of triangles intersects
+    """
+    rotation, translation = _relative_transforms(
+        rotation_a, translation_a, rotation_b[newaxis], translation_b[newaxis]
+    )
+    return bool(_collide(bvh_a, bvh_b, rotation, translation)[0])
+
+
+def meshes_distance(bvh_a, rotation_a, translation_a,
+                    bvh_b, rotation_b, translation_b):
+    """
+    Get the minimum distance between the surfaces of two meshes, 0.0 if
+    they intersect.
+    :param bvh_a: BVH of the first mesh
+    :param rotation_a: float[3x3] rotation of the first mesh
+    :param translation_a: float[3] translation of the first mesh
+    :param bvh_b: BVH of the second mesh
+    :param rotation_b: float[3x3] rotation of the second mesh
+    :param translation_b: float[3] translation of the second mesh
+    :return: float, minimum distance
+    """
+    rotation, translation = _relative_transforms(
+        rotation_a, translation_a, rotation_b[newaxis], translation_b[newaxis]
+    )
+    return float(_distance(bvh_a, bvh_b, rotation, translation)[0])
+
+
+def check_poses(link_bvhs, link_rotations, link_translations,
+                body_bvhs, body_rotations, body_translations,
+                distances=False, n_processes=None,
+                body_signed_distances=None, exact=True):
+    """
+    Check many poses of a set of moving meshes (e.g. the links of a robot
+    for many joint configurations) against a set of fixed meshes. The
+    boxes of all poses are compared at once (broad phase). For each pair of
+    meshes the proxy spheres of the moving mesh are then compared to the
+    proxy spheres, or the exact signed distance function, of the fixed
+    mesh, and only poses where the proxies touch walk the trees together.
+    Moving meshes are not checked against each other.
+    :param link_bvhs: list of L BVH objects of the moving meshes
+    :param link_rotations: float[NxLx3x3] rotations of the moving meshes
+    :param link_translations: float[NxLx3] translations of the moving
+    meshes
+    :param body_bvhs: list of S BVH objects of the fixed meshes
+    :param body_rotations: float[Sx3x3] rotations of the fixed meshes
+    :param body_translations: float[Sx3] translations of the fixed meshes
+    :param distances: bool, if True also get the minimum distance of each
+    pose to the fixed meshes
+    :param n_processes: int, if given the poses are split across a pool of
+    this many processes
+    :param body_signed_distances: list of S functions or None, a function
+    takes float[Mx3] points in the coordinates of a fixed mesh and returns
+    float[M] signed distances to its solid (e.g. Box.get_signed_distance),
+    fixed meshes without one use their proxy spheres
+    :param exact: bool, if False the proxies are not refined by the exact
+    mesh tests, a pose is in collision when its proxies touch (which is
+    conservative) and the distances are the signed proxy distances, which
+    are lower bounds of the mesh distances
+    :return: bool[N] mask of the poses in collision, and if distances is
+    True float[N] minimum distances (0.0 in collision, inf without fixed
+    meshes)
+    """
+
+    link_rotations = float_(link_rotations)
+    link_translations = float_(link_translations)
+    n_poses = link_rotations.shape[0]
+
+    # Split the poses across a process pool
+    if n_processes is not None and n_processes > 1 and n_poses > 1:
+        chunks = array_split(arange(n_poses), n_processes)
+        with Pool(n_processes) as pool:
+            results = pool.starmap(check_poses, [
+                (link_bvhs, link_rotations[chunk], link_translations[chunk],
+                 body_bvhs, body_rotations, body_translations, distances,
+                 None, body_signed_distances, exact)
+                for chunk in chunks
+            ])
+        if distances:
+            return concatenate([mask for mask, _ in results]), \
+                concatenate([distance for _, distance in results])
+        return concatenate(results)
+
+    body_rotations = float_(body_rotations).reshape((-1, 3, 3))
+    body_translations = float_(body_translations).reshape((-1, 3))
+    collision = zeros(n_poses, dtype=bool)
+    distance = full(n_poses, inf)
+
+    # World boxes of all poses of all meshes
+    link_lower, link_upper = _world_bounds(
+        link_bvhs, link_rotations, link_translations
+    )
+    body_lower, body_upper = _world_bounds(
+        body_bvhs, body_rotations, body_translations
+    )
+
+    # Broad phase for all poses, link mesh and fixed mesh combinations
+    overlap = ((link_lower[:, :, newaxis] <= body_upper) &
+               (body_lower <= link_upper[:, :, newaxis])).all(axis=3)
+
+    if body_signed_distances is None:
+        body_signed_distances = [None]*len(body_bvhs)
+
+    # Proxy check, then the narrow phase with one tree walk per mesh pair
+    # for the poses where the proxies touch
+    proxy_distance = full(n_poses, inf)
+    for i, link_bvh in enumerate(link_bvhs):
+        for j, body_bvh in enumerate(body_bvhs):
+            if exact or not distances:
+                poses = nonzero(overlap[:, i, j] & ~collision)[0]
+            else:
+                poses = arange(n_poses)
+            if not poses.size:
+                continue
+            signed_distance = _proxy_distance(
+                link_bvh, link_rotations[poses, i],
+                link_translations[poses, i], body_bvh, body_rotations[j],
+                body_translations[j], body_signed_distances[j]
+            )
+            proxy_distance[poses] = minimum(proxy_distance[poses],
+                                            signed_distance)
+            poses = poses[signed_distance <= 0.0]
+            if not exact:
+                collision[poses] = True
+            elif poses.size:
+                rotation, translation = _relative_transforms(
+                    body_rotations[j], body_translations[j],
+                    link_rotations[poses, i], link_translations[poses, i]
+                )
+                collision[poses] = _collide(
+                    body_bvh, link_bvh, rotation, translation
+                )
+    if not distances:
+        return collision
+    if not exact:
+        return collision, proxy_distance
+
+    # Distances of the poses that are not in collision, mesh pairs whose
+    # boxes are further apart than the closest distance so far are skipped
+    distance[collision] = 0.0
+    for i, link_bvh in enumerate(link_bvhs):
+        for j, body_bvh in enumerate(body_bvhs):
+            gap = norm(maximum(0.0, maximum(
+                body_lower[j] - link_upper[:, i],
+                link_lower[:, i] - body_upper[j]
+            )), axis=1)
+            poses = nonzero(gap < distance)[0]
+            if poses.size:
+                rotation, translation = _relative_transforms(
+                    body_rotations[j], body_translations[j],
+                    link_rotations[poses, i], link_translations[poses, i]
+                )
+                distance[poses] = _distance(
+                    body_bvh, link_bvh, rotation, translation,
+                    distance[poses]
+                )
+    return collision, distance
+
+
+def triangles_intersect(triangles_a, triangles_b):
+    """
+    Check pairs of triangles for intersection with the separating axis
+    theorem. The axes tested are the two face normals, the cross products
+    of the edges and, for coplanar triangles, the in plane edge normals.
+    :param triangles_a: float[Nx3x3] first triangle of each pair, one
+    vertex per row
+    :param triangles_b: float[Nx3x3] second triangle of each pair
+    :return: bool[N], True where the triangles intersect or touch
+    """
+
+    # Only pairs with overlapping boxes need the full test
+    lower_a, upper_a = _triangle_bounds(triangles_a)
+    lower_b, upper_b = _triangle_bounds(triangles_b)
+    intersect = ((lower_a <= upper_b + SEPARATION_TOLERANCE) &
+                 (lower_b <= upper_a + SEPARATION_TOLERANCE)).all(axis=1)
+    candidates = nonzero(intersect)[0]
+    intersect[candidates] = _separating_axis_test(
+        triangles_a[candidates], triangles_b[candidates]
+    )
+    return intersect
+
+
+def triangles_distance(triangles_a, triangles_b):
+    """
+    Get the minimum distance between pairs of triangles. For triangles that
+    do not intersect it is the smallest of the vertex to triangle and edge
+    to edge distances.
+    :param triangles_a: float[Nx3x3] first triangle of each pair, one
+    vertex per row
+    :param triangles_b: float[Nx3x3] second triangle of each pair
+    :return: float[N] distances, 0.0 where the triangles intersect
+    """
+
+    n_pairs = triangles_a.shape[0]
+    distance = minimum(
+        _point_triangle_distance(
+            triangles_a.reshape((-1, 3)), repeat(triangles_b, 3, axis=0)
+        ).reshape((n_pairs, 3)).min(axis=1),
+        _point_triangle_distance(
+            triangles_b.reshape((-1, 3)), repeat(triangles_a, 3, axis=0)
+        ).reshape((n_pairs, 3)).min(axis=1),
+    )
+
+    # All 9 combinations of edges
+    start_a = repeat(triangles_a, 3, axis=1)
+    end_a = repeat(roll(triangles_a, -1, axis=1), 3, axis=1)
+    start_b = tile(triangles_b, (1, 3, 1))
+    end_b = tile(roll(triangles_b, -1, axis=1), (1, 3, 1))
+    distance = minimum(distance, _segment_distance(
+        start_a.reshape((-1, 3)), end_a.reshape((-1, 3)),
+        start_b.reshape((-1, 3)), end_b.reshape((-1, 3)),
+    ).reshape((n_pairs, 9)).min(axis=1))
+
+    distance[triangles_intersect(triangles_a, triangles_b)] = 0.0
+    return distance
+
+
+def sweep_and_prune(lower, upper):
+    """
+    Find all pairs of overlapping axis aligned boxes. The boxes are sorted
+    along x and each box is only compared to the boxes that start before
+    it ends.
+    :param lower: float[Nx3] lower corners of the boxes
+    :param upper: float[Nx3] upper corners of the boxes
+    :return: int[Px2] index pairs (i, j) with i < j of overlapping boxes
+    """
+
+    lower = float_(lower).reshape((-1, 3))
+    upper = float_(upper).reshape((-1, 3))
+    order = argsort(lower[:, 0], kind='mergesort')
+    ends = searchsorted(lower[order, 0], upper[order, 0], side='right')
+
+    # Candidate pairs along x, k is compared to sorted boxes k+1:ends[k]
+    n_candidates = (ends - arange(order.size) - 1).clip(0)
+    first = repeat(arange(order.size), n_candidates)
+    offsets = arange(first.size) - repeat(
+        n_candidates.cumsum() - n_candidates, n_candidates
+    )
+    i = order[first]
+    j = order[first + 1 + offsets]
+
+    overlap = ((lower[i] <= upper[j]) & (lower[j] <= upper[i])).all(axis=1)
+    pairs = concatenate((i[overlap, newaxis], j[overlap, newaxis]), axis=1)
+    pairs.sort(axis=1)
+    return pairs
+
+
+def box_signed_distance(points, lower, upper):
+    """
+    Get the signed distances of points to a solid axis aligned box,
+    negative inside the box.
+    :param points: float[Nx3] points
+    :param lower: float[3] lower corner of the box
+    :param upper: float[3] upper corner of the box
+    :return: float[N] signed distances
+    """
+    offset = abs(points - (float_(lower) + float_(upper))/2.0) - \
+        (float_(upper) - float_(lower))/2.0
+    return norm(maximum(offset, 0.0), axis=1) + \
+        minimum(offset.max(axis=1), 0.0)
+
+
+def cylinder_signed_distance(points, height, radius):
+    """
+    Get the signed distances of points to a solid cylinder around the z
+    axis from -height/2 to height/2, negative inside the cylinder.
+    :param points: float[Nx3] points
+    :param height: height of the cylinder
+    :param radius: radius of the cylinder
+    :return: float[N] signed distances
+    """
+    offset = stack((norm(points[:, 0:2], axis=1) - radius,
+                    abs(points[:, 2]) - height/2.0), axis=1)
+    return norm(maximum(offset, 0.0), axis=1) + \
+        minimum(offset.max(axis=1), 0.0)
+
+
+def bodies_collide(body_a, body_b):
+    """
+    Check if the meshes of two GraphicalBody objects intersect at their
+    current transforms. The meshes are only compared when the proxy spheres
+    of body_a touch body_b (its signed distance function if it has one,
+    else its proxy spheres).
+    :param body_a: first GraphicalBody
+    :param body_b: second GraphicalBody
+    :return: bool, True if the bodies intersect
+    """
+    if not (body_a.has_graphics and body_b.has_graphics):
+        return False
+    if _proxy_distance(
+            body_a.bvh, body_a.rotation[newaxis],
+            body_a.translation[:, 0][newaxis], body_b.bvh, body_b.rotation,
+            body_b.translation[:, 0],
+            getattr(body_b, 'get_signed_distance', None))[0] > 0.0:
+        return False
+    return meshes_collide(
+        body_a.bvh, body_a.rotation, body_a.translation[:, 0],
+        body_b.bvh, body_b.rotation, body_b.translation[:, 0]
+    )
+
+
+def _relative_transforms(rotation_a, translation_a, rotations_b,
+                         translations_b):
+    """Get the transforms of many poses of mesh b in the frame of mesh a."""
+    rotations = einsum('ji,njk->nik', rotation_a, rotations_b)
+    translations = dot(translations_b - translation_a, rotation_a)
+    return rotations, translations
+
+
+def _world_bounds(bvhs, rotations, translations):
+    """Get the world boxes of meshes for many poses, the pose arrays have
+    one mesh per entry of their second to last (rotations third to last)
+    axis."""
+    center = stack([bvh.center[0] for bvh in bvhs]) if bvhs \
+        else zeros((0, 3))
+    half_size = stack([bvh.half_size[0] for bvh in bvhs]) if bvhs \
+        else zeros((0, 3))
+    center = einsum('...ij,...j->...i', rotations, center) + translations
+    half_size = einsum('...ij,...j->...i', abs(rotations), half_size)
+    return center - half_size, center + half_size
+
+
+def _proxy_distance(link_bvh, rotations, translations, body_bvh,
+                    body_rotation, body_translation, signed_distance=None):
+    """Get the smallest signed distance between the proxy spheres of many
+    poses of a moving mesh and a fixed mesh, see check_poses."""
+
+    n_poses = rotations.shape[0]
+    if link_bvh.sphere_radii.size == 0 or body_bvh.n_triangles == 0:
+        return full(n_poses, inf)
+    centers = einsum('nij,kj->nki', rotations, link_bvh.sphere_centers) + \
+        translations[:, newaxis]
+
+    if signed_distance is not None:
+        points = dot(centers.reshape((-1, 3)) - body_translation,
+                     body_rotation)
+        distance = signed_distance(points).reshape(centers.shape[0:2]) - \
+            link_bvh.sphere_radii
+    else:
+        body_centers = dot(body_bvh.sphere_centers, body_rotation.T) + \
+            body_translation
+        distance = norm(
+            centers[:, :, newaxis] - body_centers, axis=3
+        ) - link_bvh.sphere_radii[:, newaxis] - body_bvh.sphere_radii
+    return distance.reshape((n_poses, -1)).min(axis=1)
+
+
+def _collide(bvh_a, bvh_b, rotations, translations):
+    """Check many poses of mesh b (in the frame of mesh a) for intersection
+    with mesh a, see meshes_collide."""
+
+    n_poses = rotations.shape[0]
+    collision = zeros(n_poses, dtype=bool)
+    if bvh_a.n_triangles == 0 or bvh_b.n_triangles == 0:
+        return collision
+    abs_rotations = abs(rotations)
+
+    # Walk both trees one level at a time with the node pairs of all poses
+    # at once
+    poses = arange(n_poses)
+    nodes_a = zeros(n_poses, dtype=int)
+    nodes_b = zeros(n_poses, dtype=int)
+    while poses.size:
+
+        # Drop pairs whose boxes do not overlap
+        center = einsum('nij,nj->ni', rotations[poses],
+                        bvh_b.center[nodes_b]) + translations[poses]
+        half_size = einsum('nij,nj->ni', abs_rotations[poses],
+                           bvh_b.half_size[nodes_b])
+        keep = ((center - half_size <= bvh_a.upper[nodes_a]) &
+                (center + half_size >= bvh_a.lower[nodes_a])).all(axis=1)
+        poses, nodes_a, nodes_b = poses[keep], nodes_a[keep], nodes_b[keep]
+
+        # Test the triangles of pairs of leaves
+        leaf_a = bvh_a.is_leaf[nodes_a]
+        leaf_b = bvh_b.is_leaf[nodes_b]
+        leaves = leaf_a & leaf_b
+        if leaves.any():
+            pairs, triangles_a, triangles_b = _leaf_triangle_pairs(
+                bvh_a, nodes_a[leaves], bvh_b, nodes_b[leaves]
+            )
+            pair_poses = poses[leaves][pairs]
+            triangles_b = einsum('nij,nvj->nvi', rotations[pair_poses],
+                                 triangles_b) + \
+                translations[pair_poses, newaxis]
+            collision[pair_poses[
+                triangles_intersect(triangles_a, triangles_b)
+            ]] = True
+
+            # Poses found in collision need no more work
+            keep = ~collision[poses]
+            poses, nodes_a, nodes_b = \
+                poses[keep], nodes_a[keep], nodes_b[keep]
+            leaf_a, leaf_b, leaves = leaf_a[keep], leaf_b[keep], leaves[keep]
+
+        poses, nodes_a, nodes_b = _split_nodes(
+            bvh_a, bvh_b, poses, nodes_a, nodes_b, leaf_a, leaf_b, leaves
+        )
+
+    return collision
+
+
+def _distance(bvh_a, bvh_b, rotations, translations, upper_bound=None):
+    """Get the minimum distance of many poses of mesh b (in the frame of
+    mesh a) to mesh a, see meshes_distance. Poses where the distance is not
+    below upper_bound keep the upper bound."""
+
+    n_poses = rotations.shape[0]
+    distance = full(n_poses, inf) if upper_bound is None \
+        else array(upper_bound, dtype=float)
+    if bvh_a.n_triangles == 0 or bvh_b.n_triangles == 0:
+        return distance
+    abs_rotations = abs(rotations)
+
+    # Branch and bound walk of both trees, pairs of nodes whose boxes are
+    # further apart than the closest distance found so far are dropped
+    poses = arange(n_poses)
+    nodes_a = zeros(n_poses, dtype=int)
+    nodes_b = zeros(n_poses, dtype=int)
+    while poses.size:
+
+        # A vertex of each node gives an upper bound on the distance
+        rotation = rotations[poses]
+        translation = translations[poses]
+        vertex_a = bvh_a.triangles[bvh_a.start[nodes_a], 0]
+        vertex_b = einsum('nij,nj->ni', rotation,
+                          bvh_b.triangles[bvh_b.start[nodes_b], 0]) + \
+            translation
+        minimum.at(distance, poses, norm(vertex_a - vertex_b, axis=1))
+
+        # The distance between the boxes is a lower bound
+        center = einsum('nij,nj->ni', rotation, bvh_b.center[nodes_b]) + \
+            translation
+        half_size = einsum('nij,nj->ni', abs_rotations[poses],
+                           bvh_b.half_size[nodes_b])
+        gap = norm(maximum(0.0, maximum(
+            center - half_size - bvh_a.upper[nodes_a],
+            bvh_a.lower[nodes_a] - center - half_size
+        )), axis=1)
+        keep = gap < distance[poses]
+        poses, nodes_a, nodes_b = poses[keep], nodes_a[keep], nodes_b[keep]
+
+        # Exact distances of the triangles of pairs of leaves
+        leaf_a = bvh_a.is_leaf[nodes_a]
+        leaf_b = bvh_b.is_leaf[nodes_b]
+        leaves = leaf_a & leaf_b
+        if leaves.any():
+            pairs, triangles_a, triangles_b = _leaf_triangle_pairs(
+                bvh_a, nodes_a[leaves], bvh_b, nodes_b[leaves]
+            )
+            pair_poses = poses[leaves][pairs]
+            triangles_b = einsum('nij,nvj->nvi', rotations[pair_poses],
+                                 triangles_b) + \
+                translations[pair_poses, newaxis]
+
+            # Vertex distances tighten the bound, then only triangles whose
+            # boxes are closer than it get the exact distance
+            minimum.at(distance, pair_poses, norm(
+                triangles_a[:, :, newaxis] - triangles_b[:, newaxis], axis=3
+            ).reshape((-1, 9)).min(axis=1))
+            lower_a, upper_a = _triangle_bounds(triangles_a)
+            lower_b, upper_b = _triangle_bounds(triangles_b)
+            gap = norm(maximum(0.0, maximum(lower_b - upper_a,
+                                            lower_a - upper_b)), axis=1)
+            close = nonzero(gap < distance[pair_poses])[0]
+            minimum.at(distance, pair_poses[close], triangles_distance(
+                triangles_a[close], triangles_b[close]
+            ))
+
+        poses, nodes_a, nodes_b = _split_nodes(
+            bvh_a, bvh_b, poses, nodes_a, nodes_b, leaf_a, leaf_b, leaves
+        )
+
+    return distance
+
+
+def _split_nodes(bvh_a, bvh_b, poses, nodes_a, nodes_b, leaf_a, leaf_b,
+                 leaves):
+    """Replace each pair of nodes that are not both leaves by the pairs of
+    the children of its larger node and the other node."""
+    size_a = bvh_a.half_size[nodes_a].max(axis=1)
+    size_b = bvh_b.half_size[nodes_b].max(axis=1)
+    split_a = ~leaves & (leaf_b | (~leaf_a & (size_a >= size_b)))
+    split_b = ~leaves & ~split_a
+    poses = concatenate((repeat(poses[split_a], 2), repeat(poses[split_b], 2)))
+    nodes_a = concatenate((
+        bvh_a.children[nodes_a[split_a]].ravel(),
+        repeat(nodes_a[split_b], 2),
+    ))
+    nodes_b = concatenate((
+        repeat(nodes_b[split_a], 2),
+        bvh_b.children[nodes_b[split_b]].ravel(),
+    ))
+    return poses, nodes_a, nodes_b
+
+
+def _separating_axis_test(triangles_a, triangles_b):
+    """Check pairs of triangles for intersection, see
+    triangles_intersect."""
+
+    edges_a = roll(triangles_a, -1, axis=1) - triangles_a
+    edges_b = roll(triangles_b, -1, axis=1) - triangles_b
+    normal_a = cross(edges_a[:, 0], edges_a[:, 1])
+    normal_b = cross(edges_b[:, 0], edges_b[:, 1])
+    axes = concatenate((
+        normal_a[:, newaxis],
+        normal_b[:, newaxis],
+        cross(edges_a[:, :, newaxis], edges_b[:, newaxis, :]).reshape(
+            (-1, 9, 3)
+        ),
+        cross(normal_a[:, newaxis], edges_a),
+        cross(normal_b[:, newaxis], edges_b),
+    ), axis=1)
+
+    # Zero length axes (parallel edges) never separate the triangles
+    lengths = norm(axes, axis=2)
+    lengths[lengths == 0.0] = 1.0
+    axes /= lengths[:, :, newaxis]
+
+    lower_a, upper_a = _project(axes, triangles_a)
+    lower_b, upper_b = _project(axes, triangles_b)
+    separated = (upper_a < lower_b - SEPARATION_TOLERANCE) | \
+        (upper_b < lower_a - SEPARATION_TOLERANCE)
+    return ~separated.any(axis=1)
+
+
+def _triangle_bounds(triangles):
+    """Get the lower and upper corners of the boxes around triangles."""
+    return minimum(minimum(triangles[:, 0], triangles[:, 1]),
+                   triangles[:, 2]), \
+        maximum(maximum(triangles[:, 0], triangles[:, 1]), triangles[:, 2])
+
+
+def _project(axes, triangles):
+    """Get the interval of the projection of each triangle on each of its
+    axes, float[NxKx3] axes and float[Nx3x3] triangles."""
+    projection = [
+        axes[:, :, 0]*triangles[:, k, 0, newaxis] +
+        axes[:, :, 1]*triangles[:, k, 1, newaxis] +
+        axes[:, :, 2]*triangles[:, k, 2, newaxis]
+        for k in range(3)
+    ]
+    return minimum(minimum(projection[0], projection[1]), projection[2]), \
+        maximum(maximum(projection[0], projection[1]), projection[2])
+
+
+def _point_triangle_distance(points, triangles):
+    """Get the distances of points to triangles, float[Nx3] and
+    float[Nx3x3]."""
+
+    # Inside the triangle the distance is the distance to the plane
+    edge1 = triangles[:, 1] - triangles[:, 0]
+    edge2 = triangles[:, 2] - triangles[:, 0]
+    offset = points - triangles[:, 0]
+    d11 = _dot(edge1, edge1)
+    d12 = _dot(edge1, edge2)
+    d22 = _dot(edge2, edge2)
+    d1 = _dot(offset, edge1)
+    d2 = _dot(offset, edge2)
+    denominator = d11*d22 - d12*d12
+    valid = denominator > 0.0
+    denominator[~valid] = 1.0
+    u = (d22*d1 - d12*d2)/denominator
+    v = (d11*d2 - d12*d1)/denominator
+    inside = valid & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0)
+    distance = norm(offset - u[:, newaxis]*edge1 - v[:, newaxis]*edge2,
+                    axis=1)
+    distance[~inside] = inf
+
+    # Outside it is the distance to the closest edge
+    for k in range(3):
+        distance = minimum(distance, _segment_distance(
+            points, points, triangles[:, k], triangles[:, (k + 1) % 3]
+        ))
+    return distance
+
+
+def _dot(vectors_a, vectors_b):
+    """Get the dot products of pairs of vectors, float[Nx3] arrays."""
+    return vectors_a[:, 0]*vectors_b[:, 0] + \
+        vectors_a[:, 1]*vectors_b[:, 1] + vectors_a[:, 2]*vectors_b[:, 2]
+
+
+def _segment_distance(start_a, end_a, start_b, end_b):
+    """Get the distances between pairs of line segments, all float[Nx3].
+    Segments may have zero length."""
+
+    direction_a = end_a - start_a
+    direction_b = end_b - start_b
+    offset = start_a - start_b
+    a = _dot(direction_a, direction_a)
+    b = _dot(direction_a, direction_b)
+    c = _dot(direction_a, offset)
+    e = _dot(direction_b, direction_b)
+    f = _dot(direction_b, offset)
+    a_safe = where(a > 0.0, a, 1.0)
+    e_safe = where(e > 0.0, e, 1.0)
+
+    # Closest point of the infinite lines, clamped to segment a (s = 0 for
+    # parallel segments), then the matching point of segment b
+    denominator = a*e - b*b
+    s = where(denominator > 0.0,
+              ((b*f - c*e)/where(denominator > 0.0, denominator, 1.0)).clip(
+                  0.0, 1.0),
+              where(e > 0.0, 0.0, (-c/a_safe).clip(0.0, 1.0)))
+    t = where(e > 0.0, (b*s + f)/e_safe, 0.0)
+
+    # If the point on b is outside the segment clamp it and recompute s
+    s = where(t < 0.0, (-c/a_safe).clip(0.0, 1.0),
+              where(t > 1.0, ((b - c)/a_safe).clip(0.0, 1.0), s))
+    s = where(a > 0.0, s, 0.0)
+    t = t.clip(0.0, 1.0)
+
+    return norm(offset + s[:, newaxis]*direction_a -
+                t[:, newaxis]*direction_b, axis=1)
+
+
+def _leaf_triangle_pairs(bvh_a, leaves_a, bvh_b, leaves_b):
+    """Get all combinations of the triangles of pairs of leaves, with the
+    index of the leaf pair of each combination."""
+
+    # Each leaf pair is expanded to a leaf_size_a x leaf_size_b grid and
+    # the slots past the end of a leaf are dropped
+    k_a = arange(bvh_a.leaf_size)[newaxis, :, newaxis]
+    k_b = arange(bvh_b.leaf_size)[newaxis, newaxis, :]
+    shape = (leaves_a.size, bvh_a.leaf_size, bvh_b.leaf_size)
+    valid = broadcast_to(k_a < bvh_a.count[leaves_a, newaxis, newaxis],
+                         shape) & \
+        broadcast_to(k_b < bvh_b.count[leaves_b, newaxis, newaxis], shape)
+    index_a = broadcast_to(bvh_a.start[leaves_a, newaxis, newaxis] + k_a,
+                           shape)[valid]
+    index_b = broadcast_to(bvh_b.start[leaves_b, newaxis, newaxis] + k_b,
+                           shape)[valid]
+    pairs = broadcast_to(arange(leaves_a.size)[:, newaxis, newaxis],
+                         shape)[valid]
+    return pairs, bvh_a.triangles[index_a], bvh_b.triangles[index_b]
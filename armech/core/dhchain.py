@@ -0,0 +1,141 @@
+# dhchain.py
+#
+# Structure of arrays storage for the Denavit-Hartenberg parameters and mass
+# properties of a chain of links. A SerialLink keeps the parameters of all its
+# links in contiguous [num_links] arrays and its LinkDH objects read and write
+# their own row, so the kinematics and dynamics kernels work on whole arrays
+# instead of looping over link objects.
+
+from numpy import zeros, empty, float_, cos, sin, asarray, identity
+
+from armech.config import JOINT_REVOLUTE, JOINT_PRISMATIC
+
+# Constant rows of the state transforms
+IDENTITY = identity(4)
+
+
+class DHChain:
+
+    def __init__(self, n_links):
+        """Storage for the DH parameters of n_links links, see set_link.
+
+        Args:
+            n_links: number of links in the chain
+        """
+
+        self.n_links = n_links
+        self.joint_types = zeros(n_links, dtype=int)
+        self.revolute = zeros(n_links, dtype=bool)
+        self.a = zeros(n_links)
+        self.alpha = zeros(n_links)
+        self.d = zeros(n_links)
+        self.theta = zeros(n_links)
+        self.cos_alpha = zeros(n_links)
+        self.sin_alpha = zeros(n_links)
+        self.cos_theta = zeros(n_links)
+        self.sin_theta = zeros(n_links)
+        self.joint_limits = zeros((n_links, 2))
+        self.body_transforms = zeros((n_links, 4, 4))
+
+        # Mass properties in the link body frames (see
+        # RigidBody.set_physics), only valid where has_physics is True
+        self.has_physics = zeros(n_links, dtype=bool)
+        self.masses = zeros(n_links)
+        self.centers_of_mass = zeros((n_links, 3))
+        self.inertias = zeros((n_links, 3, 3))
+
+    def set_link(self, index, joint_type, a, alpha, d, theta):
+        """Set the DH parameters of one link and update the values that
+        depend on them.
+
+        Args:
+            index: index of the link in the chain
+            joint_type: config.JOINT_REVOLUTE or config.JOINT_PRISMATIC
+            a: the distance from z(i) to z(i+1) measured along x(i) (meters)
+            alpha: the angle from z(i) to z(i+1) measured about x(i)
+                   (radians)
+            d: the distance from x(i-1) to x(i) measured along z(i) (meters)
+            theta: the angle from x(i-1) to x(i) measured about z(i)
+                   (radians)
+        """
+
+        if joint_type not in (JOINT_REVOLUTE, JOINT_PRISMATIC):
+            raise ValueError(
+                'type must be either constants.JOINT_REVOLUTE or '
+                'constants.JOINT_PRISMATIC'
+            )
+        self.joint_types[index] = joint_type
+        self.revolute[index] = joint_type == JOINT_REVOLUTE
+        self.a[index] = a
+        self.alpha[index] = alpha
+        self.d[index] = d
+        self.theta[index] = theta
+        self.cos_alpha[index] = cos(alpha)
+        self.sin_alpha[index] = sin(alpha)
+        self.cos_theta[index] = cos(theta)
+        self.sin_theta[index] = sin(theta)
+        self.body_transforms[index] = float_([
+            [1.0, 0.0, 0.0, a],
+            [0.0, self.cos_alpha[index], -self.sin_alpha[index], 0.0],
+            [0.0, self.sin_alpha[index], self.cos_alpha[index], 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ])
+
+    def get_link_transforms(self, q, out=None, state_out=None, index=None):
+        """Calculate the link transforms state_transform(q)*body_transform
+        of all links in closed form (see calc/link_tform_matrix.py).
+
+        Args:
+            q: [n_links] or [N x n_links] float array of general coordinates
+            out: [... x n_links x 4 x 4] float array to write the link
+                 transforms to
+            state_out: optional [... x n_links x 4 x 4] float array to write
+                       the state transforms (the links' body frames) to
+            index: optional index of a single link to calculate, q and the
+                   outputs then have no link axis (see
+                   LinkDH.get_link_transform)
+
+        Returns:
+            out, where element [..., k] is the transform from the end of
+            link k-1 to the end of link k
+        """
+
+        q = asarray(q, dtype=float)
+        if out is None:
+            out = empty(q.shape + (4, 4))
+        if index is None:
+            index = slice(None)
+
+        # Joint dependant values, q turns revolute joints about z and moves
+        # prismatic joints along z
+        revolute = self.revolute[index]
+        angle = self.theta[index] + q*revolute
+        c = cos(angle)
+        s = sin(angle)
+        d = self.d[index] + q*~revolute
+        ca = self.cos_alpha[index]
+        sa = self.sin_alpha[index]
+
+        # Write the closed form transforms, the last two rows are the ones
+        # of the body transform except for d
+        out[..., 0, 0] = c
+        out[..., 0, 1] = s*ca
+        out[..., 0, 2] = -s*sa
+        out[..., 0, 3] = self.a[index]*c
+        out[..., 1, 0] = -s
+        out[..., 1, 1] = c*ca
+        out[..., 1, 2] = -c*sa
+        out[..., 1, 3] = -self.a[index]*s
+        out[..., 2:4, :] = self.body_transforms[index, 2:4]
+        out[..., 2, 3] = d
+
+        if state_out is not None:
+            state_out[..., 0, 0] = c
+            state_out[..., 0, 1] = s
+            state_out[..., 1, 0] = -s
+            state_out[..., 1, 1] = c
+            state_out[..., 0:2, 2:4] = 0.0
+            state_out[..., 2:4, :] = IDENTITY[2:4]
+            state_out[..., 2, 3] = d
+
+        return out
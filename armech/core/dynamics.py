@@ -0,0 +1,235 @@
+# dynamics.py
+#
+# Rigid body dynamics of SerialLink robots using the mass properties of the
+# links (see RigidBody.set_physics). All functions work on batches of states
+# so whole trajectories can be evaluated in one call.
+
+from numpy import float_, zeros, ones, cross, matmul, swapaxes, einsum, \
+    broadcast_to, empty, identity, where, diff, triu
+from numpy.linalg import cholesky, LinAlgError
+
+from armech.config import GRAVITY
+
+
+def get_mass_properties(robot):
+    """Get the mass properties of the links of a robot from its chain. Links
+    without physics are treated as massless.
+
+    Args:
+        robot: SerialLink object
+
+    Returns: [num_links] masses, [num_links x 3] centers of mass in the link
+             body frames and [num_links x 3 x 3] inertia matrices about the
+             centers of mass in the link body frames
+    """
+    chain = robot.chain
+    physics = chain.has_physics
+    return (where(physics, chain.masses, 0.0),
+            where(physics[:, None], chain.centers_of_mass, 0.0),
+            where(physics[:, None, None], chain.inertias, 0.0))
+
+
+def get_joint_frames(robot, q):
+    """Get the link frames and joint axes of a batch of states in global
+    coordinates.
+
+    Args:
+        robot: SerialLink object
+        q: [N x num_links] joint positions
+
+    Returns: [N x num_links x 3 x 3] link rotations, [N x num_links x 3] link
+             origins and [N x num_links x 3] joint axes
+    """
+    _, frames = robot.get_tool_trans_batch(q, local=False, link_frames=True)
+    # A revolute joint rotates about the negative z axis of its frame, a
+    # prismatic joint slides along the positive z axis
+    axes = frames[..., 0:3, 2]*(1.0 - 2.0*robot.revolute)[:, None]
+    return frames[..., 0:3, 0:3], frames[..., 0:3, 3], axes
+
+
+def inverse_dynamics(robot, q, qd, qdd, gravity=GRAVITY, frames=None):
+    """Calculate the joint torques (forces for prismatic joints) needed for
+    the given joint accelerations with the recursive Newton-Euler algorithm.
+    In global coordinates both recursions are sums along the chain, so they
+    are cumulative sums over the link axis of all states at once.
+
+    Args:
+        robot: SerialLink object
+        q: [N x num_links] joint positions
+        qd: [N x num_links] joint velocities
+        qdd: [N x num_links] joint accelerations
+        gravity: 3 element gravitational acceleration in global coordinates
+        frames: optional result of get_joint_frames for q
+
+    Returns: [N x num_links] float array of joint torques
+    """
+
+    # Check inputs
+    q = robot.check_q_batch(q)
+    qd = broadcast_to(robot.check_q_batch(qd), q.shape)
+    qdd = broadcast_to(robot.check_q_batch(qdd), q.shape)
+    masses, centers, inertias = get_mass_properties(robot)
+    if frames is None:
+        frames = get_joint_frames(robot, q)
+    rotations, origins, axes = frames
+    revolute = robot.revolute[:, None]
+    prismatic = ~revolute
+
+    # Forward recursion: angular velocities and accelerations after each
+    # joint (w, wd) and before it (w_in, wd_in)
+    rate = axes*(qd[..., None]*revolute)
+    w = rate.cumsum(axis=1)
+    w_in = w - rate
+    wd_step = axes*(qdd[..., None]*revolute) + cross(w_in, rate)
+    wd = wd_step.cumsum(axis=1)
+    wd_in = wd - wd_step
+
+    # Accelerations of the link origins as points of the previous links,
+    # the base is accelerated upwards to account for gravity
+    base = broadcast_to(robot.global_translation.reshape(3),
+                        (q.shape[0], 1, 3))
+    r = diff(origins, axis=1, prepend=base)
+    slide = axes*qd[..., None]
+    a = (cross(wd_in, r) + cross(w_in, cross(w_in, r)) +
+         prismatic*(axes*qdd[..., None] + 2.0*cross(w_in, slide)))
+    a = a.cumsum(axis=1) - float_(gravity)
+
+    # Inertial forces and moments of the links about their centers of mass
+    offsets = einsum('nkij,kj->nki', rotations, centers)
+    a_centers = a + cross(wd, offsets) + cross(w, cross(w, offsets))
+    inertia = matmul(matmul(rotations, inertias), swapaxes(rotations, -1, -2))
+    forces = masses[:, None]*a_centers
+    moments = einsum('nkij,nkj->nki', inertia, wd) + \
+        cross(w, einsum('nkij,nkj->nki', inertia, w))
+
+    # Backward recursion: the force and the moment about the global origin
+    # transmitted through joint k are sums over the links k..n, the moment
+    # is then moved to the joint origin
+    f = forces[:, ::-1].cumsum(axis=1)[:, ::-1]
+    n = (moments + cross(origins + offsets, forces))[:, ::-1].cumsum(
+        axis=1
+    )[:, ::-1] - cross(origins, f)
+    return where(robot.revolute, (axes*n).sum(axis=2), (axes*f).sum(axis=2))
+
+
+def gravity_torques(robot, q, gravity=GRAVITY):
+    """Get the joint torques needed to hold the robot still against gravity.
+
+    Args:
+        robot: SerialLink object
+        q: [N x num_links] joint positions
+        gravity: 3 element gravitational acceleration in global coordinates
+
+    Returns: [N x num_links] float array of joint torques
+    """
+    q = robot.check_q_batch(q)
+    still = zeros(q.shape)
+    return inverse_dynamics(robot, q, still, still, gravity)
+
+
+def mass_matrix(robot, q, frames=None):
+    """Calculate the joint space mass matrix with the composite rigid body
+    algorithm. Spatial inertias and joint motion vectors are expressed about
+    the global origin, so the composite inertia of the links k..n is a plain
+    sum and M[i, j] = s_i' * I_composite[max(i, j)] * s_j.
+
+    Args:
+        robot: SerialLink object
+        q: [N x num_links] joint positions
+        frames: optional result of get_joint_frames for q
+
+    Returns: [N x num_links x num_links] float array of mass matrices
+    """
+
+    q = robot.check_q_batch(q)
+    n_states = q.shape[0]
+    masses, centers, inertias = get_mass_properties(robot)
+    if frames is None:
+        frames = get_joint_frames(robot, q)
+    rotations, origins, axes = frames
+
+    # Spatial inertia [[Ic + m*S*S', m*S], [m*S', m*1]] of each link about
+    # the global origin, where S is the cross product matrix of the center
+    spatial = zeros((n_states, robot.num_links, 6, 6))
+    center = matmul(rotations, centers[:, :, None])[..., 0] + origins
+    skew = zeros((n_states, robot.num_links, 3, 3))
+    skew[..., 0, 1] = -center[..., 2]
+    skew[..., 0, 2] = center[..., 1]
+    skew[..., 1, 0] = center[..., 2]
+    skew[..., 1, 2] = -center[..., 0]
+    skew[..., 2, 0] = -center[..., 1]
+    skew[..., 2, 1] = center[..., 0]
+    mass_skew = masses[:, None, None]*skew
+    spatial[..., 0:3, 0:3] = matmul(
+        matmul(rotations, inertias), swapaxes(rotations, -1, -2)
+    ) - matmul(mass_skew, skew)
+    spatial[..., 0:3, 3:6] = mass_skew
+    spatial[..., 3:6, 0:3] = swapaxes(mass_skew, -1, -2)
+    spatial[..., 3:6, 3:6] = masses[:, None, None]*identity(3)
+
+    # Composite inertias of the links k..n
+    composite = spatial[:, ::-1].cumsum(axis=1)[:, ::-1]
+
+    # Joint motion vectors (w, v) about the global origin
+    motion = zeros((n_states, robot.num_links, 6))
+    revolute = robot.revolute[:, None]
+    motion[..., 0:3] = axes*revolute
+    motion[..., 3:6] = (cross(origins, axes)*revolute) + axes*(~revolute)
+
+    # Assemble the symmetric mass matrix, element [i, j] with i <= j is the
+    # motion of joint i times the force of composite j moved by joint j
+    force = einsum('nkij,nkj->nki', composite, motion)
+    upper = einsum('nia,nja->nij', motion, force)
+    return where(triu(ones((robot.num_links, robot.num_links), dtype=bool)),
+                 upper, swapaxes(upper, 1, 2))
+
+
+def forward_dynamics(robot, q, qd, torques, gravity=GRAVITY):
+    """Calculate the joint accelerations produced by joint torques. Solves
+    M(q)*qdd = torques - h(q, qd) with a Cholesky factorization of the mass
+    matrix, h is found with inverse_dynamics for zero acceleration.
+
+    Args:
+        robot: SerialLink object
+        q: [N x num_links] joint positions
+        qd: [N x num_links] joint velocities
+        torques: [N x num_links] joint torques
+        gravity: 3 element gravitational acceleration in global coordinates
+
+    Returns: [N x num_links] float array of joint accelerations
+    """
+    q = robot.check_q_batch(q)
+    frames = get_joint_frames(robot, q)
+    bias = inverse_dynamics(robot, q, qd, zeros(q.shape), gravity, frames)
+    try:
+        lower = cholesky(mass_matrix(robot, q, frames))
+    except LinAlgError:
+        raise ValueError(
+            'The mass matrix is singular, the links need mass properties '
+            '(see RigidBody.set_physics)'
+        )
+    return cholesky_solve(
+        lower, broadcast_to(robot.check_q_batch(torques), q.shape) - bias
+    )
+
+
+def cholesky_solve(lower, b):
+    """Solve a batch of systems (L*L')*x = b by forward and back
+    substitution.
+
+    Args:
+        lower: [N x n x n] float array of lower triangular Cholesky factors
+        b: [N x n] float array of right hand sides
+
+    Returns: [N x n] float array of solutions
+    """
+    n = b.shape[1]
+    y = empty(b.shape)
+    for i in range(n):
+        y[:, i] = (b[:, i] - einsum('nj,nj->n', lower[:, i, 0:i], y[:, 0:i])) \
+            / lower[:, i, i]
+    x = empty(b.shape)
+    for i in reversed(range(n)):
+        x[:, i] = (y[:, i] - einsum('nj,nj->n', lower[:, i + 1:, i],
+                                    x[:, i + 1:])) / lower[:, i, i]
+    return x
@@ -0,0 +1,257 @@
+# ikine.py
+#
+# Numerical inverse kinematics for SerialLink robots. Uses a damped least
+# squares (Levenberg-Marquardt) iteration on the geometric jacobian. Many
+# targets and many random starting points per target are solved at once as
+# one batch, and solutions can be warm started from a previous solution when
+# tracking a trajectory.
+
+from numpy import float_, ones, full, eye, where, clip, mod, pi, \
+    swapaxes, matmul, repeat, arange, argmin, inf, broadcast_to, nonzero
+from numpy.linalg import solve
+from numpy.random import RandomState
+
+from armech.core.transforms import pose_error, inverse_transform
+
+
+class IKSolver:
+
+    def __init__(self, robot, mask=None, tolerance=1e-6, max_iterations=100,
+                 damping=1e-2, n_seeds=8, random_seed=None):
+        """Numerical inverse kinematics solver for a SerialLink robot.
+
+        Args:
+            robot: SerialLink object to solve for
+            mask: 6 element array weighting the [x, y, z, rx, ry, rz] pose
+                  error, e.g. (1, 1, 1, 0, 0, 0) to only solve for the tool
+                  position. Defaults to the full pose for robots with 6 or
+                  more links and to the position for smaller robots.
+            tolerance: norm of the weighted pose error at which a solution is
+                       accepted
+            max_iterations: maximum number of iterations per solve
+            damping: initial damping factor of the least squares steps
+            n_seeds: number of starting points tried for each target
+            random_seed: seed for the random starting points
+        """
+
+        self.robot = robot
+        if mask is None:
+            if robot.num_links >= 6:
+                mask = ones(6)
+            else:
+                mask = (1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+        self.mask = float_(mask).reshape(6)
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.damping = damping
+        self.n_seeds = n_seeds
+        self.random_state = RandomState(random_seed)
+
+        # Joint properties
+        self.joint_limits = robot.get_joint_limits()
+        # Revolute joints that can turn all the way around are wrapped
+        # instead of clipped
+        self.wrap = robot.revolute & (
+            self.joint_limits[:, 1] - self.joint_limits[:, 0] >= 2*pi - 1e-9
+        )
+
+    def solve(self, targets, q0=None, n_seeds=None, local=True):
+        """Solve the inverse kinematics for one or many target transforms.
+
+        Args:
+            targets: [4x4] or [N x 4 x 4] array of desired tool transforms
+            q0: optional state vector or [N x num_links] array of states to
+                use as the first starting point (warm start), solutions that
+                are closest to q0 are preferred
+            n_seeds: number of starting points per target, defaults to the
+                     n_seeds of the solver
+            local: bool, if False the targets are given in global coordinates
+
+        Returns: the solved state vectors ([num_links] or
+                 [N x num_links]) and a bool (array) that is True where the
+                 solution is within tolerance
+        """
+
+        # Format the targets
+        targets = float_(targets)
+        single = targets.ndim == 2
+        targets = targets.reshape((-1, 4, 4))
+        if not local:
+            targets = matmul(
+                inverse_transform(self.robot.global_transform()), targets
+            )
+        n_targets = targets.shape[0]
+        if n_seeds is None:
+            n_seeds = self.n_seeds
+
+        # Get starting points, the warm start (if any) is tried first
+        seeds = self.get_seeds(n_targets*n_seeds).reshape(
+            (n_targets, n_seeds, self.robot.num_links)
+        )
+        if q0 is not None:
+            q0 = broadcast_to(
+                float_(q0).reshape((-1, self.robot.num_links)),
+                (n_targets, self.robot.num_links)
+            )
+            seeds[:, 0] = q0
+
+        # Solve all problems as one batch
+        q, cost = self.refine(
+            repeat(targets, n_seeds, axis=0),
+            seeds.reshape((-1, self.robot.num_links)),
+            group=n_seeds
+        )
+        q = q.reshape(seeds.shape)
+        cost = cost.reshape((n_targets, n_seeds))
+
+        # Pick the best solution for each target, preferring the solution
+        # closest to q0 among the ones within tolerance
+        success = cost <= self.tolerance**2
+        if q0 is not None:
+            score = ((q - q0[:, None])**2).sum(axis=-1)
+            score = where(success, score, inf)
+            score[~success.any(axis=1)] = cost[~success.any(axis=1)]
+        else:
+            score = cost
+        best = argmin(score, axis=1)
+        q = q[arange(n_targets), best]
+        success = success[arange(n_targets), best]
+
+        if single:
+            return q[0], bool(success[0])
+        return q, success
+
+    def track(self, targets, q0=None, local=True):
+        """Solve a sequence of targets, warm starting each solve from the
+        previous solution. Falls back to a multi start solve when the warm
+        start does not converge. Solutions are generated as they are needed.
+
+        Args:
+            targets: iterable of [4x4] desired tool transforms
+            q0: optional state vector to start from
+            local: bool, if False the targets are given in global coordinates
+
+        Yields: tuples of the state vector and a bool that is True if the
+                solution is within tolerance
+        """
+
+        q = None if q0 is None else float_(q0).reshape(self.robot.num_links)
+        for target in targets:
+            target = float_(target).reshape((1, 4, 4))
+            if not local:
+                target = matmul(
+                    inverse_transform(self.robot.global_transform()), target
+                )
+            success = False
+            if q is not None:
+                q_new, cost = self.refine(target, q[None])
+                success = cost[0] <= self.tolerance**2
+                q_new = q_new[0]
+            if not success:
+                q_new, success = self.solve(target[0], q0=q)
+            q = q_new
+            yield q.copy(), bool(success)
+
+    def get_seeds(self, n_seeds):
+        """Get random state vectors within the joint limits.
+
+        Args:
+            n_seeds: number of state vectors
+
+        Returns: [n_seeds x num_links] float array
+        """
+        return self.random_state.uniform(
+            self.joint_limits[:, 0], self.joint_limits[:, 1],
+            (n_seeds, self.robot.num_links)
+        )
+
+    def limit(self, q):
+        """Apply the joint limits to state vectors. Joints that can turn all
+        the way around are wrapped, all other joints are clipped.
+
+        Args:
+            q: [N x num_links] float array of state vectors
+
+        Returns: [N x num_links] float array of limited state vectors
+        """
+        lower = self.joint_limits[:, 0]
+        upper = self.joint_limits[:, 1]
+        return where(
+            self.wrap, lower + mod(q - lower, 2*pi), clip(q, lower, upper)
+        )
+
+    def refine(self, targets, q, group=1):
+        """Run the damped least squares iteration on a batch of problems.
+
+        Args:
+            targets: [N x 4 x 4] float array of desired tool transforms
+            q: [N x num_links] float array of starting points
+            group: number of consecutive problems that belong to the same
+                   target, once one of them converges the others are stopped
+
+        Returns: [N x num_links] array of state vectors and [N] array of the
+                 squared weighted pose errors
+        """
+
+        n_problems, n_links = q.shape
+        tolerance = self.tolerance**2
+        identity = eye(n_links)
+
+        # Initial errors and jacobians
+        q = self.limit(q)
+        error, cost, jacobian = self.evaluate(targets, q)
+        damping = full(n_problems, self.damping)
+        active = cost > tolerance
+
+        for _ in range(self.max_iterations):
+            if group > 1:
+                done = (cost <= tolerance).reshape((-1, group)).any(axis=1)
+                active &= ~repeat(done, group)
+            index = nonzero(active)[0]
+            if index.shape[0] == 0:
+                break
+
+            # Damped least squares step
+            weighted = self.mask[:, None]*jacobian[index]
+            transposed = swapaxes(weighted, 1, 2)
+            step = solve(
+                matmul(transposed, weighted) +
+                damping[index, None, None]*identity,
+                matmul(transposed, error[index][..., None])
+            )[..., 0]
+            q_new = self.limit(q[index] + step)
+            error_new, cost_new, jacobian_new = self.evaluate(
+                targets[index], q_new
+            )
+
+            # Accept steps that reduce the error and relax their damping,
+            # increase the damping of the others
+            better = cost_new < cost[index]
+            accepted = index[better]
+            q[accepted] = q_new[better]
+            error[accepted] = error_new[better]
+            cost[accepted] = cost_new[better]
+            jacobian[accepted] = jacobian_new[better]
+            damping[accepted] = clip(damping[accepted]*0.3, 1e-9, None)
+            damping[index[~better]] *= 4.0
+
+            # Stop problems that converged or can not make progress
+            active[index] = (cost[index] > tolerance) & \
+                (damping[index] < 1e9)
+
+        return q, cost
+
+    def evaluate(self, targets, q):
+        """Get the weighted pose errors and jacobians of a batch of states.
+
+        Args:
+            targets: [N x 4 x 4] float array of desired tool transforms
+            q: [N x num_links] float array of state vectors
+
+        Returns: [N x 6] weighted errors, [N] squared error norms and
+                 [N x 6 x num_links] jacobians
+        """
+        jacobian, tools = self.robot.get_jacobian_batch(q)
+        error = self.mask*pose_error(targets, tools)
+        cost = (error**2).sum(axis=-1)
+        return error, cost, jacobian
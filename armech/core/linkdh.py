@@ -4,9 +4,11 @@
 # link in a serial link robot described by Denavit-Hartenberg (DH) parameters
 #
 
-from numpy import float_, cos, sin
+from numpy import float_, cos, sin, asarray
 
-from armech.config import JOINT_REVOLUTE, JOINT_PRISMATIC
+from armech.config import JOINT_REVOLUTE, JOINT_PRISMATIC, \
+    JOINT_LIMITS_REVOLUTE, JOINT_LIMITS_PRISMATIC
+from armech.core.dhchain import DHChain
 from armech.core.rigidbody import RigidBody
 
 
@@ -14,7 +16,8 @@ from armech.core.rigidbody import RigidBody
 
 class LinkDH(RigidBody):
 
-    def __init__(self, joint_type, a=0.0, alpha=0.0, d=0.0, theta=0.0):
+    def __init__(self, joint_type, a=0.0, alpha=0.0, d=0.0, theta=0.0,
+                 joint_limits=None):
         """
         A link in a serial chain robot described by Denavit-Hartenberg (DH)
         parameters.
@@ -24,34 +27,174 @@ class LinkDH(RigidBody):
         :param theta: the angle from x(i-1) to x(i) measured about z(i) (radians)
         :param joint_type: type of joint connecting the link, either
         armech.constants.REVOLUTE_JOINT or PRISMATIC_JOINT
+        :param joint_limits: (lower, upper) limits of the general coordinate,
+        defaults to config.JOINT_LIMITS_REVOLUTE or JOINT_LIMITS_PRISMATIC
         :return: A Link object
         """
 
+        # The DH parameters and mass properties live in a chain of one link
+        # until the link is added to a SerialLink, see attach
+        self.chain = DHChain(1)
+        self.index = 0
+
         # Initialize Graphical Body
         super(LinkDH, self).__init__()
 
-        # Initialize values
-        self.joint_type = joint_type
-        self.a = float_(a)
-        self.alpha = float_(alpha)
-        self.d = float_(d)
-        self.theta = float_(theta)
-        self.body_transform = float_([
-            [1.0,             0.0,              0.0, self.a],
-            [0.0, cos(self.alpha), -sin(self.alpha),    0.0],
-            [0.0, sin(self.alpha),  cos(self.alpha),    0.0],
-            [0.0,             0.0,              0.0,    1.0],
-        ])
-        self.state_transform = self.get_state_transform()
         if joint_type == JOINT_REVOLUTE:
             self.joint_type_str = 'Revolute Joint'
+            default_limits = JOINT_LIMITS_REVOLUTE
         elif joint_type == JOINT_PRISMATIC:
             self.joint_type_str = 'Prismatic Joint'
+            default_limits = JOINT_LIMITS_PRISMATIC
         else:
             raise ValueError(
                 'type must be either constants.JOINT_REVOLUTE or '
                 'constants.JOINT_PRISMATIC'
             )
+        self.chain.set_link(0, joint_type, a, alpha, d, theta)
+        if joint_limits is None:
+            joint_limits = default_limits
+        self.joint_limits = joint_limits
+
+    def attach(self, chain, index):
+        """
+        Move the parameters of the link into a row of a chain, from then on
+        the link is a view onto that row. SerialLink attaches its links to
+        its own chain.
+
+        Args:
+            chain: DHChain object
+            index: row of the chain for this link
+        """
+        chain.set_link(index, self.joint_type, self.a, self.alpha, self.d,
+                       self.theta)
+        chain.joint_limits[index] = self.joint_limits
+        chain.has_physics[index] = self.has_physics
+        chain.masses[index] = self.mass
+        chain.centers_of_mass[index] = self.center_of_mass[:, 0]
+        chain.inertias[index] = self.inertia_matrix
+        self.chain = chain
+        self.index = index
+
+    def _set_parameter(self, name, value):
+        """Change one DH parameter in the chain."""
+        parameters = {'a': self.a, 'alpha': self.alpha, 'd': self.d,
+                      'theta': self.theta}
+        parameters[name] = value
+        self.chain.set_link(self.index, self.joint_type, **parameters)
+
+    @property
+    def joint_type(self):
+        """config.JOINT_REVOLUTE or config.JOINT_PRISMATIC"""
+        return int(self.chain.joint_types[self.index])
+
+    @property
+    def a(self):
+        """the distance from z(i) to z(i+1) measured along x(i) (meters)"""
+        return self.chain.a[self.index]
+
+    @a.setter
+    def a(self, value):
+        self._set_parameter('a', value)
+
+    @property
+    def alpha(self):
+        """the angle from z(i) to z(i+1) measured about x(i) (radians)"""
+        return self.chain.alpha[self.index]
+
+    @alpha.setter
+    def alpha(self, value):
+        self._set_parameter('alpha', value)
+
+    @property
+    def d(self):
+        """the distance from x(i-1) to x(i) measured along z(i) (meters)"""
+        return self.chain.d[self.index]
+
+    @d.setter
+    def d(self, value):
+        self._set_parameter('d', value)
+
+    @property
+    def theta(self):
+        """the angle from x(i-1) to x(i) measured about z(i) (radians)"""
+        return self.chain.theta[self.index]
+
+    @theta.setter
+    def theta(self, value):
+        self._set_parameter('theta', value)
+
+    @property
+    def cos_alpha(self):
+        return self.chain.cos_alpha[self.index]
+
+    @property
+    def sin_alpha(self):
+        return self.chain.sin_alpha[self.index]
+
+    @property
+    def cos_theta(self):
+        return self.chain.cos_theta[self.index]
+
+    @property
+    def sin_theta(self):
+        return self.chain.sin_theta[self.index]
+
+    @property
+    def joint_limits(self):
+        """[2] view of the (lower, upper) limits of the general coordinate"""
+        return self.chain.joint_limits[self.index]
+
+    @joint_limits.setter
+    def joint_limits(self, value):
+        self.chain.joint_limits[self.index] = float_(value).reshape(2)
+
+    @property
+    def has_physics(self):
+        """bool, True once the mass properties are set"""
+        return bool(self.chain.has_physics[self.index])
+
+    @has_physics.setter
+    def has_physics(self, value):
+        self.chain.has_physics[self.index] = value
+
+    @property
+    def mass(self):
+        """mass of the link (kg)"""
+        return self.chain.masses[self.index]
+
+    @mass.setter
+    def mass(self, value):
+        self.chain.masses[self.index] = value
+
+    @property
+    def center_of_mass(self):
+        """[3x1] view of the center of mass in the link body frame"""
+        return self.chain.centers_of_mass[self.index][:, None]
+
+    @center_of_mass.setter
+    def center_of_mass(self, value):
+        self.chain.centers_of_mass[self.index] = float_(value).reshape(3)
+
+    @property
+    def inertia_matrix(self):
+        """[3x3] view of the inertia matrix about the center of mass"""
+        return self.chain.inertias[self.index]
+
+    @inertia_matrix.setter
+    def inertia_matrix(self, value):
+        self.chain.inertias[self.index] = value
+
+    @property
+    def body_transform(self):
+        """[4x4] view of the constant part of the link transform"""
+        return self.chain.body_transforms[self.index]
+
+    @property
+    def state_transform(self):
+        """function f(q) of the joint dependant part of the link transform,
+        see get_state_transform"""
+        return self.get_state_transform()
 
     def get_state_transform(self):
         """
@@ -82,4 +225,38 @@ class LinkDH(RigidBody):
             raise ValueError(
                 'type must be either constants.JOINT_REVOLUTE or '
                 'constants.JOINT_PRISMATIC'
-            )
\ No newline at end of file
+            )
+
+    def get_link_transform(self, q, out=None, state_out=None):
+        """
+        Calculate the full link transform state_transform(q)*body_transform
+        in closed form, from the row of the link in its chain (see
+        DHChain.get_link_transforms).
+
+        Args:
+            q: float, general coordinate of the link (theta or d)
+            out: [4x4] float array to write the link transform to
+            state_out: optional [4x4] float array to write the state
+                       transform (the link's body frame) to
+
+        Returns:
+            out, the transform from the end of the previous link to the end
+            of this link
+        """
+        return self.chain.get_link_transforms(q, out, state_out, self.index)
+
+    def get_link_transforms(self, q, out=None, state_out=None):
+        """
+        Batched version of get_link_transform for many joint states at once.
+
+        Args:
+            q: [N] float array of general coordinates (theta or d)
+            out: [Nx4x4] float array to write the link transforms to
+            state_out: optional [Nx4x4] float array to write the state
+                       transforms (the link's body frames) to
+
+        Returns:
+            out, where element k is the link transform for q[k]
+        """
+        q = asarray(q, dtype=float).reshape(-1)
+        return self.chain.get_link_transforms(q, out, state_out, self.index)
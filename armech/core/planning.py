@@ -0,0 +1,699 @@
+# planning.py
+#
+# Sampling based motion planning in the joint space of a robot in a
+# Workspace. RRT-Connect answers single queries, the probabilistic roadmap
+# (PRM) is built once and reused for many queries. Roadmap edges are only
+# checked for collisions when a query wants to use them (lazy validation),
+# the roadmap can be saved and loaded, and when bodies are added to or
+# removed from the workspace only the validity of the roadmap is repaired.
+# All collision checks are made on batches of configurations with
+# Workspace.in_collision_batch.
+
+from heapq import heappush, heappop
+
+from numpy import float_, int_, int8, empty, zeros, ones, full, arange, \
+    argsort, argmax, argmin, concatenate, sqrt, ceil, abs, repeat, cumsum, \
+    where, nonzero, minimum, maximum, unique, isin, stack, array, \
+    array_equal, newaxis, inf, load, savez
+from numpy.random import RandomState
+
+# Maximum number of points in a leaf of the KD-tree
+KD_LEAF_SIZE = 16
+
+# Validation states of the roadmap edges
+EDGE_UNKNOWN = 0
+EDGE_FREE = 1
+EDGE_BLOCKED = -1
+
+
+class KDTree:
+
+    def __init__(self, points, leaf_size=KD_LEAF_SIZE):
+        """KD-tree for nearest neighbor queries. Each node splits its points
+        at the median of the dimension with the largest spread.
+
+        Args:
+            points: [N x D] float array of points
+            leaf_size: maximum number of points in a leaf
+        """
+
+        points = float_(points)
+        self.index = arange(points.shape[0])
+
+        # Nodes are (split dimension, split value, left, right, start, end)
+        # tuples, the split dimension of a leaf is -1 and its points are
+        # index[start:end]
+        self.nodes = [(-1, 0.0, -1, -1, 0, points.shape[0])]
+        pending = [0]
+        while pending:
+            node = pending.pop()
+            _, _, _, _, start, end = self.nodes[node]
+            if end - start <= leaf_size:
+                continue
+            node_points = points[self.index[start:end]]
+            spread = node_points.max(axis=0) - node_points.min(axis=0)
+            dimension = int(argmax(spread))
+            if spread[dimension] == 0.0:
+                continue
+            order = argsort(node_points[:, dimension], kind='stable')
+            self.index[start:end] = self.index[start:end][order]
+            middle = (start + end)//2
+            left = len(self.nodes)
+            self.nodes.append((-1, 0.0, -1, -1, start, middle))
+            self.nodes.append((-1, 0.0, -1, -1, middle, end))
+            self.nodes[node] = (
+                dimension, float(node_points[order[middle - start],
+                                             dimension]),
+                left, left + 1, start, end
+            )
+            pending.extend((left, left + 1))
+
+        # Points in tree order, so leaves are contiguous
+        self.points = points[self.index]
+
+    def query(self, points, k=1):
+        """Get the nearest neighbors of points.
+
+        Args:
+            points: [D] or [M x D] float array of query points
+            k: number of neighbors per point
+
+        Returns: [M x k] float array of distances and [M x k] int array of
+                 the indices of the neighbors, both sorted by distance. If
+                 the tree has less than k points the missing neighbors have
+                 an infinite distance and an index of -1.
+        """
+
+        points = float_(points).reshape((-1, self.points.shape[1]))
+        distances = full((points.shape[0], k), inf)
+        indices = full((points.shape[0], k), -1, dtype=int)
+        if self.points.shape[0] == 0:
+            return distances, indices
+
+        for m in range(points.shape[0]):
+            point = points[m]
+            best_distances = full(k, inf)
+            best_indices = full(k, -1, dtype=int)
+
+            # Depth first with the nearer child first, a subtree is skipped
+            # when its side of the splitting plane is farther away than the
+            # k-th nearest point found so far
+            pending = [(0, 0.0)]
+            while pending:
+                node, bound = pending.pop()
+                if bound >= best_distances[-1]:
+                    continue
+                dimension, value, left, right, start, end = self.nodes[node]
+                if dimension < 0:
+                    candidates = concatenate((
+                        best_distances,
+                        ((self.points[start:end] - point)**2).sum(axis=1)
+                    ))
+                    order = argsort(candidates, kind='stable')[0:k]
+                    best_distances = candidates[order]
+                    best_indices = concatenate((
+                        best_indices, arange(start, end)
+                    ))[order]
+                    continue
+                offset = point[dimension] - value
+                if offset < 0.0:
+                    near, far = left, right
+                else:
+                    near, far = right, left
+                pending.append((far, max(bound, offset*offset)))
+                pending.append((near, bound))
+
+            distances[m] = sqrt(best_distances)
+            indices[m] = where(best_indices >= 0,
+                               self.index[best_indices], -1)
+
+        return distances, indices
+
+
+class MotionPlanner:
+
+    def __init__(self, workspace, robot_name, resolution=0.05, exact=True,
+                 random_seed=None):
+        """Base class of the planners, plans the motion of one robot of a
+        workspace in its joint space. Everything else in the workspace is
+        static while planning.
+
+        Args:
+            workspace: Workspace the robot is in
+            robot_name: name of the robot to plan for
+            resolution: largest joint step (radians or meters) between the
+                        configurations that are checked along an edge
+            exact: bool, if False only the bounding sphere proxies of the
+                   links are checked, which is faster and conservative (see
+                   Workspace.in_collision_batch)
+            random_seed: seed for the random samples
+        """
+
+        self.workspace = workspace
+        self.robot_name = robot_name
+        self.robot = workspace.robots[robot_name]
+        self.joint_limits = self.robot.get_joint_limits()
+        self.resolution = resolution
+        self.exact = exact
+        self.random_state = RandomState(random_seed)
+
+    def in_collision(self, q, bodies=None):
+        """Check configurations of the robot for collisions.
+
+        Args:
+            q: [N x num_links] float array of state vectors
+            bodies: optional list of GraphicalBody objects to check against
+                    instead of everything else in the workspace
+
+        Returns: [N] bool array, True where a configuration is in collision
+        """
+        q = float_(q).reshape((-1, self.robot.num_links))
+        if q.shape[0] == 0:
+            return zeros(0, dtype=bool)
+        return self.workspace.in_collision_batch(
+            self.robot_name, q, exact=self.exact, bodies=bodies
+        )
+
+    def sample_free(self, n_samples, max_batches=100):
+        """Get random collision free configurations within the joint limits.
+        Configurations are drawn and checked in batches of n_samples.
+
+        Args:
+            n_samples: number of configurations
+            max_batches: maximum number of batches to draw
+
+        Returns: [n_samples x num_links] float array of state vectors, less
+                 if the free space is too small to find them all
+        """
+        samples = []
+        n_found = 0
+        for _ in range(max_batches):
+            if n_found >= n_samples:
+                break
+            q = self.random_state.uniform(
+                self.joint_limits[:, 0], self.joint_limits[:, 1],
+                (n_samples, self.robot.num_links)
+            )
+            samples.append(q[~self.in_collision(q)])
+            n_found += samples[-1].shape[0]
+        return concatenate(
+            samples + [empty((0, self.robot.num_links))]
+        )[0:n_samples]
+
+    def edges_free(self, starts, ends, bodies=None):
+        """Check straight joint space edges for collisions. The points along
+        all edges are checked as one batch, the end points of the edges are
+        expected to be checked already.
+
+        Args:
+            starts: [E x num_links] float array of start configurations
+            ends: [E x num_links] float array of end configurations
+            bodies: optional list of GraphicalBody objects to check against
+                    instead of everything else in the workspace
+
+        Returns: [E] bool array, True where the whole edge is collision free
+        """
+
+        starts = float_(starts).reshape((-1, self.robot.num_links))
+        ends = float_(ends).reshape((-1, self.robot.num_links))
+        free = ones(starts.shape[0], dtype=bool)
+        if starts.shape[0] == 0:
+            return free
+
+        # Interior points of all edges, at most resolution apart
+        n_steps = maximum(int_(ceil(
+            abs(ends - starts).max(axis=1)/self.resolution
+        )), 1)
+        counts = n_steps - 1
+        edge = repeat(arange(starts.shape[0]), counts)
+        step = arange(edge.shape[0]) - repeat(cumsum(counts) - counts,
+                                              counts) + 1
+        s = (step/n_steps[edge])[:, newaxis]
+        q = starts[edge] + s*(ends[edge] - starts[edge])
+
+        free[edge[self.in_collision(q, bodies)]] = False
+        return free
+
+    def _format_q(self, q):
+        """Format a state vector as a [num_links] float array."""
+        return float_(q).reshape(self.robot.num_links)
+
+
+class RRTConnect(MotionPlanner):
+
+    def __init__(self, workspace, robot_name, step_size=0.5, resolution=0.05,
+                 max_iterations=2000, exact=True, random_seed=None):
+        """Bidirectional rapidly exploring random tree planner (RRT-Connect)
+        for single queries. One tree grows from the start and one from the
+        goal, each new node of one tree is greedily connected to the other.
+
+        Args:
+            workspace: Workspace the robot is in
+            robot_name: name of the robot to plan for
+            step_size: largest joint space distance a tree is extended
+                       towards a random sample
+            resolution: largest joint step between the configurations that
+                        are checked along an edge
+            max_iterations: number of random samples before giving up
+            exact: bool, if False only the bounding sphere proxies of the
+                   links are checked
+            random_seed: seed for the random samples
+        """
+        super(RRTConnect, self).__init__(
+            workspace, robot_name, resolution, exact, random_seed
+        )
+        self.step_size = step_size
+        self.max_iterations = max_iterations
+
+    def plan(self, q_start, q_goal):
+        """Plan a collision free path between two configurations.
+
+        Args:
+            q_start: start state vector
+            q_goal: goal state vector
+
+        Returns: [K x num_links] float array of configurations from q_start
+                 to q_goal joined by collision free straight edges, or None
+                 if the start or goal is in collision or no path was found
+        """
+
+        q_start = self._format_q(q_start)
+        q_goal = self._format_q(q_goal)
+        if self.in_collision(stack((q_start, q_goal))).any():
+            return None
+        if self.edges_free(q_start, q_goal)[0]:
+            return stack((q_start, q_goal))
+
+        # Both trees as preallocated arrays of nodes and parents, the trees
+        # stay small so the nearest node is found by brute force
+        size = self.max_iterations + 1
+        nodes = [empty((size, self.robot.num_links)) for _ in range(2)]
+        parents = [empty(size, dtype=int) for _ in range(2)]
+        n_nodes = [1, 1]
+        nodes[0][0] = q_start
+        nodes[1][0] = q_goal
+        parents[0][0] = parents[1][0] = -1
+
+        samples = self.random_state.uniform(
+            self.joint_limits[:, 0], self.joint_limits[:, 1],
+            (self.max_iterations, self.robot.num_links)
+        )
+        for iteration in range(self.max_iterations):
+            a = iteration % 2
+            b = 1 - a
+
+            # Extend tree a one step towards the sample
+            near = self._nearest(nodes[a][0:n_nodes[a]], samples[iteration])
+            q_near = nodes[a][near]
+            offset = samples[iteration] - q_near
+            distance = sqrt((offset**2).sum())
+            if distance > self.step_size:
+                offset *= self.step_size/distance
+            q_new, _ = self._advance(q_near, q_near + offset)
+            if q_new is None:
+                continue
+            new = self._add(nodes[a], parents[a], n_nodes, a, q_new, near)
+
+            # Connect tree b to the new node as far as possible
+            near = self._nearest(nodes[b][0:n_nodes[b]], q_new)
+            q_reached, reached = self._advance(nodes[b][near], q_new)
+            if reached:
+                path = (self._trace(nodes[a], parents[a], new),
+                        self._trace(nodes[b], parents[b], near))
+                if a:
+                    path = path[::-1]
+                return concatenate((path[0], path[1][::-1]))
+            if q_reached is not None:
+                self._add(nodes[b], parents[b], n_nodes, b, q_reached, near)
+
+        return None
+
+    def _advance(self, start, end):
+        """Move along the edge from start to end until the first collision.
+
+        Args:
+            start: [num_links] collision free state vector
+            end: [num_links] state vector
+
+        Returns: the last collision free configuration checked (None if
+                 the first step collides) and a bool that is True if the
+                 end was reached
+        """
+        n_steps = max(int(ceil(abs(end - start).max()/self.resolution)), 1)
+        s = arange(1, n_steps + 1)[:, newaxis]/float(n_steps)
+        q = start + s*(end - start)
+        collided = self.in_collision(q)
+        if not collided.any():
+            return end, True
+        first = int(argmax(collided))
+        if first == 0:
+            return None, False
+        return q[first - 1], False
+
+    @staticmethod
+    def _nearest(nodes, q):
+        """Index of the node nearest to q."""
+        return int(argmin(((nodes - q)**2).sum(axis=1)))
+
+    @staticmethod
+    def _add(nodes, parents, n_nodes, tree, q, parent):
+        """Add a node to a tree and return its index."""
+        index = n_nodes[tree]
+        nodes[index] = q
+        parents[index] = parent
+        n_nodes[tree] += 1
+        return index
+
+    @staticmethod
+    def _trace(nodes, parents, node):
+        """Configurations from the root of a tree to a node."""
+        path = []
+        while node >= 0:
+            path.append(nodes[node])
+            node = parents[node]
+        return stack(path[::-1])
+
+
+class PRM(MotionPlanner):
+
+    def __init__(self, workspace, robot_name, n_neighbors=10,
+                 resolution=0.05, exact=True, random_seed=None):
+        """Probabilistic roadmap planner for many queries in a workspace that
+        rarely changes. Nodes are collision free configurations connected to
+        their nearest neighbors (found with a KD-tree). Edges are checked
+        for collisions the first time a query wants to use them and the
+        result is kept in the roadmap.
+
+        The roadmap remembers the bodies of the workspace it was checked
+        against. Before each query the bodies are compared, and after
+        Workspace.add_obstacle, Workspace.remove_obstacle or a moved body
+        only the affected nodes and edges are checked again.
+
+        Args:
+            workspace: Workspace the robot is in
+            robot_name: name of the robot to plan for
+            n_neighbors: number of nearest neighbors each node is connected
+                         to
+            resolution: largest joint step between the configurations that
+                        are checked along an edge
+            exact: bool, if False only the bounding sphere proxies of the
+                   links are checked
+            random_seed: seed for the random samples
+        """
+
+        super(PRM, self).__init__(
+            workspace, robot_name, resolution, exact, random_seed
+        )
+        self.n_neighbors = n_neighbors
+
+        # Roadmap
+        self.nodes = empty((0, self.robot.num_links))
+        self.node_free = zeros(0, dtype=bool)
+        self.edges = empty((0, 2), dtype=int)
+        self.edge_states = empty(0, dtype=int8)
+        self.edge_lengths = empty(0)
+        self.tree = KDTree(self.nodes)
+        self.adjacency = []
+
+        # States of the bodies the roadmap is checked against
+        self.body_states = self.get_body_states()
+
+    def get_body_states(self):
+        """Get the placement and size of the bodies the robot is checked
+        against, see Workspace.get_static_bodies.
+
+        Returns: dictionary of [19] float arrays (rotation, translation,
+                 bounds and number of faces) by body key
+        """
+        return {
+            key: concatenate((
+                body.rotation.ravel(), body.translation.ravel(),
+                body.bounds_x, body.bounds_y, body.bounds_z, [body.n_faces]
+            ))
+            for key, body
+            in self.workspace.get_static_bodies(self.robot_name).items()
+        }
+
+    def update(self):
+        """Repair the roadmap after bodies were added to, removed from or
+        moved in the workspace. A removed body can only free nodes and
+        edges, so the blocked ones are checked again. An added body can only
+        block them, so the free nodes are checked against the added bodies
+        and the free edges are validated again when a query uses them. A
+        moved body counts as removed and added.
+
+        Returns: bool, True if the workspace changed
+        """
+
+        body_states = self.get_body_states()
+        added = [key for key, state in body_states.items()
+                 if key not in self.body_states or
+                 not array_equal(state, self.body_states[key])]
+        removed = [key for key, state in self.body_states.items()
+                   if key not in body_states or
+                   not array_equal(state, body_states[key])]
+        self.body_states = body_states
+
+        if removed:
+            blocked = nonzero(~self.node_free)[0]
+            self.node_free[blocked] = ~self.in_collision(self.nodes[blocked])
+            self.edge_states[self.edge_states == EDGE_BLOCKED] = EDGE_UNKNOWN
+        if added:
+            bodies = self.workspace.get_static_bodies(self.robot_name)
+            free = nonzero(self.node_free)[0]
+            self.node_free[free] = ~self.in_collision(
+                self.nodes[free], [bodies[key] for key in added]
+            )
+            self.edge_states[self.edge_states == EDGE_FREE] = EDGE_UNKNOWN
+
+        return bool(added or removed)
+
+    def build(self, n_nodes):
+        """Add collision free nodes to the roadmap and connect each of them
+        to its nearest neighbors. The new edges are not checked until a
+        query uses them. Can be called again to grow the roadmap.
+
+        Args:
+            n_nodes: number of nodes to add
+        """
+
+        self.update()
+        first = self.nodes.shape[0]
+        new = self.sample_free(n_nodes)
+        self.nodes = concatenate((self.nodes, new))
+        self.node_free = concatenate((self.node_free,
+                                      ones(new.shape[0], dtype=bool)))
+        self.tree = KDTree(self.nodes)
+
+        # Edges to the nearest neighbors of the new nodes, without self
+        # edges and without the edges that are already in the roadmap
+        _, neighbors = self.tree.query(new, self.n_neighbors + 1)
+        i = repeat(arange(first, self.nodes.shape[0]), neighbors.shape[1])
+        j = neighbors.ravel()
+        keep = (j >= 0) & (j != i)
+        n_total = self.nodes.shape[0]
+        keys = unique(minimum(i, j)[keep]*n_total + maximum(i, j)[keep])
+        keys = keys[~isin(keys, self.edges[:, 0]*n_total + self.edges[:, 1])]
+        edges = stack((keys//n_total, keys % n_total), axis=1)
+
+        self.edges = concatenate((self.edges, edges))
+        self.edge_states = concatenate((
+            self.edge_states, full(edges.shape[0], EDGE_UNKNOWN, dtype=int8)
+        ))
+        self.edge_lengths = concatenate((
+            self.edge_lengths, self._lengths(self.nodes, edges)
+        ))
+        self._build_adjacency()
+
+    def plan(self, q_start, q_goal):
+        """Plan a collision free path between two configurations through the
+        roadmap. The start and goal are connected to their nearest nodes,
+        then the shortest path is searched (A*) and its unchecked edges are
+        checked. Blocked edges are left out and the search is repeated until
+        a path with only free edges is found.
+
+        Args:
+            q_start: start state vector
+            q_goal: goal state vector
+
+        Returns: [K x num_links] float array of configurations from q_start
+                 to q_goal joined by collision free straight edges, or None
+                 if the start or goal is in collision or they are not
+                 connected by the roadmap
+        """
+
+        self.update()
+        q = stack((self._format_q(q_start), self._format_q(q_goal)))
+        if self.in_collision(q).any():
+            return None
+
+        # Temporary start and goal nodes, connected to their nearest nodes
+        # and to each other
+        n_nodes = self.nodes.shape[0]
+        start, goal = n_nodes, n_nodes + 1
+        nodes = concatenate((self.nodes, q))
+        _, neighbors = self.tree.query(q, self.n_neighbors)
+        extra_edges = [(start, goal)]
+        for node, node_neighbors in ((start, neighbors[0]),
+                                     (goal, neighbors[1])):
+            extra_edges.extend((node, int(neighbor))
+                               for neighbor in node_neighbors
+                               if neighbor >= 0)
+        extra_edges = int_(extra_edges)
+        edges = concatenate((self.edges, extra_edges))
+        states = concatenate((
+            self.edge_states,
+            full(extra_edges.shape[0], EDGE_UNKNOWN, dtype=int8)
+        ))
+        lengths = concatenate((self.edge_lengths,
+                               self._lengths(nodes, extra_edges)))
+        extra_adjacency = {start: [], goal: []}
+        for e, (i, j) in enumerate(extra_edges.tolist(),
+                                   self.edges.shape[0]):
+            extra_adjacency[i].append(e)
+            extra_adjacency.setdefault(j, []).append(e)
+        node_free = self.node_free.tolist() + [True, True]
+
+        # Search and check the unchecked edges of the path until all of its
+        # edges are free
+        edge_list = edges.tolist()
+        length_list = lengths.tolist()
+        while True:
+            path = self._search(nodes, edge_list, states.tolist(),
+                                length_list, node_free, extra_adjacency,
+                                start, goal)
+            if path is None:
+                break
+            unknown = array([e for e in path if states[e] == EDGE_UNKNOWN],
+                            dtype=int)
+            if unknown.shape[0] == 0:
+                break
+            states[unknown] = where(
+                self.edges_free(nodes[edges[unknown, 0]],
+                                nodes[edges[unknown, 1]]),
+                EDGE_FREE, EDGE_BLOCKED
+            )
+        self.edge_states = states[0:self.edges.shape[0]]
+
+        if path is None:
+            return None
+        path_nodes = [start]
+        for e in path:
+            i, j = edge_list[e]
+            path_nodes.append(j if i == path_nodes[-1] else i)
+        return nodes[path_nodes]
+
+    def save(self, file_name):
+        """Save the roadmap, with the states of the bodies it was checked
+        against, to a .npz file.
+
+        Args:
+            file_name: name of the file to write
+        """
+        keys = sorted(self.body_states)
+        savez(file_name,
+              nodes=self.nodes,
+              node_free=self.node_free,
+              edges=self.edges,
+              edge_states=self.edge_states,
+              n_neighbors=self.n_neighbors,
+              resolution=self.resolution,
+              body_keys=array(keys, dtype=str),
+              body_states=float_(
+                  [self.body_states[key] for key in keys]
+              ).reshape((len(keys), -1)))
+
+    @classmethod
+    def load(cls, file_name, workspace, robot_name, exact=True,
+             random_seed=None):
+        """Load a roadmap saved with PRM.save. Bodies that were added,
+        removed or moved since the roadmap was saved are repaired by the
+        next update.
+
+        Args:
+            file_name: name of the .npz file
+            workspace: Workspace the robot is in
+            robot_name: name of the robot to plan for
+            exact: bool, if False only the bounding sphere proxies of the
+                   links are checked
+            random_seed: seed for the random samples
+
+        Returns: PRM object
+        """
+
+        with load(file_name) as roadmap:
+            planner = cls(workspace, robot_name, int(roadmap['n_neighbors']),
+                          float(roadmap['resolution']), exact, random_seed)
+            if roadmap['nodes'].shape[1] != planner.robot.num_links:
+                raise ValueError(
+                    'The roadmap was built for a robot with {} links'.format(
+                        roadmap['nodes'].shape[1]
+                    )
+                )
+            planner.nodes = roadmap['nodes']
+            planner.node_free = roadmap['node_free']
+            planner.edges = roadmap['edges']
+            planner.edge_states = roadmap['edge_states']
+            planner.body_states = dict(zip(roadmap['body_keys'].tolist(),
+                                           roadmap['body_states']))
+
+        planner.edge_lengths = cls._lengths(planner.nodes, planner.edges)
+        planner.tree = KDTree(planner.nodes)
+        planner._build_adjacency()
+        return planner
+
+    def _build_adjacency(self):
+        """List the edges of each node."""
+        self.adjacency = [[] for _ in range(self.nodes.shape[0])]
+        for e, (i, j) in enumerate(self.edges.tolist()):
+            self.adjacency[i].append(e)
+            self.adjacency[j].append(e)
+
+    def _search(self, nodes, edges, states, lengths, node_free,
+                extra_adjacency, start, goal):
+        """A* search for the shortest path that avoids blocked nodes and
+        edges. Returns the list of edge indices of the path, or None."""
+
+        heuristic = sqrt(((nodes - nodes[goal])**2).sum(axis=1)).tolist()
+        n_nodes = len(self.adjacency)
+        costs = {start: 0.0}
+        parent_edges = {start: -1}
+        closed = set()
+        queue = [(heuristic[start], start)]
+        while queue:
+            _, node = heappop(queue)
+            if node == goal:
+                path = []
+                while parent_edges[node] >= 0:
+                    path.append(parent_edges[node])
+                    i, j = edges[path[-1]]
+                    node = i if j == node else j
+                return path[::-1]
+            if node in closed:
+                continue
+            closed.add(node)
+
+            adjacent = extra_adjacency.get(node, [])
+            if node < n_nodes:
+                adjacent = self.adjacency[node] + adjacent
+            for e in adjacent:
+                if states[e] == EDGE_BLOCKED:
+                    continue
+                i, j = edges[e]
+                other = j if i == node else i
+                if other in closed or not node_free[other]:
+                    continue
+                cost = costs[node] + lengths[e]
+                if cost < costs.get(other, inf):
+                    costs[other] = cost
+                    parent_edges[other] = e
+                    heappush(queue, (cost + heuristic[other], other))
+
+        return None
+
+    @staticmethod
+    def _lengths(nodes, edges):
+        """Joint space lengths of edges."""
+        return sqrt(((nodes[edges[:, 1]] - nodes[edges[:, 0]])**2).sum(
+            axis=1
+        ))
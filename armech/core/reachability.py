@@ -0,0 +1,199 @@
+# reachability.py
+#
+# Precomputed reachability maps. The joint space of a robot is sampled
+# offline with batched forward kinematics and the tool positions are counted
+# in a voxel grid in the base frame of the robot, together with a few joint
+# states that reach each voxel. The grid is stored as memory mapped arrays,
+# so at runtime a lookup is an index calculation and one array access, for
+# any mounting of the robot (SerialLink.set_global_transform).
+
+from os import makedirs
+from os.path import join
+
+from numpy import float_, int_, float32, uint32, zeros, full, floor, \
+    arange, argsort, bincount, minimum, hypot, abs, nonzero, cumsum, \
+    ravel_multi_index, concatenate, matmul, load, savez, all as all_
+from numpy.lib.format import open_memmap
+from numpy.random import RandomState
+
+from armech.config import JOINT_PRISMATIC
+from armech.core.transforms import inverse_transform
+
+# Number of joint states stored per voxel
+N_SEEDS = 4
+
+# Number of configurations per forward kinematics batch while building
+BATCH_SIZE = 100000
+
+
+class ReachabilityMap:
+
+    def __init__(self, directory, mode='r'):
+        """Open a reachability map written by ReachabilityMap.build. The
+        arrays are memory mapped, only the voxels that are looked up are
+        read from disk.
+
+        Args:
+            directory: directory of the map
+            mode: memory map mode, 'r' to read or 'r+' to update the map
+        """
+
+        self.directory = directory
+        with load(join(directory, 'grid.npz')) as grid:
+            self.lower = grid['lower']
+            self.voxel_size = float(grid['voxel_size'])
+            self.n_samples = int(grid['n_samples'])
+        self.counts = load(join(directory, 'counts.npy'), mmap_mode=mode)
+        self.seeds = load(join(directory, 'seeds.npy'), mmap_mode=mode)
+        self.shape = self.counts.shape
+        self.n_seeds, self.num_links = self.seeds.shape[3:5]
+
+    @classmethod
+    def build(cls, robot, directory, voxel_size=0.05, n_samples=1000000,
+              n_seeds=N_SEEDS, batch_size=BATCH_SIZE, random_seed=None):
+        """Sample the joint space of a robot and write its reachability map.
+        The tool positions are taken relative to the base of the robot, so
+        the map stays valid when the robot is moved.
+
+        Args:
+            robot: SerialLink robot made of LinkDH links
+            directory: directory to write the map to, it is created if it
+                       does not exist
+            voxel_size: edge length of a voxel (meters)
+            n_samples: number of joint space samples
+            n_seeds: number of joint states stored per voxel
+            batch_size: number of samples per forward kinematics batch
+            random_seed: seed for the samples
+
+        Returns: ReachabilityMap object of the new map
+        """
+
+        # Grid covering a cube of the largest reach around the base
+        reach = 0.0
+        for link in robot.links:
+            extension = abs(link.d)
+            if link.joint_type == JOINT_PRISMATIC:
+                extension += abs(link.joint_limits).max()
+            reach += float(hypot(link.a, extension))
+        n_voxels = max(int(2.0*reach/voxel_size) + 1, 1)
+        shape = (n_voxels,)*3
+        lower = -0.5*n_voxels*voxel_size*float_((1.0, 1.0, 1.0))
+
+        makedirs(directory, exist_ok=True)
+        savez(join(directory, 'grid.npz'), lower=lower,
+              voxel_size=voxel_size, n_samples=n_samples)
+        counts = open_memmap(join(directory, 'counts.npy'), mode='w+',
+                             dtype=uint32, shape=shape)
+        seeds = open_memmap(join(directory, 'seeds.npy'), mode='w+',
+                            dtype=float32,
+                            shape=shape + (n_seeds, robot.num_links))
+        flat_counts = counts.reshape(-1)
+        flat_seeds = seeds.reshape((-1, n_seeds, robot.num_links))
+
+        random_state = RandomState(random_seed)
+        joint_limits = robot.get_joint_limits()
+        for start in range(0, n_samples, batch_size):
+            q = random_state.uniform(
+                joint_limits[:, 0], joint_limits[:, 1],
+                (min(batch_size, n_samples - start), robot.num_links)
+            )
+            voxels = int_(floor(
+                (robot.get_tool_trans_batch(q)[:, 0:3, 3] - lower)/voxel_size
+            ))
+            inside = all_((voxels >= 0) & (voxels < n_voxels), axis=1)
+            voxels = ravel_multi_index(voxels[inside].T, shape)
+            q = q[inside]
+
+            # The first samples of each voxel fill its free seed slots, a
+            # sample's slot is the number of seeds its voxel had plus its
+            # rank among the samples of the voxel in this batch
+            order = argsort(voxels, kind='stable')
+            voxels = voxels[order]
+            q = q[order]
+            first = concatenate(([True], voxels[1:] != voxels[:-1]))
+            rank = arange(voxels.shape[0])
+            rank -= nonzero(first)[0][cumsum(first) - 1]
+            slot = minimum(flat_counts[voxels], n_seeds) + rank
+            keep = slot < n_seeds
+            flat_seeds[voxels[keep], slot[keep]] = q[keep]
+            flat_counts += bincount(
+                voxels, minlength=flat_counts.shape[0]
+            ).astype(uint32)
+
+        counts.flush()
+        seeds.flush()
+        del counts, seeds, flat_counts, flat_seeds
+        return cls(directory)
+
+    def get_voxels(self, points, transform=None):
+        """Get the voxels of points.
+
+        Args:
+            points: [3] or [N x 3] float array of positions
+            transform: optional [4x4] transform of the robot base the points
+                       are given in, e.g. SerialLink.global_transform(). If
+                       None the points are relative to the robot base.
+
+        Returns: [N] int array of flat voxel indices, -1 outside the grid
+        """
+        points = float_(points).reshape((-1, 3))
+        if transform is not None:
+            inverse = inverse_transform(transform)
+            points = matmul(points, inverse[0:3, 0:3].T) + inverse[0:3, 3]
+        voxels = int_(floor((points - self.lower)/self.voxel_size))
+        inside = all_((voxels >= 0) & (voxels < self.shape), axis=1)
+        indices = full(points.shape[0], -1, dtype=int)
+        indices[inside] = ravel_multi_index(voxels[inside].T, self.shape)
+        return indices
+
+    def get_counts(self, points, transform=None):
+        """Get the number of samples that reached the voxels of points.
+
+        Args:
+            points: [3] or [N x 3] float array of positions
+            transform: optional [4x4] transform of the robot base, see
+                       get_voxels
+
+        Returns: [N] int array of sample counts, 0 outside the grid
+        """
+        voxels = self.get_voxels(points, transform)
+        counts = zeros(voxels.shape[0], dtype=int)
+        inside = voxels >= 0
+        counts[inside] = self.counts.reshape(-1)[voxels[inside]]
+        return counts
+
+    def is_reachable(self, points, transform=None, min_count=1):
+        """Check if the tool of the robot can reach points. The answer is
+        as fine as the grid, a point counts as reachable when enough samples
+        reached its voxel.
+
+        Args:
+            points: [3] or [N x 3] float array of positions
+            transform: optional [4x4] transform of the robot base, see
+                       get_voxels
+            min_count: number of samples a voxel needs to be reachable
+
+        Returns: [N] bool array
+        """
+        return self.get_counts(points, transform) >= min_count
+
+    def get_seeds(self, point, transform=None):
+        """Get the stored joint states that reach the voxel of a point, to
+        be used as starting points of the inverse kinematics (see
+        IKSolver.solve).
+
+        Args:
+            point: [3] float array of a position
+            transform: optional [4x4] transform of the robot base, see
+                       get_voxels
+
+        Returns: [K x num_links] float array of state vectors, K is 0 if the
+                 voxel was not reached
+        """
+        voxel = self.get_voxels(point, transform)[0]
+        if voxel < 0:
+            return zeros((0, self.num_links))
+        n_seeds = min(int(self.counts.reshape(-1)[voxel]), self.n_seeds)
+        return float_(
+            self.seeds.reshape((-1, self.n_seeds, self.num_links))[voxel]
+        )[0:n_seeds]
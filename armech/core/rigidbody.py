@@ -27,30 +27,28 @@ class RigidBody(GraphicalBody):
         self.center_of_mass = zeros((3, 1))
         self.inertia_matrix = zeros((3, 3))
 
-    def set_physics(self, mass, center_of_mass, 
+    def set_physics(self, mass, center_of_mass,
                     moments_of_inertia, products_of_inertia):
         """
         Sets the physical properties of the body
         :param mass: Mass of the body (kg)
         :param center_of_mass: distance from the body origin to the center
         of mass
-        :param moments_of_inertia: 3 element array of the x, y and bz moments
-        of inertia (Ixx, Iyy, Izz)
+        :param moments_of_inertia: 3 element array of the x, y and z moments
+        of inertia (Ixx, Iyy, Izz) about the center of mass, in the body
+        coordinate system
         :param products_of_inertia: 3 element array of the products of inertia
         (Iyz, Ixz, Ixy)
         """
 
         # Set values
-        self.mass = mass
-        self.center_of_mass = center_of_mass
+        self.mass = float_(mass)
+        self.center_of_mass = float_(center_of_mass).reshape((3, 1))
         self.inertia_matrix = array([
-           [moments_of_inertia[0], products_of_inertia[0], products_of_inertia[1]],
-           [products_of_inertia[0], moments_of_inertia[1], products_of_inertia[2]],
-           [products_of_inertia[1], products_of_inertia[2], moments_of_inertia[3]],
+           [moments_of_inertia[0], products_of_inertia[2], products_of_inertia[1]],
+           [products_of_inertia[2], moments_of_inertia[1], products_of_inertia[0]],
+           [products_of_inertia[1], products_of_inertia[0], moments_of_inertia[2]],
         ])
 
         # Enable dynamics
         self.has_physics = True
-
-
-
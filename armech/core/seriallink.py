@@ -4,7 +4,13 @@
 # serial link robot. Provides functions for forward kinematics, inverse
 # kinematics, and dynamics calculations.
 
-from numpy import identity, dot, zeros, concatenate, float_
+from numpy import identity, zeros, concatenate, float_, matmul, empty, \
+    tile, where, cross, swapaxes
+
+from armech.config import GRAVITY
+from armech.core.dhchain import DHChain
+from armech.core.dynamics import inverse_dynamics, forward_dynamics
+from armech.core.transforms import inverse_transform
 
 
 class SerialLink:
@@ -24,9 +30,14 @@ class SerialLink:
         :return: A SerialLink robot object
         """
 
-        # Class members
+        # Class members, the DH parameters of all links are kept in one
+        # chain and the links become views onto its rows
         self.links = links
         self.num_links = len(links)
+        self.chain = DHChain(self.num_links)
+        for k, link in enumerate(links):
+            link.attach(self.chain, k)
+        self.revolute = self.chain.revolute
         self.base = base
         self.name = name
         self.state = zeros(self.num_links, dtype='float')
@@ -35,6 +46,12 @@ class SerialLink:
         self.global_rotation = identity(3, dtype='float')
         self.global_translation = zeros((3, 1), dtype='float')
 
+        # Work buffers for the forward kinematics kernels
+        self._link_buffers = empty((self.num_links, 4, 4))
+        self._state_buffers = empty((self.num_links, 4, 4))
+        self._frame_buffer = empty((4, 4))
+        self._transform_buffers = (empty((4, 4)), empty((4, 4)))
+
         # move robot and joints to the initial position
         self.set_global_transform(
             global_rotation, global_translation
@@ -46,6 +63,13 @@ class SerialLink:
             (float_([0, 0, 0, 1]).reshape((1, 4)))), axis=0
         )
 
+    def get_joint_limits(self):
+        """Get the limits of the general coordinates of all the links.
+
+        Returns: [num_links x 2] float array of (lower, upper) limits
+        """
+        return self.chain.joint_limits.copy()
+
     def set_global_transform(self, rotation=None, translation=None):
         """Set the global transform for the overall arm assembly
 
@@ -76,28 +100,54 @@ class SerialLink:
         self.state = q
 
         # Apply all transforms one by one
-        transform = self.global_transform()
+        transform, result = self._transform_buffers
+        transform[:, :] = self.global_transform()
+        frame = self._frame_buffer
+        self.chain.get_link_transforms(
+            q, out=self._link_buffers, state_out=self._state_buffers
+        )
         for k, link in enumerate(self.links):
-            state_transform = dot(
-                transform, link.state_transform(q[k])
-            )
-            self.link_transforms[:, :, k] = state_transform
+            matmul(transform, self._state_buffers[k], out=frame)
+            self.link_transforms[:, :, k] = frame
             link.set_transform(
-                rotation=state_transform[0:3, 0:3],
-                translation=state_transform[0:3, 3]
+                rotation=frame[0:3, 0:3],
+                translation=frame[0:3, 3]
             )
-            transform = dot(state_transform, link.body_transform)
+            matmul(transform, self._link_buffers[k], out=result)
+            transform, result = result, transform
 
         # Set the tool transform
-        self.tool_transform = transform
+        self.tool_transform = transform.copy()
+
+    def set_link_frames(self, q, frames, tool_transform):
+        """Set the joint state together with the link frames and the tool
+        transform of that state calculated elsewhere, e.g. by move_joints in
+        a worker process (see armech.graphics.workspacepool). No forward
+        kinematics is calculated.
+
+        Args:
+            q: a vector of joint states in order from the base to the top
+            frames: [num_links x 4 x 4] link frames in global coordinates
+                    (see link_transforms)
+            tool_transform: [4x4] tool transform in global coordinates
+        """
+        self.state = self.check_q(q)
+        frames = float_(frames).reshape((self.num_links, 4, 4))
+        self.link_transforms[:, :, :] = frames.transpose((1, 2, 0))
+        for link, frame in zip(self.links, frames):
+            link.set_transform(rotation=frame[0:3, 0:3],
+                               translation=frame[0:3, 3])
+        self.tool_transform = float_(tool_transform).reshape((4, 4)).copy()
 
-    def get_tool_trans(self, q, local=True):
+    def get_tool_trans(self, q, local=True, out=None):
         """Get the transform of the tool from the base of the robot given the
         state configuration "q"
         Args:
             q: state vector of the robot in meters and/or radians
             local: bool, get transform local to the robot, if False will give
                    the transform from the robots global_coordinates
+            out: optional [4x4] float array to write the result to, if given
+                 no arrays are allocated by the link loop
 
         Returns: 4x4 transform matrix for the end of the arm
         """
@@ -106,22 +156,206 @@ class SerialLink:
         q = self.check_q(q)
 
         # Set base transform
+        transform, result = self._transform_buffers
         if local:
-            transform = identity(4)
+            transform[:, :] = 0.0
+            transform[0, 0] = transform[1, 1] = 1.0
+            transform[2, 2] = transform[3, 3] = 1.0
         else:
-            transform = self.global_transform
+            transform[:, :] = self.global_transform()
 
-        # Loop through links and calculate transform
-        for k, link in enumerate(self.links):
-            transform = dot(
-                transform, link.state_transform(q[k])
-            )
-            transform = dot(
-                transform, link.body_transform
+        # Chain the link transforms
+        self.chain.get_link_transforms(q, out=self._link_buffers)
+        for k in range(self.num_links):
+            matmul(transform, self._link_buffers[k], out=result)
+            transform, result = result, transform
+
+        if out is None:
+            return transform.copy()
+        out[:, :] = transform
+        return out
+
+    def get_tool_trans_batch(self, q, local=True, link_frames=False):
+        """Get the transforms of the tool for many state configurations at
+        once. Each link is applied to the whole batch with broadcast matrix
+        products, so the cost per configuration is much lower than calling
+        get_tool_trans in a loop.
+
+        Args:
+            q: [N x num_links] array of state vectors in meters and/or radians
+            local: bool, get transforms local to the robot, if False will give
+                   the transforms from the robots global_coordinates
+            link_frames: bool, if True also return the frame of each link
+                         (the same frames move_joints stores in
+                         link_transforms)
+
+        Returns: [N x 4 x 4] array of tool transforms, and if link_frames is
+                 True a [N x num_links x 4 x 4] array of link frames
+        """
+
+        # Check inputs
+        q = self.check_q_batch(q)
+        n_configurations = q.shape[0]
+
+        # Set base transforms
+        if local:
+            transform = tile(identity(4), (n_configurations, 1, 1))
+        else:
+            transform = tile(
+                self.global_transform(), (n_configurations, 1, 1)
             )
+        if link_frames:
+            frames = empty((n_configurations, self.num_links, 4, 4))
 
+        # Transforms of all links for all configurations in one pass, then
+        # chain them link by link
+        state_transforms = empty((n_configurations, self.num_links, 4, 4)) \
+            if link_frames else None
+        link_transforms = self.chain.get_link_transforms(
+            q, state_out=state_transforms
+        )
+        for k in range(self.num_links):
+            if link_frames:
+                matmul(transform, state_transforms[:, k], out=frames[:, k])
+            transform = matmul(transform, link_transforms[:, k])
+
+        if link_frames:
+            return transform, frames
         return transform
 
+    def get_jacobian(self, q=None, local=True):
+        """Get the geometric jacobian of the tool together with the tool
+        transform. The rows of the jacobian are [vx, vy, vz, wx, wy, wz] and
+        each column is the tool velocity for a unit rate of one joint.
+
+        Args:
+            q: state vector of the robot in meters and/or radians, if None
+               the link frames stored by the last call to move_joints are
+               used and no forward kinematics is calculated
+            local: bool, express the jacobian and tool transform in the robot
+                   base frame, if False they are given in global coordinates
+
+        Returns: [6 x num_links] jacobian and 4x4 tool transform
+        """
+
+        if q is None:
+            frames = self.link_transforms.transpose((2, 0, 1))[None]
+            tool = self.tool_transform[None]
+            if local:
+                base = inverse_transform(self.global_transform())
+                frames = matmul(base, frames)
+                tool = matmul(base, tool)
+        else:
+            tool, frames = self.get_tool_trans_batch(
+                self.check_q(q)[None], local=local, link_frames=True
+            )
+
+        return self.jacobian_from_frames(tool, frames)[0], tool[0]
+
+    def get_jacobian_batch(self, q, local=True):
+        """Get the geometric jacobians and tool transforms for many state
+        configurations at once. See get_jacobian.
+
+        Args:
+            q: [N x num_links] array of state vectors in meters and/or radians
+            local: bool, express the results in the robot base frame, if
+                   False they are given in global coordinates
+
+        Returns: [N x 6 x num_links] jacobians and [N x 4 x 4] tool
+                 transforms
+        """
+        tools, frames = self.get_tool_trans_batch(
+            q, local=local, link_frames=True
+        )
+        return self.jacobian_from_frames(tools, frames), tools
+
+    def jacobian_from_frames(self, tools, frames):
+        """Calculate geometric jacobians from the link frames of a forward
+        kinematics pass (see get_tool_trans_batch).
+
+        Args:
+            tools: [N x 4 x 4] float array of tool transforms
+            frames: [N x num_links x 4 x 4] float array of link frames in the
+                    same coordinates as the tools
+
+        Returns: [N x 6 x num_links] float array of jacobians
+        """
+
+        # In this DH convention a revolute joint rotates about the negative
+        # z axis of its frame, a prismatic joint slides along the z axis
+        revolute = self.revolute[:, None]
+        z = frames[..., 0:3, 2]
+        w = where(revolute, -z, 0.0)
+        v = where(
+            revolute, cross(w, tools[:, None, 0:3, 3] - frames[..., 0:3, 3]), z
+        )
+        return swapaxes(concatenate((v, w), axis=-1), 1, 2)
+
+    def get_joint_torques(self, q, qd, qdd, gravity=GRAVITY):
+        """Get the joint torques (forces for prismatic joints) that produce
+        the given joint accelerations, using the mass properties of the links.
+
+        Args:
+            q: state vector of the robot in meters and/or radians
+            qd: joint velocity vector
+            qdd: joint acceleration vector
+            gravity: 3 element gravitational acceleration in global
+                     coordinates
+
+        Returns: [num_links] float array of joint torques
+        """
+        return inverse_dynamics(
+            self, self.check_q(q)[None], self.check_q(qd)[None],
+            self.check_q(qdd)[None], gravity
+        )[0]
+
+    def get_joint_torques_batch(self, q, qd, qdd, gravity=GRAVITY):
+        """Get the joint torques for a whole trajectory (or any batch of
+        states) in one vectorized recursive Newton-Euler pass.
+
+        Args:
+            q: [N x num_links] joint positions
+            qd: [N x num_links] joint velocities
+            qdd: [N x num_links] joint accelerations
+            gravity: 3 element gravitational acceleration in global
+                     coordinates
+
+        Returns: [N x num_links] float array of joint torques
+        """
+        return inverse_dynamics(self, q, qd, qdd, gravity)
+
+    def get_joint_accelerations(self, q, qd, torques, gravity=GRAVITY):
+        """Get the joint accelerations produced by the given joint torques
+        (forces for prismatic joints).
+
+        Args:
+            q: state vector of the robot in meters and/or radians
+            qd: joint velocity vector
+            torques: joint torque vector
+            gravity: 3 element gravitational acceleration in global
+                     coordinates
+
+        Returns: [num_links] float array of joint accelerations
+        """
+        return forward_dynamics(
+            self, self.check_q(q)[None], self.check_q(qd)[None],
+            self.check_q(torques)[None], gravity
+        )[0]
+
+    def get_joint_accelerations_batch(self, q, qd, torques, gravity=GRAVITY):
+        """Get the joint accelerations for a batch of states and torques.
+
+        Args:
+            q: [N x num_links] joint positions
+            qd: [N x num_links] joint velocities
+            torques: [N x num_links] joint torques
+            gravity: 3 element gravitational acceleration in global
+                     coordinates
+
+        Returns: [N x num_links] float array of joint accelerations
+        """
+        return forward_dynamics(self, q, qd, torques, gravity)
+
     def render_links(self):
         """Render the links of the robot using OpenGL."""
         for link in self.links:
@@ -144,4 +378,23 @@ class SerialLink:
                     'of links'
             )
         # Convert to a numpy array
-        return float_(q).reshape((self.num_links, 1))
\ No newline at end of file
+        return float_(q).reshape(self.num_links)
+
+    def check_q_batch(self, q):
+        """Check an array of state vectors and make sure that it is correct.
+        Will error out if the input is not correct.
+
+        Args:
+            q: [N x num_links] array of state vectors of the robot in meters
+               and/or radians
+
+        Returns: A properly formatted [N x num_links] version of q
+        """
+
+        # Make sure the correct input is given
+        q = float_(q)
+        if q.ndim != 2 or q.shape[1] != self.num_links:
+            raise IndexError(
+                    'q must be an N x num_links array of state vectors'
+            )
+        return q
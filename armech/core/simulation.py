@@ -0,0 +1,124 @@
+# simulation.py
+#
+# Fixed step simulation of SerialLink robot dynamics. The state of many
+# independent instances of the same robot is kept in one [B x num_links]
+# batch, so thousands of rollouts advance with a single forward dynamics call
+# per integrator stage.
+
+from numpy import float_, zeros, empty, broadcast_to, arange
+
+from armech.config import GRAVITY, INTEGRATOR_EULER, INTEGRATOR_RK4
+from armech.core.dynamics import forward_dynamics
+
+
+class Simulator:
+
+    def __init__(self, robot, time_step, integrator=INTEGRATOR_RK4,
+                 gravity=GRAVITY):
+        """Fixed step simulator for batches of robot states.
+
+        Args:
+            robot: SerialLink object with physics set on its links
+            time_step: integration time step (seconds)
+            integrator: config.INTEGRATOR_RK4 (fourth order Runge-Kutta) or
+                        config.INTEGRATOR_EULER (semi-implicit Euler)
+            gravity: 3 element gravitational acceleration in global
+                     coordinates
+        """
+
+        if integrator not in (INTEGRATOR_EULER, INTEGRATOR_RK4):
+            raise ValueError(
+                'integrator must be either config.INTEGRATOR_EULER or '
+                'config.INTEGRATOR_RK4'
+            )
+        self.robot = robot
+        self.time_step = float(time_step)
+        self.integrator = integrator
+        self.gravity = float_(gravity)
+
+    def get_accelerations(self, q, qd, torques):
+        """Get the joint accelerations of a batch of states.
+
+        Args:
+            q: [B x num_links] joint positions
+            qd: [B x num_links] joint velocities
+            torques: [B x num_links] joint torques
+
+        Returns: [B x num_links] joint accelerations
+        """
+        return forward_dynamics(self.robot, q, qd, torques, self.gravity)
+
+    def step(self, q, qd, torques):
+        """Advance a batch of states by one time step, the torques are held
+        constant during the step.
+
+        Args:
+            q: [B x num_links] joint positions
+            qd: [B x num_links] joint velocities
+            torques: [B x num_links] joint torques
+
+        Returns: [B x num_links] joint positions and velocities at the end of
+                 the step
+        """
+
+        q = self.robot.check_q_batch(q)
+        qd = self.robot.check_q_batch(qd)
+        h = self.time_step
+
+        if self.integrator == INTEGRATOR_EULER:
+            qd = qd + h*self.get_accelerations(q, qd, torques)
+            return q + h*qd, qd
+
+        # Fourth order Runge-Kutta on the state (q, qd)
+        k1_qd = self.get_accelerations(q, qd, torques)
+        k2_q = qd + 0.5*h*k1_qd
+        k2_qd = self.get_accelerations(q + 0.5*h*qd, k2_q, torques)
+        k3_q = qd + 0.5*h*k2_qd
+        k3_qd = self.get_accelerations(q + 0.5*h*k2_q, k3_q, torques)
+        k4_q = qd + h*k3_qd
+        k4_qd = self.get_accelerations(q + h*k3_q, k4_q, torques)
+        q = q + h/6.0*(qd + 2.0*k2_q + 2.0*k3_q + k4_q)
+        qd = qd + h/6.0*(k1_qd + 2.0*k2_qd + 2.0*k3_qd + k4_qd)
+        return q, qd
+
+    def simulate(self, q0, qd0, n_steps, controller=None, record=True):
+        """Simulate a batch of robots for a number of time steps.
+
+        Args:
+            q0: [B x num_links] initial joint positions
+            qd0: [B x num_links] initial joint velocities
+            n_steps: number of time steps to simulate
+            controller: function f(t, q, qd) returning the [B x num_links]
+                        torques to apply during the step starting at time t,
+                        or a constant torque array. None applies no torques.
+            record: bool, if True the states at every step are returned,
+                    otherwise only the final states
+
+        Returns: times, joint positions and joint velocities. With record
+                 the arrays are [n_steps + 1], [n_steps + 1 x B x num_links]
+                 and [n_steps + 1 x B x num_links].
+        """
+
+        q = self.robot.check_q_batch(q0)
+        qd = broadcast_to(self.robot.check_q_batch(qd0), q.shape)
+        times = arange(n_steps + 1)*self.time_step
+        if controller is None:
+            controller = zeros(q.shape)
+        if not callable(controller):
+            constant_torques = broadcast_to(float_(controller), q.shape)
+            controller = lambda t, q, qd: constant_torques
+
+        if record:
+            q_history = empty((n_steps + 1,) + q.shape)
+            qd_history = empty((n_steps + 1,) + q.shape)
+            q_history[0] = q
+            qd_history[0] = qd
+        for k in range(n_steps):
+            q, qd = self.step(q, qd, controller(times[k], q, qd))
+            if record:
+                q_history[k + 1] = q
+                qd_history[k + 1] = qd
+
+        if record:
+            return times, q_history, qd_history
+        return times[-1], q, qd
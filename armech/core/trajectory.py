@@ -0,0 +1,541 @@
+# trajectory.py
+#
+# Time parameterized joint space trajectories. Quintic polynomial,
+# trapezoidal velocity and cubic spline trajectories are fitted once, then
+# positions, velocities and accelerations at any number of sample times are
+# evaluated with a single vectorized call. Straight line tool motions are
+# streamed through the inverse kinematics one setpoint at a time.
+
+from numpy import float_, zeros, empty, broadcast_to, arange, append, \
+    sqrt, abs, sign, where, diff, cumsum, concatenate, searchsorted, inf, \
+    isfinite, maximum, isreal
+from numpy.linalg import solve
+from numpy.polynomial.polynomial import polyder, polyroots, polyval, \
+    polytrim
+
+from armech.core.transforms import rotation_to_quaternion, \
+    quaternion_to_rotation, quaternion_slerp, rotation_error
+
+
+class Trajectory:
+
+    def __init__(self, n_joints, duration):
+        """Base class of joint space trajectories.
+
+        Args:
+            n_joints: number of joints
+            duration: duration of the trajectory (seconds)
+        """
+        self.n_joints = n_joints
+        self.duration = float(duration)
+
+    def sample(self, t):
+        """Get the joint states at the given times. Times outside
+        [0, duration] are clamped to the start or end of the trajectory.
+
+        Args:
+            t: float or [T] array of times (seconds)
+
+        Returns: [T x n_joints] joint positions, velocities and
+                 accelerations
+        """
+        t = float_(t).reshape(-1).clip(0.0, self.duration)
+        return self._evaluate(t)
+
+    def sample_rate(self, rate):
+        """Sample the whole trajectory at a fixed rate, the last sample is
+        at the end of the trajectory.
+
+        Args:
+            rate: sample rate (Hz), e.g. 1000.0 for 1 kHz setpoints
+
+        Returns: [T] times and [T x n_joints] joint positions, velocities
+                 and accelerations
+        """
+        t = arange(0.0, self.duration, 1.0/rate)
+        if t.size == 0 or t[-1] < self.duration:
+            t = append(t, self.duration)
+        return (t,) + self.sample(t)
+
+    def _evaluate(self, t):
+        """Evaluate the trajectory at [T] times within [0, duration]."""
+        raise NotImplementedError
+
+
+class QuinticTrajectory(Trajectory):
+
+    def __init__(self, q0, q1, duration=None, max_velocity=None,
+                 max_acceleration=None, qd0=0.0, qd1=0.0, qdd0=0.0,
+                 qdd1=0.0):
+        """Fifth order polynomial from one joint state to another, with
+        given velocities and accelerations at both ends.
+
+        Args:
+            q0: [n_joints] start positions
+            q1: [n_joints] end positions
+            duration: duration (seconds), if the velocity or acceleration
+                      limits need more time the trajectory is made longer.
+                      Required when no limits are given.
+            max_velocity: float or [n_joints] velocity limits
+            max_acceleration: float or [n_joints] acceleration limits
+            qd0: float or [n_joints] start velocities
+            qd1: float or [n_joints] end velocities
+            qdd0: float or [n_joints] start accelerations
+            qdd1: float or [n_joints] end accelerations
+        """
+
+        self.q0 = float_(q0).reshape(-1)
+        n_joints = self.q0.size
+        self.q1 = _joint_array(q1, n_joints)
+        self.qd0 = _joint_array(qd0, n_joints)
+        self.qd1 = _joint_array(qd1, n_joints)
+        self.qdd0 = _joint_array(qdd0, n_joints)
+        self.qdd1 = _joint_array(qdd1, n_joints)
+        self.max_velocity = _limit_array(max_velocity, n_joints)
+        self.max_acceleration = _limit_array(max_acceleration, n_joints)
+
+        if duration is None and not (isfinite(self.max_velocity).any() or
+                                     isfinite(self.max_acceleration).any()):
+            raise ValueError(
+                'A duration or joint limits must be given'
+            )
+        if (abs(self.qd0) > self.max_velocity).any() or \
+                (abs(self.qd1) > self.max_velocity).any() or \
+                (abs(self.qdd0) > self.max_acceleration).any() or \
+                (abs(self.qdd1) > self.max_acceleration).any():
+            raise ValueError(
+                'The end conditions exceed the joint limits'
+            )
+
+        super(QuinticTrajectory, self).__init__(n_joints, 0.0)
+        self._fit(duration or 0.0)
+        if not self._within_limits():
+            self._fit(_minimum_duration(self._fit, self._within_limits,
+                                        duration or 0.0))
+
+    def _fit(self, duration):
+        """Set the polynomial coefficients for a duration."""
+        self.duration = float(duration)
+        T = self.duration
+        if T <= 0.0:
+            self.coefficients = zeros((6, self.n_joints))
+            self.coefficients[0] = self.q1
+            return
+        delta = self.q1 - self.q0
+        self.coefficients = float_((
+            self.q0,
+            self.qd0,
+            self.qdd0/2.0,
+            (20.0*delta - (8.0*self.qd1 + 12.0*self.qd0)*T -
+             (3.0*self.qdd0 - self.qdd1)*T**2)/(2.0*T**3),
+            (-30.0*delta + (14.0*self.qd1 + 16.0*self.qd0)*T +
+             (3.0*self.qdd0 - 2.0*self.qdd1)*T**2)/(2.0*T**4),
+            (12.0*delta - 6.0*(self.qd1 + self.qd0)*T +
+             (self.qdd1 - self.qdd0)*T**2)/(2.0*T**5),
+        ))
+
+    def _within_limits(self):
+        """Check the fitted trajectory against the joint limits, using the
+        exact peaks of the velocity and acceleration polynomials."""
+        if self.duration <= 0.0:
+            return (self.q0 == self.q1).all() and \
+                (self.qd0 == self.qd1).all() and \
+                (self.qdd0 == self.qdd1).all()
+        for k in range(self.n_joints):
+            velocity = polyder(self.coefficients[:, k])
+            acceleration = polyder(velocity)
+            if _polynomial_peak(velocity, self.duration) > \
+                    self.max_velocity[k]*(1.0 + 1e-9) or \
+                    _polynomial_peak(acceleration, self.duration) > \
+                    self.max_acceleration[k]*(1.0 + 1e-9):
+                return False
+        return True
+
+    def _evaluate(self, t):
+        c = self.coefficients
+        t = t[:, None]
+        q = c[0] + t*(c[1] + t*(c[2] + t*(c[3] + t*(c[4] + t*c[5]))))
+        qd = c[1] + t*(2.0*c[2] + t*(3.0*c[3] + t*(4.0*c[4] + t*5.0*c[5])))
+        qdd = 2.0*c[2] + t*(6.0*c[3] + t*(12.0*c[4] + t*20.0*c[5]))
+        return q, qd, qdd
+
+
+class TrapezoidalTrajectory(Trajectory):
+
+    def __init__(self, q0, q1, max_velocity, max_acceleration,
+                 duration=None):
+        """Trapezoidal velocity profile from rest to rest. Each joint
+        accelerates at its limit, cruises and decelerates at its limit. All
+        joints are synchronized to start and stop together, the cruise
+        velocity of the faster joints is lowered to do so.
+
+        Args:
+            q0: [n_joints] start positions
+            q1: [n_joints] end positions
+            max_velocity: float or [n_joints] velocity limits
+            max_acceleration: float or [n_joints] acceleration limits
+            duration: optional duration (seconds), used if it is longer
+                      than the fastest duration the limits allow
+        """
+
+        self.q0 = float_(q0).reshape(-1)
+        n_joints = self.q0.size
+        self.q1 = _joint_array(q1, n_joints)
+        self.max_velocity = _limit_array(max_velocity, n_joints)
+        self.max_acceleration = _limit_array(max_acceleration, n_joints)
+        if not (isfinite(self.max_velocity).all() and
+                isfinite(self.max_acceleration).all()):
+            raise ValueError(
+                'Velocity and acceleration limits must be given for all '
+                'joints'
+            )
+
+        # Fastest duration of each joint, a triangle profile if the joint
+        # never reaches its velocity limit
+        distance = abs(self.q1 - self.q0)
+        v = self.max_velocity
+        a = self.max_acceleration
+        fastest = where(distance*a > v**2,
+                        distance/v + v/a, 2.0*sqrt(distance/a))
+        T = max(fastest.max(), duration or 0.0)
+        super(TrapezoidalTrajectory, self).__init__(n_joints, T)
+
+        # Cruise velocity of each joint to finish at T with its acceleration
+        # limit, the smaller root of v**2 - a*T*v + a*distance = 0
+        if T > 0.0:
+            discriminant = maximum((a*T)**2 - 4.0*a*distance, 0.0)
+            self.velocity = (a*T - sqrt(discriminant))/2.0
+        else:
+            self.velocity = zeros(n_joints)
+        self.acceleration = where(self.velocity > 0.0, a, 0.0)
+        self.ramp_time = where(self.velocity > 0.0, self.velocity/a, 0.0)
+        self.direction = sign(self.q1 - self.q0)
+
+    def _evaluate(self, t):
+        t = t[:, None]
+        T = self.duration
+        ramp = self.ramp_time
+        v = self.velocity
+        a = self.acceleration
+        accelerating = t < ramp
+        decelerating = t > T - ramp
+        remaining = T - t
+
+        distance = where(
+            accelerating, 0.5*a*t**2,
+            where(decelerating, v*(T - ramp) - 0.5*a*remaining**2,
+                  v*(t - 0.5*ramp))
+        )
+        velocity = where(accelerating, a*t,
+                         where(decelerating, a*remaining, v))
+        acceleration = where(accelerating, a, where(decelerating, -a, 0.0))
+
+        d = self.direction
+        return self.q0 + d*distance, d*velocity, d*acceleration
+
+
+class SplineTrajectory(Trajectory):
+
+    def __init__(self, waypoints, times=None, max_velocity=None,
+                 max_acceleration=None, qd0=0.0, qd1=0.0):
+        """Cubic spline through waypoints with given velocities at both
+        ends. If the velocity or acceleration limits are exceeded all times
+        are stretched by the same factor, which scales the velocities down
+        linearly and the accelerations quadratically. Nonzero end
+        velocities do not scale, the shortest stretch within the limits is
+        then searched for. Raises ValueError if the end velocities exceed
+        the velocity limits.
+
+        Args:
+            waypoints: [K x n_joints] joint positions to pass through, K >= 2
+            times: optional [K] increasing times of the waypoints (seconds)
+                   starting at 0.0. If not given the segment durations are
+                   the time the slowest joint needs at its limits.
+            max_velocity: float or [n_joints] velocity limits
+            max_acceleration: float or [n_joints] acceleration limits
+            qd0: float or [n_joints] start velocities
+            qd1: float or [n_joints] end velocities
+        """
+
+        self.waypoints = float_(waypoints)
+        if self.waypoints.ndim != 2 or self.waypoints.shape[0] < 2:
+            raise ValueError(
+                'waypoints must be a K x n_joints array with K >= 2'
+            )
+        n_joints = self.waypoints.shape[1]
+        self.qd0 = _joint_array(qd0, n_joints)
+        self.qd1 = _joint_array(qd1, n_joints)
+        self.max_velocity = _limit_array(max_velocity, n_joints)
+        self.max_acceleration = _limit_array(max_acceleration, n_joints)
+        if (abs(self.qd0) > self.max_velocity).any() or \
+                (abs(self.qd1) > self.max_velocity).any():
+            raise ValueError(
+                'The end conditions exceed the joint limits'
+            )
+
+        if times is None:
+            if not (isfinite(self.max_velocity).any() or
+                    isfinite(self.max_acceleration).any()):
+                raise ValueError(
+                    'Waypoint times or joint limits must be given'
+                )
+            distance = abs(diff(self.waypoints, axis=0))
+            segment_durations = maximum(
+                distance/self.max_velocity,
+                sqrt(4.0*distance/self.max_acceleration)
+            ).max(axis=1)
+            times = concatenate(((0.0,), cumsum(segment_durations)))
+        times = float_(times).reshape(-1)
+        if times.size != self.waypoints.shape[0] or \
+                (diff(times) <= 0.0).any():
+            raise ValueError(
+                'times must be increasing with one time per waypoint'
+            )
+
+        super(SplineTrajectory, self).__init__(n_joints, times[-1])
+        self._fit(times - times[0])
+
+        # Stretch the time axis to meet the limits, exact for zero end
+        # velocities. The end velocities do not scale with time, if they
+        # are not zero the shortest stretch is searched for.
+        peak_velocity, peak_acceleration = self._peaks()
+        scale = max(
+            (peak_velocity/self.max_velocity).max(),
+            sqrt((peak_acceleration/self.max_acceleration).max())
+        )
+        if scale > 1.0 + 1e-9:
+            self._fit(self.times*scale)
+        if not self._within_limits():
+            times = self.times/self.duration
+            self._fit(times*_minimum_duration(
+                lambda duration: self._fit(times*duration),
+                self._within_limits, self.duration
+            ))
+
+    def _within_limits(self):
+        """Check the fitted spline against the joint limits."""
+        peak_velocity, peak_acceleration = self._peaks()
+        return (peak_velocity <=
+                self.max_velocity*(1.0 + 1e-9)).all() and \
+            (peak_acceleration <=
+             self.max_acceleration*(1.0 + 1e-9)).all()
+
+    def _peaks(self):
+        """Get the largest absolute velocity and acceleration of each joint.
+        The acceleration is linear in each segment so it peaks at the
+        waypoints, the velocity also peaks where the acceleration is
+        zero."""
+        c = self.coefficients
+        h = diff(self.times)[:, None]
+        velocity = maximum(abs(c[1]), abs(c[1] + h*(2.0*c[2] + h*3.0*c[3])))
+        vertex = where(c[3] != 0.0, -c[2]/(3.0*where(c[3] != 0.0, c[3], 1.0)),
+                       0.0)
+        vertex_velocity = abs(c[1] - c[2]**2/(3.0*where(c[3] != 0.0, c[3],
+                                                          1.0)))
+        velocity = where((vertex > 0.0) & (vertex < h),
+                         maximum(velocity, vertex_velocity), velocity)
+        acceleration = maximum(abs(2.0*c[2]), abs(2.0*c[2] + h*6.0*c[3]))
+        return velocity.max(axis=0), acceleration.max(axis=0)
+
+    def _fit(self, times):
+        """Set the spline coefficients for the waypoint times."""
+
+        self.times = times
+        self.duration = float(times[-1])
+        h = diff(times)
+        y = self.waypoints
+        n = y.shape[0]
+
+        # Clamped spline, solve for the velocities at the waypoints
+        matrix = zeros((n, n))
+        rhs = empty((n, self.n_joints))
+        matrix[0, 0] = matrix[-1, -1] = 1.0
+        rhs[0] = self.qd0
+        rhs[-1] = self.qd1
+        k = arange(1, n - 1)
+        matrix[k, k - 1] = h[1:]
+        matrix[k, k] = 2.0*(h[:-1] + h[1:])
+        matrix[k, k + 1] = h[:-1]
+        slope = diff(y, axis=0)/h[:, None]
+        rhs[1:-1] = 3.0*(h[1:, None]*slope[:-1] + h[:-1, None]*slope[1:])
+        velocities = solve(matrix, rhs)
+
+        # Coefficients of each segment in the local time t - times[k]
+        h = h[:, None]
+        self.coefficients = float_((
+            y[:-1],
+            velocities[:-1],
+            (3.0*slope - 2.0*velocities[:-1] - velocities[1:])/h,
+            (velocities[:-1] + velocities[1:] - 2.0*slope)/h**2,
+        ))
+
+    def _evaluate(self, t):
+        segment = searchsorted(self.times, t, side='right') - 1
+        segment = segment.clip(0, self.times.size - 2)
+        c = self.coefficients[:, segment]
+        t = (t - self.times[segment])[:, None]
+        q = c[0] + t*(c[1] + t*(c[2] + t*c[3]))
+        qd = c[1] + t*(2.0*c[2] + t*3.0*c[3])
+        qdd = 2.0*c[2] + t*6.0*c[3]
+        return q, qd, qdd
+
+
+class CartesianTrajectory:
+
+    def __init__(self, start, end, max_velocity, max_acceleration,
+                 max_angular_velocity=None, max_angular_acceleration=None,
+                 duration=None):
+        """Straight line motion of the tool between two poses. The position
+        moves along the line and the rotation turns about a fixed axis
+        (quaternion slerp), both follow the same trapezoidal timing law so
+        they start and stop together.
+
+        Args:
+            start: [4x4] start pose, e.g. from SerialLink.get_tool_trans
+            end: [4x4] end pose
+            max_velocity: linear velocity limit of the tool (m/s)
+            max_acceleration: linear acceleration limit of the tool (m/s^2)
+            max_angular_velocity: optional angular velocity limit (rad/s)
+            max_angular_acceleration: optional angular acceleration limit
+                                      (rad/s^2)
+            duration: optional duration (seconds), used if it is longer than
+                      the fastest duration the limits allow
+        """
+
+        self.start = float_(start).reshape((4, 4))
+        self.end = float_(end).reshape((4, 4))
+        self.start_quaternion = rotation_to_quaternion(self.start[0:3, 0:3])
+        self.end_quaternion = rotation_to_quaternion(self.end[0:3, 0:3])
+        self.length = float(sqrt(((self.end[0:3, 3] -
+                                   self.start[0:3, 3])**2).sum()))
+        self.angle = float(sqrt((rotation_error(
+            self.end[0:3, 0:3], self.start[0:3, 0:3]
+        )**2).sum()))
+
+        # Limits of the path parameter s, which goes from 0 to 1
+        velocity = [max_velocity/max(self.length, 1e-12)]
+        acceleration = [max_acceleration/max(self.length, 1e-12)]
+        if max_angular_velocity is not None:
+            velocity.append(max_angular_velocity/max(self.angle, 1e-12))
+        if max_angular_acceleration is not None:
+            acceleration.append(
+                max_angular_acceleration/max(self.angle, 1e-12)
+            )
+        self.timing = TrapezoidalTrajectory(
+            (0.0,), (1.0,), min(velocity), min(acceleration), duration
+        )
+        self.duration = self.timing.duration
+
+    def sample(self, t):
+        """Get the tool poses at the given times. Times outside
+        [0, duration] are clamped.
+
+        Args:
+            t: float or [T] array of times (seconds)
+
+        Returns: [T x 4 x 4] tool poses
+        """
+        s = self.timing.sample(t)[0][:, 0]
+        poses = zeros((s.size, 4, 4))
+        poses[:, 0:3, 0:3] = quaternion_to_rotation(quaternion_slerp(
+            self.start_quaternion, self.end_quaternion, s
+        ))
+        poses[:, 0:3, 3] = self.start[0:3, 3] + \
+            s[:, None]*(self.end[0:3, 3] - self.start[0:3, 3])
+        poses[:, 3, 3] = 1.0
+        return poses
+
+    def stream(self, rate):
+        """Generate the tool poses at a fixed rate one at a time, each pose
+        is calculated when it is requested.
+
+        Args:
+            rate: sample rate (Hz)
+
+        Yields: tuples of the time and the [4x4] tool pose, the last pose is
+                at the end of the trajectory
+        """
+        n_steps = int(self.duration*rate)
+        for k in range(n_steps + 1):
+            yield k/float(rate), self.sample(k/float(rate))[0]
+        if n_steps/float(rate) < self.duration:
+            yield self.duration, self.end.copy()
+
+    def stream_joints(self, solver, rate, q0=None, local=True):
+        """Solve the inverse kinematics along the line while the joint
+        setpoints are consumed. Each solve is warm started from the previous
+        solution (see IKSolver.track), nothing is solved ahead.
+
+        Args:
+            solver: IKSolver of the robot
+            rate: sample rate (Hz)
+            q0: optional state vector to start from, e.g. the current state
+                of the robot
+            local: bool, if False the poses are in global coordinates
+
+        Yields: tuples of the time, the state vector and a bool that is True
+                if the solution is within tolerance
+        """
+        times = []
+
+        def poses():
+            for t, pose in self.stream(rate):
+                times.append(t)
+                yield pose
+
+        for q, success in solver.track(poses(), q0=q0, local=local):
+            yield times.pop(0), q, success
+
+
+def _joint_array(value, n_joints):
+    """Broadcast a float or per joint value to a [n_joints] array."""
+    return broadcast_to(float_(value), (n_joints,)).copy()
+
+
+def _limit_array(limit, n_joints):
+    """Get per joint limits, None means no limit."""
+    if limit is None:
+        return broadcast_to(inf, (n_joints,)).copy()
+    limit = _joint_array(limit, n_joints)
+    if (limit <= 0.0).any():
+        raise ValueError('Joint limits must be positive')
+    return limit
+
+
+def _polynomial_peak(coefficients, duration):
+    """Get the largest absolute value of a polynomial (coefficients in
+    increasing order) on [0, duration], at the ends or where its derivative
+    is zero."""
+    times = [0.0, duration]
+    coefficients = polytrim(coefficients)
+    if coefficients.size > 2:
+        roots = polyroots(polyder(coefficients))
+        roots = roots[isreal(roots)].real
+        times.extend(roots[(roots > 0.0) & (roots < duration)])
+    return abs(polyval(float_(times), coefficients)).max()
+
+
+def _minimum_duration(fit, within_limits, lower):
+    """Find the smallest duration above lower for which a trajectory is
+    within its limits, by doubling and then bisection. fit(duration) fits
+    the trajectory and within_limits() checks it."""
+
+    upper = max(2.0*lower, 1e-3)
+    fit(upper)
+    while not within_limits():
+        lower, upper = upper, 2.0*upper
+        if upper > 1e9:
+            raise ValueError(
+                'No duration meets the joint limits'
+            )
+        fit(upper)
+    for _ in range(50):
+        middle = (lower + upper)/2.0
+        fit(middle)
+        if within_limits():
+            upper = middle
+        else:
+            lower = middle
+        if upper - lower <= 1e-9*upper:
+            break
+    return upper
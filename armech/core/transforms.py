@@ -0,0 +1,184 @@
+# transforms.py
+#
+# Functions for working with rotation matrices and homogeneous transforms.
+# All functions work on single matrices as well as on stacks of matrices
+# ([... x 3 x 3] or [... x 4 x 4] arrays).
+
+from numpy import float_, matmul, swapaxes, clip, arccos, sqrt, where, \
+    stack, argmax, arange, identity, pi, concatenate, zeros, empty, sin, \
+    newaxis, array
+from numpy.linalg import norm
+
+
+def inverse_transform(transform):
+    """Invert homogeneous transforms using the transpose of the rotation.
+
+    Args:
+        transform: [... x 4 x 4] float array of homogeneous transforms
+
+    Returns: [... x 4 x 4] float array of the inverse transforms
+    """
+    transform = float_(transform)
+    rotation = swapaxes(transform[..., 0:3, 0:3], -1, -2)
+    inverse = zeros(transform.shape)
+    inverse[..., 0:3, 0:3] = rotation
+    inverse[..., 0:3, 3] = -matmul(rotation, transform[..., 0:3, 3:4])[..., 0]
+    inverse[..., 3, 3] = 1.0
+    return inverse
+
+
+def rotation_log(rotation):
+    """Get the rotation vector (axis*angle) of rotation matrices.
+
+    Args:
+        rotation: [... x 3 x 3] float array of rotation matrices
+
+    Returns: [... x 3] float array of rotation vectors, angles are in the
+             range [0, pi]
+    """
+
+    rotation = float_(rotation)
+    vee = stack((
+        rotation[..., 2, 1] - rotation[..., 1, 2],
+        rotation[..., 0, 2] - rotation[..., 2, 0],
+        rotation[..., 1, 0] - rotation[..., 0, 1],
+    ), axis=-1)
+    trace = rotation[..., 0, 0] + rotation[..., 1, 1] + rotation[..., 2, 2]
+    angle = arccos(clip((trace - 1.0)/2.0, -1.0, 1.0))
+    sin_angle = sqrt(clip(1.0 - ((trace - 1.0)/2.0)**2, 0.0, 1.0))
+
+    # General case, the scale tends to 1/2 for small angles
+    small = sin_angle < 1e-8
+    scale = where(small, 0.5, angle/(2.0*where(small, 1.0, sin_angle)))
+    log = vee*scale[..., None]
+
+    # Close to pi the skew part vanishes, get the axis from R + I instead
+    near_pi = small & (angle > pi/2)
+    if near_pi.any():
+        symmetric = rotation[near_pi] + identity(3)
+        column = argmax(symmetric[:, (0, 1, 2), (0, 1, 2)], axis=-1)
+        axis = symmetric[arange(symmetric.shape[0]), :, column]
+        axis /= norm(axis, axis=-1, keepdims=True)
+        log[near_pi] = axis*angle[near_pi][:, None]
+
+    return log
+
+
+def rotation_error(target, rotation):
+    """Get the rotation vector that turns 'rotation' into 'target', both
+    expressed in the same (world) frame.
+
+    Args:
+        target: [... x 3 x 3] float array of desired rotation matrices
+        rotation: [... x 3 x 3] float array of actual rotation matrices
+
+    Returns: [... x 3] float array of rotation vectors
+    """
+    return rotation_log(matmul(target, swapaxes(rotation, -1, -2)))
+
+
+def pose_error(target, transform):
+    """Get the 6 element error [position; rotation] between transforms. For
+    small errors this is the twist that moves 'transform' onto 'target', so
+    it can be used directly with a geometric jacobian.
+
+    Args:
+        target: [... x 4 x 4] float array of desired transforms
+        transform: [... x 4 x 4] float array of actual transforms
+
+    Returns: [... x 6] float array of pose errors
+    """
+    return concatenate((
+        target[..., 0:3, 3] - transform[..., 0:3, 3],
+        rotation_error(target[..., 0:3, 0:3], transform[..., 0:3, 0:3]),
+    ), axis=-1)
+
+
+def rotation_to_quaternion(rotation):
+    """Get the unit quaternions (w, x, y, z) of rotation matrices. The
+    largest of the four components is found first to keep the result
+    accurate for all angles.
+
+    Args:
+        rotation: [... x 3 x 3] float array of rotation matrices
+
+    Returns: [... x 4] float array of unit quaternions with w >= 0
+    """
+
+    rotation = float_(rotation)
+    r = rotation.reshape((-1, 3, 3))
+    trace = r[:, 0, 0] + r[:, 1, 1] + r[:, 2, 2]
+    candidates = stack((trace, r[:, 0, 0], r[:, 1, 1], r[:, 2, 2]), axis=-1)
+    largest = argmax(candidates, axis=-1)
+
+    # Four times the largest component, the others follow from the off
+    # diagonal terms
+    quaternion = empty((r.shape[0], 4))
+    scale = 2.0*sqrt(1.0 + 2.0*candidates[arange(r.shape[0]), largest] -
+                     trace)
+    sums = stack((r[:, 2, 1] + r[:, 1, 2], r[:, 0, 2] + r[:, 2, 0],
+                  r[:, 1, 0] + r[:, 0, 1]), axis=-1)
+    differences = stack((r[:, 2, 1] - r[:, 1, 2], r[:, 0, 2] - r[:, 2, 0],
+                         r[:, 1, 0] - r[:, 0, 1]), axis=-1)
+    w = largest == 0
+    quaternion[w, 0] = scale[w]/4.0
+    quaternion[w, 1:4] = differences[w]/scale[w, newaxis]
+    for k in range(1, 4):
+        rows = largest == k
+        quaternion[rows, 0] = differences[rows, k - 1]/scale[rows]
+        quaternion[rows, k] = scale[rows]/4.0
+        for other in range(1, 4):
+            if other != k:
+                # The sum of the pair (k, other) is at index 5 - k - other
+                quaternion[rows, other] = \
+                    sums[rows, 5 - k - other]/scale[rows]
+
+    quaternion *= where(quaternion[:, 0:1] < 0.0, -1.0, 1.0)
+    return quaternion.reshape(rotation.shape[:-2] + (4,))
+
+
+def quaternion_to_rotation(quaternion):
+    """Get the rotation matrices of unit quaternions (w, x, y, z).
+
+    Args:
+        quaternion: [... x 4] float array of unit quaternions
+
+    Returns: [... x 3 x 3] float array of rotation matrices
+    """
+    w, x, y, z = (float_(quaternion)[..., k] for k in range(4))
+    return stack((
+        stack((1.0 - 2.0*(y*y + z*z), 2.0*(x*y - w*z), 2.0*(x*z + w*y)),
+              axis=-1),
+        stack((2.0*(x*y + w*z), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z - w*x)),
+              axis=-1),
+        stack((2.0*(x*z - w*y), 2.0*(y*z + w*x), 1.0 - 2.0*(x*x + y*y)),
+              axis=-1),
+    ), axis=-2)
+
+
+def quaternion_slerp(start, end, s):
+    """Spherical linear interpolation between two unit quaternions, along
+    the shorter arc.
+
+    Args:
+        start: [4] unit quaternion at s = 0
+        end: [4] unit quaternion at s = 1
+        s: float or [...] array of interpolation parameters
+
+    Returns: [... x 4] float array of unit quaternions
+    """
+
+    start = float_(start)
+    end = float_(end)
+    s = array(s, dtype=float)[..., newaxis]
+    cos_angle = (start*end).sum()
+    if cos_angle < 0.0:
+        end = -end
+        cos_angle = -cos_angle
+
+    # Nearly equal quaternions are interpolated linearly
+    if cos_angle > 1.0 - 1e-12:
+        quaternion = start + s*(end - start)
+        return quaternion/sqrt((quaternion**2).sum(axis=-1))[..., newaxis]
+    angle = arccos(clip(cos_angle, -1.0, 1.0))
+    return (sin((1.0 - s)*angle)*start + sin(s*angle)*end)/sin(angle)
@@ -5,7 +5,7 @@
 
 # Package imports
 from os.path import dirname, realpath, join
-from numpy import pi
+from numpy import pi, float_
 
 # Local imports
 from armech.config import UNIT_MM
@@ -34,7 +34,12 @@ class Simple3DOF(SerialLink):
     """
 
     def __init__(self, global_transform=None):
-        """Get an instance of Simple3DOF robot."""
+        """Get an instance of Simple3DOF robot.
+
+        Args:
+            global_transform: optional [4x4] transform of the robot base in
+                              the world
+        """
 
         # Create links
         base = GraphicalBody()
@@ -50,6 +55,13 @@ class Simple3DOF(SerialLink):
         link3.load_obj(join(obj_dir, 'link3.obj'), UNIT_MM, [0.0, 0.0, 1.0])
 
         # Initialize the SerialLink super class
+        if global_transform is not None:
+            global_transform = float_(global_transform)
+            global_rotation = global_transform[0:3, 0:3]
+            global_translation = global_transform[0:3, 3]
+        else:
+            global_rotation = global_translation = None
         super(Simple3DOF, self).__init__(
-            [link1, link2, link3], base, global_transform
+            [link1, link2, link3], base, 'Simple3DOF',
+            global_rotation, global_translation
         )
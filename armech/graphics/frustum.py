@@ -0,0 +1,88 @@
+# frustum.py
+#
+# View frustum of a camera. Bodies whose bounding box is outside the
+# frustum are not drawn and the level of detail of the others is picked
+# from their size on the screen (see meshlod).
+
+from numpy import float_, empty, zeros, dot, matmul, log2, floor, clip
+from numpy.linalg import norm
+
+from armech.graphics.meshlod import LOD_LEVELS, LOD_CELL_FRACTION
+
+# Largest error of a level of detail on the screen (pixels), about the size
+# of its grid cells
+LOD_PIXEL_ERROR = 1.0
+
+# Corners of a unit box
+BOX_CORNERS = float_(
+    [[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+)
+
+
+class Frustum:
+
+    def __init__(self, clip_matrix, viewport_size):
+        """
+        Create the frustum of a camera
+        :param clip_matrix: float[4x4] transform from world to clip
+        coordinates, the projection matrix times the view matrix
+        :param viewport_size: (width, height) of the viewport in pixels
+        :return: Frustum object
+        """
+
+        self.clip_matrix = float_(clip_matrix).reshape((4, 4))
+        self.viewport_size = viewport_size
+
+        # Planes (a, b, c, d) with a*x + b*y + c*z + d >= 0 inside, in the
+        # order left, right, bottom, top, near, far
+        m = self.clip_matrix
+        planes = float_((m[3] + m[0], m[3] - m[0], m[3] + m[1],
+                         m[3] - m[1], m[3] + m[2], m[3] - m[2]))
+        self.planes = planes/norm(planes[:, 0:3], axis=1)[:, None]
+
+        # Pixels covered by a unit length at a distance of one, the y row of
+        # the clip matrix is the focal length times a row of the rotation
+        self.pixel_scale = norm(m[1, 0:3])*viewport_size[1]/2.0
+
+    def get_visibility(self, bodies):
+        """
+        Cull bodies against the frustum by their bounding boxes and pick
+        their levels of detail
+        :param bodies: list of GraphicalBody objects
+        :return: bool[N] True for the bodies that may be in view, int[N]
+        level of detail of each body (see MeshAsset.get_lod)
+        """
+
+        n_bodies = len(bodies)
+        lower = empty((n_bodies, 3))
+        upper = empty((n_bodies, 3))
+        rotations = empty((n_bodies, 3, 3))
+        translations = empty((n_bodies, 3))
+        has_graphics = empty(n_bodies, dtype=bool)
+        for k, body in enumerate(bodies):
+            lower[k] = body.bounds_x[0], body.bounds_y[0], body.bounds_z[0]
+            upper[k] = body.bounds_x[1], body.bounds_y[1], body.bounds_z[1]
+            rotations[k] = body.rotation
+            translations[k] = body.translation[:, 0]
+            has_graphics[k] = body.has_graphics
+
+        # A box is out of view when all its corners are outside one plane
+        corners = lower[:, None] + BOX_CORNERS*(upper - lower)[:, None]
+        corners = matmul(corners, rotations.transpose((0, 2, 1))) + \
+            translations[:, None]
+        distances = dot(corners, self.planes[:, 0:3].T) + self.planes[:, 3]
+        visible = (distances.max(axis=1) >= 0.0).all(axis=1) & has_graphics
+
+        # Size on the screen, level k > 0 has cells of about
+        # size*LOD_CELL_FRACTION*2**(k - 1), bodies around or behind the
+        # camera get the full mesh
+        depth = dot(corners.mean(axis=1), self.clip_matrix[3, 0:3]) + \
+            self.clip_matrix[3, 3]
+        size = (upper - lower).max(axis=1)
+        sized = (depth > 0.0) & (size > 0.0)
+        cell = size[sized]*LOD_CELL_FRACTION*self.pixel_scale/depth[sized]
+        levels = zeros(n_bodies, dtype=int)
+        levels[sized] = clip(
+            floor(log2(LOD_PIXEL_ERROR/cell)) + 1, 0, LOD_LEVELS
+        )
+        return visible, levels
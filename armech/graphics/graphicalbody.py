@@ -3,11 +3,14 @@
 # Contains the GraphicalBody class that allows rendering via PyOpenGL and
 # various functions along with a way to update the transformation matrix
 
-from numpy import dot, identity, float_, int_, zeros, min, max, cross
-from numpy.linalg import norm
-from OpenGL.GL import glVertex3fv, glColor3fv, glNormal3fv
+from numpy import dot, identity, float_, zeros, float32, \
+    ascontiguousarray, array
+from OpenGL.GL import glColor3fv, glPushMatrix, glPopMatrix, \
+    glMultMatrixf, glVertexPointer, glNormalPointer, glDrawArrays, \
+    GL_FLOAT, GL_TRIANGLES
 
 from armech.config import UNIT_M, UNIT_MM
+from armech.graphics.meshasset import MeshAsset, get_obj_asset
 
 # Constants
 DEFAULT_FACE_COLOR = float_((0.0, 1.0, 1.0))
@@ -26,6 +29,9 @@ class GraphicalBody:
         self.vertices = float_([])
         self.faces = float_([])
         self.face_normals = float_([])
+        self.vertex_normals = float_([])
+        self.degenerate_faces = zeros(0, dtype=bool)
+        self.smooth_normals = False
         self.face_color = float_(DEFAULT_FACE_COLOR)
         self.n_vertices = float_(0)
         self.n_faces = float_(0)
@@ -34,8 +40,10 @@ class GraphicalBody:
         self.bounds_z = float_((0, 0))
         self.rotation = identity(3)
         self.translation = zeros((3, 1))
-        self.world_vertices = float_([])
-        self.world_face_normals = float_([])
+        self._world_vertices = None
+        self._world_face_normals = None
+        self.transform_version = 0
+        self.mesh = None
         self.obj_file_name = None
 
     def set_transform(self, rotation=None, translation=None):
@@ -45,99 +53,175 @@ class GraphicalBody:
         :param translation: float[3x1] vector to the body coordinate system
         """
 
-        # Set values
+        # Set values, copies are stored so the body never shares memory
+        # with the caller's (possibly reused) arrays
         if rotation is not None:
-            self.rotation = float_(rotation).reshape((3, 3))
+            self.rotation = array(rotation, dtype=float).reshape((3, 3))
         if translation is not None:
-            self.translation = float_(translation).reshape((3, 1))
+            self.translation = array(translation, dtype=float).reshape((3, 1))
 
-        # Apply the transform
-        if self.has_graphics:
-            self.world_vertices = dot(self.rotation, self.vertices) + \
+        # World geometry is recalculated only when it is asked for, the
+        # version tells viewers that the body moved
+        self._world_vertices = None
+        self._world_face_normals = None
+        self.transform_version += 1
+
+    @property
+    def world_vertices(self):
+        """
+        float[3xN] vertices in world coordinates, calculated on first access
+        after the transform or the geometry changed
+        """
+        if not self.has_graphics:
+            return float_([])
+        if self._world_vertices is None:
+            self._world_vertices = dot(self.rotation, self.vertices) + \
                 self.translation
-            self.world_face_normals = dot(self.rotation, self.face_normals)
+        return self._world_vertices
+
+    @property
+    def world_face_normals(self):
+        """
+        float[3xN] face normals in world coordinates, calculated on first
+        access after the transform or the geometry changed
+        """
+        if not self.has_graphics:
+            return float_([])
+        if self._world_face_normals is None:
+            self._world_face_normals = dot(self.rotation, self.face_normals)
+        return self._world_face_normals
+
+    @property
+    def bvh(self):
+        """
+        BVH of the faces in body coordinates for collision checking, shared
+        by all bodies with the same mesh
+        """
+        return self.mesh.bvh
 
-    def set_graphics(self, vertices, faces, face_color=DEFAULT_FACE_COLOR):
+    def set_mesh(self, mesh, face_color=None):
+        """
+        Use a mesh asset as the geometry of the body. The body only keeps
+        references to the arrays of the asset, so any number of bodies can
+        share one mesh.
+        :param mesh: MeshAsset object
+        :param face_color: optional float[3], color of the object faces, in
+        RGB format e.g. [0.0, 1.0, 0.5]
+        """
+
+        self.mesh = mesh
+        self.vertices = mesh.vertices
+        self.faces = mesh.faces
+        self.face_normals = mesh.face_normals
+        self.vertex_normals = mesh.vertex_normals
+        self.degenerate_faces = mesh.degenerate_faces
+        self.smooth_normals = mesh.smooth_normals
+        self.n_vertices = mesh.n_vertices
+        self.n_faces = mesh.n_faces
+        self.bounds_x = mesh.bounds_x
+        self.bounds_y = mesh.bounds_y
+        self.bounds_z = mesh.bounds_z
+        if face_color is not None:
+            self.face_color = float_(face_color)
+        self.has_graphics = True
+
+        # Invalidate world vertices and normals
+        self.set_transform()
+
+    def set_graphics(self, vertices, faces, face_color=DEFAULT_FACE_COLOR,
+                     smooth_normals=False):
         """
         Sets the geometry of the part for graphical display
         :param vertices: list of 3 value vertices (x, y, z)
         :param faces: list of three vertices to connect with triangle
         :param face_color: float[3], color of the object faces, in RGB format
         e.g. [0.0, 1.0, 0.5]
+        :param smooth_normals: bool, if True the body is shaded with per
+        vertex normals (the area weighted average of the adjacent face
+        normals) instead of flat face normals
         """
+        self.set_mesh(MeshAsset(vertices, faces, smooth_normals), face_color)
+        self.obj_file_name = None
 
-        # Set the appropriate values
-        self.vertices = float_(vertices).transpose()
-        self.faces = int_(faces).transpose()
-        self.face_color = float_(face_color)
-        self.n_vertices = self.vertices.shape[1]
-        self.n_faces = self.faces.shape[1]
-
-        # find the face normals
-        self.face_normals = zeros((3, self.n_faces))
-        for k, idx_vertices in enumerate(self.faces.T):
-            vec1 = self.vertices[:, idx_vertices[1]] - self.vertices[:, idx_vertices[0]]
-            vec2 = self.vertices[:, idx_vertices[2]] - self.vertices[:, idx_vertices[0]]
-            normal = cross(vec1, vec2)
-            self.face_normals[:, k] = normal/norm(normal)
-
-        # find the bounding box
-        self.bounds_x = float_((min(self.vertices[0, :]),
-                                max(self.vertices[0, :])))
-        self.bounds_y = float_((min(self.vertices[1, :]),
-                                max(self.vertices[1, :])))
-        self.bounds_z = float_((min(self.vertices[2, :]),
-                                max(self.vertices[2, :])))
-
-        # set the has_graphics flag
-        self.has_graphics = True
-
-        # Update world vertices and normals
-        self.set_transform()
-
-    def load_obj(self, obj_file_name, obj_file_units=UNIT_MM, face_color=DEFAULT_FACE_COLOR):
+    def load_obj(self, obj_file_name, obj_file_units=UNIT_MM,
+                 face_color=DEFAULT_FACE_COLOR, use_cache=True,
+                 smooth_normals=False):
         """
-        Load the visual representation of the body from an .obj file.
+        Load the visual representation of the body from an .obj file. The
+        mesh is shared with all other bodies that loaded the same file with
+        the same units (see meshasset.get_obj_asset).
         :param obj_file_name: link to the .obj file containing vertex and face
         info
         :param obj_file_units: units for the .obj file, can be config.UNITS_MM
          (milimeters) or config.UNITS_M (meters)
         :param face_color: float[3], color of the object faces, in RGB format
         e.g. (0.0, 1.0, 0.5)
+        :param use_cache: bool, reuse the parsed mesh cached next to the file
+        (see meshio.load_obj)
+        :param smooth_normals: bool, shade with per vertex normals (see
+        set_graphics)
         """
-
-        # Read in the file and extract vertices and faces
-        obj_file = open(obj_file_name, 'r')
-        if not obj_file:
-            raise IOError('Could not open "{}"'.format(obj_file_name))
-
-        # Set the scaling constant
-        if obj_file_units == UNIT_MM:
-            scale_factor = 0.001
-        else:
-            scale_factor = 1.0
-
-        # Parse the file and store vertices and faces
-        vertices = []
-        faces = []
-        for line in obj_file:
-            data = line.strip().split(' ')
-            if data[0] == 'v':
-                vertices.append(tuple(float_(data[1:])*scale_factor))
-            elif data[0] == 'f':
-                faces.append(tuple(int_(data[1:]) - 1))
-
-        # Set the values
-        self.set_graphics(vertices, faces, face_color)
+        self.set_mesh(
+            get_obj_asset(obj_file_name, obj_file_units, use_cache,
+                          smooth_normals),
+            face_color
+        )
         self.obj_file_name = obj_file_name
 
-    def render_faces(self):
+    def get_render_array(self):
+        """
+        Get the interleaved vertex and normal data of all triangles in body
+        coordinates, as uploaded to the vertex buffer.
+        :return: float32[n_faces*3 x 6] array of (x, y, z, nx, ny, nz) rows
+        """
+        return self.mesh.get_render_array()
+
+    def get_model_matrix(self):
+        """
+        Get the body to world transform as an OpenGL (column major) matrix.
+        :return: float32[4x4] array to pass to glMultMatrixf
+        """
+        model_matrix = identity(4, dtype=float32)
+        model_matrix[0:3, 0:3] = self.rotation
+        model_matrix[0:3, 3] = self.translation[:, 0]
+        return ascontiguousarray(model_matrix.T)
+
+    def upload_graphics(self):
+        """
+        Upload the geometry to the vertex buffer object of the mesh. Must be
+        called with an OpenGL context, render_faces calls it when needed.
+        """
+        self.mesh.upload_graphics()
+
+    def release_graphics(self):
+        """
+        Forget the vertex buffer of the mesh, e.g. after the OpenGL context
+        that owned it was destroyed. It is uploaded again on the next render.
+        """
+        if self.mesh is not None:
+            self.mesh.release_graphics()
+
+    def render_faces(self, level=0):
         """
-        Draws the object faces on the OpenGL canvas.
+        Draws the object faces on the OpenGL canvas with one draw call, the
+        body transform is applied as the model matrix. The vertex and normal
+        client arrays must be enabled (see Workspace.render_all).
+        :param level: level of detail of the mesh, 0 is the full mesh (see
+        MeshAsset.get_lod)
         """
         if self.has_graphics:
+            mesh = self.mesh.get_lod(level)
+            if mesh.vertex_buffer is None:
+                mesh.upload_graphics()
+            vertex_buffer = mesh.vertex_buffer
             glColor3fv(self.face_color)
-            for k, face in enumerate(self.faces.T):
-                glNormal3fv(self.world_face_normals[:, k])
-                for idx_vertex in face:
-                    glVertex3fv(self.world_vertices[:, idx_vertex])
\ No newline at end of file
+            glPushMatrix()
+            glMultMatrixf(self.get_model_matrix())
+            vertex_buffer.bind()
+            try:
+                glVertexPointer(3, GL_FLOAT, 24, vertex_buffer)
+                glNormalPointer(GL_FLOAT, 24, vertex_buffer + 12)
+                glDrawArrays(GL_TRIANGLES, 0, 3*mesh.n_faces)
+            finally:
+                vertex_buffer.unbind()
+                glPopMatrix()
@@ -0,0 +1,183 @@
+# meshasset.py
+#
+# Immutable mesh geometry that many GraphicalBody objects can share. A mesh
+# asset holds everything that depends only on the geometry (vertices,
+# normals, bounds, the collision BVH and the vertex buffer), so a body only
+# adds its color and pose. Meshes loaded from .obj files are kept in a
+# registry, every body that loads the same file with the same units gets
+# the same asset and the file is read once.
+
+from os import stat
+from os.path import abspath
+from weakref import WeakValueDictionary
+
+from numpy import float_, int_, zeros, cross, float32, empty, finfo, add, \
+    where, newaxis
+from numpy.linalg import norm
+from OpenGL.arrays.vbo import VBO
+
+from armech.config import UNIT_MM
+from armech.core.collision import BVH
+from armech.graphics.meshio import load_obj, load_obj_lods
+
+# Loaded .obj meshes by (path, units, smooth normals), an asset is dropped
+# when no body uses it anymore
+_registry = WeakValueDictionary()
+
+
+class MeshAsset:
+
+    def __init__(self, vertices, faces, smooth_normals=False):
+        """
+        Create the shared geometry of a triangle mesh. The arrays are made
+        read only, a mesh asset never changes after it is created.
+        :param vertices: list of 3 value vertices (x, y, z)
+        :param faces: list of three vertices to connect with triangle
+        :param smooth_normals: bool, if True per vertex normals (the area
+        weighted average of the adjacent face normals) are calculated for
+        smooth shading
+        :return: A MeshAsset object
+        """
+
+        self.vertices = float_(vertices).transpose()
+        self.faces = int_(faces).reshape((-1, 3)).transpose()
+        self.n_vertices = self.vertices.shape[1]
+        self.n_faces = self.faces.shape[1]
+        self.smooth_normals = smooth_normals
+
+        # find the face normals for all faces at once, faces with (close to)
+        # zero area get a zero normal instead of dividing by zero
+        corners = self.vertices[:, self.faces]
+        vec1 = corners[:, 1, :] - corners[:, 0, :]
+        vec2 = corners[:, 2, :] - corners[:, 0, :]
+        normals = cross(vec1, vec2, axis=0)
+        lengths = norm(normals, axis=0)
+        self.degenerate_faces = lengths <= \
+            finfo(float).eps*norm(vec1, axis=0)*norm(vec2, axis=0)
+        lengths[self.degenerate_faces] = 1.0
+        normals[:, self.degenerate_faces] = 0.0
+        self.face_normals = normals/lengths
+
+        # find the vertex normals, the length of the cross product is twice
+        # the face area so summing it weights each face by its area
+        if smooth_normals:
+            vertex_normals = zeros((self.n_vertices, 3))
+            for k in range(3):
+                add.at(vertex_normals, self.faces[k, :], normals.T)
+            lengths = norm(vertex_normals, axis=1)
+            self.vertex_normals = (
+                vertex_normals/where(lengths > 0.0, lengths, 1.0)[:, newaxis]
+            ).T
+        else:
+            self.vertex_normals = float_([])
+
+        # find the bounding box
+        lower = self.vertices.min(axis=1)
+        upper = self.vertices.max(axis=1)
+        self.bounds_x = float_((lower[0], upper[0]))
+        self.bounds_y = float_((lower[1], upper[1]))
+        self.bounds_z = float_((lower[2], upper[2]))
+
+        for value in (self.vertices, self.faces, self.face_normals,
+                      self.vertex_normals, self.degenerate_faces,
+                      self.bounds_x, self.bounds_y, self.bounds_z):
+            value.flags.writeable = False
+
+        self._bvh = None
+        self.vertex_buffer = None
+        self.source = None
+
+        # Coarser meshes for rendering at a distance, from fine to coarse
+        self.lods = []
+
+    @property
+    def bvh(self):
+        """
+        BVH of the faces for collision checking, built on first access
+        """
+        if self._bvh is None:
+            self._bvh = BVH(self.vertices, self.faces)
+        return self._bvh
+
+    def get_lod(self, level):
+        """
+        Get the mesh to render at a level of detail
+        :param level: int, 0 is the full mesh and higher levels are coarser,
+        levels beyond the coarsest give the coarsest mesh
+        :return: MeshAsset object
+        """
+        if level <= 0 or not self.lods:
+            return self
+        return self.lods[min(level, len(self.lods)) - 1]
+
+    def get_render_array(self):
+        """
+        Get the interleaved vertex and normal data of all triangles, as
+        uploaded to the vertex buffer.
+        :return: float32[n_faces*3 x 6] array of (x, y, z, nx, ny, nz) rows
+        """
+        data = empty((self.n_faces, 3, 6), dtype=float32)
+        data[:, :, 0:3] = self.vertices.T[self.faces.T]
+        if self.smooth_normals:
+            data[:, :, 3:6] = self.vertex_normals.T[self.faces.T]
+        else:
+            data[:, :, 3:6] = self.face_normals.T[:, newaxis, :]
+        return data.reshape((-1, 6))
+
+    def upload_graphics(self):
+        """
+        Upload the geometry to a vertex buffer object. Must be called with an
+        OpenGL context, GraphicalBody.render_faces calls it when needed.
+        """
+        self.vertex_buffer = VBO(self.get_render_array())
+
+    def release_graphics(self):
+        """
+        Forget the vertex buffer, e.g. after the OpenGL context that owned it
+        was destroyed. It is uploaded again on the next render.
+        """
+        self.vertex_buffer = None
+        for lod in self.lods:
+            lod.release_graphics()
+
+
+def get_obj_asset(obj_file_name, obj_file_units=UNIT_MM, use_cache=True,
+                  smooth_normals=False):
+    """
+    Get the shared mesh asset of an .obj file. The file is read (see
+    meshio.load_obj) only the first time, or again when it changed on disk.
+    The levels of detail of the mesh (see meshio.load_obj_lods) are made at
+    the same time.
+    :param obj_file_name: path to the .obj file
+    :param obj_file_units: units for the .obj file, can be config.UNITS_MM
+    (milimeters) or config.UNITS_M (meters)
+    :param use_cache: bool, reuse the parsed mesh cached next to the file
+    :param smooth_normals: bool, calculate per vertex normals
+    :return: MeshAsset object
+    """
+
+    key = (abspath(obj_file_name), obj_file_units, bool(smooth_normals))
+    source = stat(obj_file_name)
+    source = (source.st_mtime_ns, source.st_size)
+    asset = _registry.get(key)
+    if asset is not None and asset.source == source:
+        return asset
+
+    # Set the scaling constant
+    if obj_file_units == UNIT_MM:
+        scale_factor = 0.001
+    else:
+        scale_factor = 1.0
+
+    vertices, faces, _, _ = load_obj(obj_file_name, use_cache)
+    asset = MeshAsset(vertices*scale_factor, faces, smooth_normals)
+    asset.lods = [
+        MeshAsset(lod_vertices*scale_factor, lod_faces, smooth_normals)
+        for lod_vertices, lod_faces in load_obj_lods(
+            obj_file_name, use_cache, mesh=(vertices, faces)
+        )
+        if lod_faces.shape[0] > 0
+    ]
+    asset.source = source
+    _registry[key] = asset
+    return asset
@@ -0,0 +1,265 @@
+# meshio.py
+#
+# Reading of mesh files. Wavefront .obj files are parsed in bulk with numpy
+# and the result is cached in a .npz file next to the source file, so a mesh
+# is only parsed once until the source changes.
+
+from hashlib import sha1
+from os import stat, replace, getpid
+
+from numpy import float_, int_, zeros, load, savez, where, arange, newaxis
+
+from armech.graphics.meshlod import LOD_LEVELS, LOD_CELL_FRACTION, \
+    get_lods, pack_lods, unpack_lods
+
+# Bump when the cached arrays change so old cache files are not reused
+CACHE_VERSION = 2
+
+# Characters of the numbers in face statements, removing them leaves the
+# vertex format of each face vertex (e.g. '//' for v//vn)
+_INDEX_CHARACTERS = str.maketrans('', '', '0123456789+-')
+
+
+def read_obj(obj_file_name):
+    """
+    Parse a Wavefront .obj file. Supports the 'v', 'vn' and 'f' statements
+    with all face vertex formats (v, v/vt, v/vt/vn, v//vn), negative
+    indices (relative to the vertices and normals defined before the face)
+    and polygons, which are split into triangle fans. Texture coordinates
+    and other statements are ignored. Raises ValueError for face indices
+    that are 0 or out of range.
+    :param obj_file_name: path to the .obj file
+    :return: float[Nx3] vertices, int[Mx3] triangle vertex indices,
+    float[Kx3] vertex normals and int[Mx3] triangle normal indices (-1 where
+    a face vertex has no normal)
+    """
+
+    with open(obj_file_name, 'r') as obj_file:
+        lines = obj_file.read().splitlines()
+
+    # Sort the statements, relative face indices refer to the vertices and
+    # normals defined before the face
+    vertex_lines = []
+    normal_lines = []
+    face_lines = []
+    vertex_counts = []
+    normal_counts = []
+    for line in lines:
+        if line[0:2] in ('v ', 'f '):
+            keyword, data = line[0], line[2:]
+        else:
+            statement = line.split(None, 1)
+            if len(statement) < 2:
+                continue
+            keyword, data = statement
+        if keyword == 'v':
+            vertex_lines.append(data)
+        elif keyword == 'vn':
+            normal_lines.append(data)
+        elif keyword == 'f':
+            face_lines.append(data)
+            vertex_counts.append(len(vertex_lines))
+            normal_counts.append(len(normal_lines))
+
+    vertices = _parse_vectors(vertex_lines)
+    normals = _parse_vectors(normal_lines)
+    faces, face_normals = _parse_faces(
+        face_lines, int_(vertex_counts), int_(normal_counts),
+        vertices.shape[0], normals.shape[0]
+    )
+
+    return vertices, faces, normals, face_normals
+
+
+def load_obj(obj_file_name, use_cache=True):
+    """
+    Read a Wavefront .obj file (see read_obj), using a cache file
+    '<obj_file_name>.npz' when it is up to date. The cache is valid when the
+    modification time and size of the source match, or when the content
+    hash matches (e.g. after a checkout touched the file). If the cache can
+    not be written the mesh is still returned.
+    :param obj_file_name: path to the .obj file
+    :param use_cache: bool, set to False to always parse the source
+    :return: same as read_obj
+    """
+
+    if not use_cache:
+        return read_obj(obj_file_name)
+
+    cache_file_name = obj_file_name + '.npz'
+    source = stat(obj_file_name)
+    source_hash = None
+    mesh = None
+    try:
+        with load(cache_file_name) as cache:
+            if int(cache['version']) == CACHE_VERSION:
+                if int(cache['source_mtime']) == source.st_mtime_ns and \
+                        int(cache['source_size']) == source.st_size:
+                    return (cache['vertices'], cache['faces'],
+                            cache['normals'], cache['face_normals'])
+                source_hash = _file_hash(obj_file_name)
+                if str(cache['source_hash']) == source_hash:
+                    mesh = (cache['vertices'], cache['faces'],
+                            cache['normals'], cache['face_normals'])
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+
+    # Parse the source when there is no valid cache
+    if mesh is None:
+        mesh = read_obj(obj_file_name)
+    if source_hash is None:
+        source_hash = _file_hash(obj_file_name)
+
+    _write_cache(cache_file_name,
+                 version=CACHE_VERSION,
+                 source_mtime=source.st_mtime_ns,
+                 source_size=source.st_size,
+                 source_hash=source_hash,
+                 vertices=mesh[0], faces=mesh[1],
+                 normals=mesh[2], face_normals=mesh[3])
+
+    return mesh
+
+
+def load_obj_lods(obj_file_name, use_cache=True, n_levels=LOD_LEVELS,
+                  cell_fraction=LOD_CELL_FRACTION, mesh=None):
+    """
+    Get the levels of detail of the mesh in a Wavefront .obj file (see
+    meshlod.get_lods), using a cache file '<obj_file_name>.lod.npz' when it
+    was made from the same source with the same settings.
+    :param obj_file_name: path to the .obj file
+    :param use_cache: bool, set to False to always make the levels
+    :param n_levels: number of levels
+    :param cell_fraction: cell size of the first level as a fraction of the
+    largest dimension of the mesh
+    :param mesh: (vertices, faces) of the source if it was already read, so
+    it is not read again when the levels are made
+    :return: list of n_levels (vertices, faces) tuples, from fine to coarse
+    """
+
+    cache_file_name = obj_file_name + '.lod.npz'
+    source = stat(obj_file_name)
+    if use_cache:
+        try:
+            with load(cache_file_name) as cache:
+                if int(cache['version']) == CACHE_VERSION and \
+                        int(cache['source_mtime']) == source.st_mtime_ns \
+                        and int(cache['source_size']) == source.st_size \
+                        and int(cache['n_levels']) == n_levels and \
+                        float(cache['cell_fraction']) == cell_fraction:
+                    return unpack_lods(
+                        cache['vertices'], cache['faces'],
+                        cache['vertex_counts'], cache['face_counts']
+                    )
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+
+    if mesh is None:
+        mesh = load_obj(obj_file_name, use_cache)
+    vertices, faces = mesh[0:2]
+    lods = get_lods(vertices, faces, n_levels, cell_fraction)
+    if use_cache:
+        packed = pack_lods(lods)
+        _write_cache(cache_file_name,
+                     version=CACHE_VERSION,
+                     source_mtime=source.st_mtime_ns,
+                     source_size=source.st_size,
+                     n_levels=n_levels,
+                     cell_fraction=cell_fraction,
+                     vertices=packed[0], faces=packed[1],
+                     vertex_counts=packed[2], face_counts=packed[3])
+    return lods
+
+
+def _write_cache(cache_file_name, **arrays):
+    """Write a cache file, a temporary file is used so other processes never
+    see a partially written cache. Errors are ignored, a missing cache only
+    costs time."""
+    temp_file_name = '{}.{}.tmp.npz'.format(cache_file_name[:-4], getpid())
+    try:
+        savez(temp_file_name, **arrays)
+        replace(temp_file_name, cache_file_name)
+    except (IOError, OSError):
+        pass
+
+
+def _file_hash(file_name):
+    """Get the sha1 hash of the content of a file."""
+    with open(file_name, 'rb') as source_file:
+        return sha1(source_file.read()).hexdigest()
+
+
+def _parse_vectors(lines):
+    """Parse lines of 3 or more numbers into a float[Nx3] array, only the
+    first 3 numbers of each line are used."""
+    if not lines:
+        return zeros((0, 3))
+    tokens = ' '.join(lines).split()
+    if len(tokens) == 3*len(lines):
+        return float_(tokens).reshape((-1, 3))
+    return float_([line.split()[0:3] for line in lines])
+
+
+def _parse_faces(lines, vertex_counts, normal_counts, n_vertices,
+                 n_normals):
+    """Parse the vertex and normal indices of face statements into
+    triangles, vertex_counts and normal_counts are the numbers of vertices
+    and normals defined before each face."""
+
+    if not lines:
+        return zeros((0, 3), dtype=int), zeros((0, 3), dtype=int)
+
+    # Fast path: all faces are triangles with the same vertex format, the
+    # v/vt/vn and v//vn formats both have the normal as third field
+    text = ' '.join(lines)
+    tokens = text.split()
+    fast = len(tokens) == 3*len(lines)
+    if fast:
+        patterns = ' '.join(tokens).translate(_INDEX_CHARACTERS).split(' ')
+        fast = len(set(patterns)) == 1
+    if fast:
+        n_fields = patterns[0].count('/') + 1
+        fields = int_(
+            text.replace('//', '/0/').replace('/', ' ').split()
+        ).reshape((len(lines), 3, n_fields))
+        faces = fields[:, :, 0]
+        if n_fields == 3:
+            normals = fields[:, :, 2]
+        else:
+            normals = zeros(faces.shape, dtype=int)
+        face_lines = arange(len(lines))
+    else:
+        # General case, one face at a time with fan triangulation
+        faces = []
+        normals = []
+        face_lines = []
+        for index, line in enumerate(lines):
+            corners = [(token.split('/') + ['', ''])[0:3]
+                       for token in line.split()]
+            vertex = [int(corner[0]) for corner in corners]
+            normal = [int(corner[2]) if corner[2] else 0
+                      for corner in corners]
+            for k in range(1, len(corners) - 1):
+                faces.append((vertex[0], vertex[k], vertex[k + 1]))
+                normals.append((normal[0], normal[k], normal[k + 1]))
+                face_lines.append(index)
+        faces = int_(faces).reshape((-1, 3))
+        normals = int_(normals).reshape((-1, 3))
+        face_lines = int_(face_lines)
+
+    if (faces == 0).any():
+        raise ValueError('Face with vertex index 0, .obj indices start at 1')
+    return _resolve_indices(faces, vertex_counts[face_lines], n_vertices,
+                            'vertex'), \
+        _resolve_indices(normals, normal_counts[face_lines], n_normals,
+                         'normal')
+
+
+def _resolve_indices(indices, counts, total, name):
+    """Convert 1 based and negative .obj indices to 0 based indices,
+    negative indices are relative to the counts of elements defined before
+    each face. Missing indices (0) become -1."""
+    relative = counts[:, newaxis] + indices
+    if ((indices > total) | (indices < 0) & (relative < 0)).any():
+        raise ValueError('Face {} index out of range'.format(name))
+    return where(indices > 0, indices - 1, where(indices < 0, relative, -1))
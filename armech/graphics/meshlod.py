@@ -0,0 +1,104 @@
+# meshlod.py
+#
+# Levels of detail of triangle meshes. Coarser versions of a mesh are made
+# by vertex clustering: the vertices in each cell of a grid are merged into
+# their mean and the triangles that collapse are dropped. The cell size of
+# a level is relative to the size of the mesh, so the levels do not depend
+# on the units of the mesh.
+
+from numpy import float_, int_, zeros, unique, sort, bincount, add, \
+    floor, concatenate, cumsum, split
+
+# Number of levels of detail made below the full mesh
+LOD_LEVELS = 3
+
+# Cell size of the first level as a fraction of the largest dimension of
+# the mesh, each further level doubles the cell size
+LOD_CELL_FRACTION = 1.0/128.0
+
+
+def decimate(vertices, faces, cell_size):
+    """
+    Simplify a mesh by merging all vertices within the same grid cell
+    :param vertices: float[Nx3] vertices
+    :param faces: int[Mx3] triangle vertex indices
+    :param cell_size: edge length of the grid cells
+    :return: float[Kx3] vertices and int[Lx3] triangle vertex indices of the
+    simplified mesh
+    """
+
+    vertices = float_(vertices).reshape((-1, 3))
+    faces = int_(faces).reshape((-1, 3))
+    if vertices.shape[0] == 0:
+        return vertices, faces
+
+    # Cluster the vertices by their grid cell, the new vertex is the mean
+    cells = int_(floor((vertices - vertices.min(axis=0))/cell_size))
+    _, cluster = unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    counts = bincount(cluster)
+    merged = zeros((counts.shape[0], 3))
+    add.at(merged, cluster, vertices)
+    merged /= counts[:, None]
+
+    # Drop the triangles that collapsed and the duplicates of the rest
+    faces = cluster[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) &
+                  (faces[:, 1] != faces[:, 2]) &
+                  (faces[:, 2] != faces[:, 0])]
+    _, first = unique(sort(faces, axis=1), axis=0, return_index=True)
+    faces = faces[sort(first)]
+
+    # Drop the vertices no triangle uses
+    used, faces = unique(faces, return_inverse=True)
+    return merged[used], faces.reshape((-1, 3))
+
+
+def get_lods(vertices, faces, n_levels=LOD_LEVELS,
+             cell_fraction=LOD_CELL_FRACTION):
+    """
+    Make the levels of detail of a mesh, from fine to coarse
+    :param vertices: float[Nx3] vertices
+    :param faces: int[Mx3] triangle vertex indices
+    :param n_levels: number of levels
+    :param cell_fraction: cell size of the first level as a fraction of the
+    largest dimension of the mesh
+    :return: list of n_levels (vertices, faces) tuples
+    """
+    vertices = float_(vertices).reshape((-1, 3))
+    if vertices.shape[0] == 0:
+        size = 1.0
+    else:
+        size = (vertices.max(axis=0) - vertices.min(axis=0)).max()
+    lods = []
+    for level in range(n_levels):
+        lods.append(decimate(vertices, faces, size*cell_fraction*2**level))
+    return lods
+
+
+def pack_lods(lods):
+    """
+    Pack levels of detail into four arrays, e.g. to save them to a file
+    :param lods: list of (vertices, faces) tuples
+    :return: concatenated vertices, concatenated faces, vertex counts and
+    face counts of the levels
+    """
+    return (
+        concatenate([lod[0] for lod in lods] + [zeros((0, 3))]),
+        concatenate([lod[1] for lod in lods] + [zeros((0, 3), dtype=int)]),
+        int_([lod[0].shape[0] for lod in lods]),
+        int_([lod[1].shape[0] for lod in lods]),
+    )
+
+
+def unpack_lods(vertices, faces, vertex_counts, face_counts):
+    """
+    Unpack levels of detail packed by pack_lods
+    :return: list of (vertices, faces) tuples
+    """
+    if len(vertex_counts) == 0:
+        return []
+    return list(zip(
+        split(vertices, cumsum(vertex_counts)[:-1]),
+        split(faces, cumsum(face_counts)[:-1]),
+    ))
@@ -0,0 +1,327 @@
+# offscreen.py
+#
+# Headless rendering of Workspace scenes into NumPy images. Triangles are
+# rasterized in software with a depth buffer, all triangles of a batch at
+# once, so no display, window or OpenGL context is needed. The camera, the
+# back face culling and the lighting follow the OpenGL viewer (see
+# workspaceviewer.BaseViewer).
+
+from numpy import float_, int_, uint8, empty, full, zeros, arange, repeat, \
+    cumsum, concatenate, searchsorted, ceil, floor, clip, maximum, \
+    minimum, tan, radians, cos, sin, identity, dot, absolute, inf, \
+    newaxis, asarray
+
+# Intensity of the ambient light (the OpenGL default global ambient light)
+AMBIENT = 0.2
+
+# Largest number of candidate pixels tested in one batch
+MAX_FRAGMENTS = 2**22
+
+
+class OffscreenRenderer:
+
+    def __init__(self, workspace, size=(320, 240), field_of_view=45.0,
+                 near=0.1, far=100.0, background=(0.0, 0.0, 0.0)):
+        """
+        Create a renderer that draws a workspace into images without a
+        window. The camera starts at the initial view of BaseViewer.
+        :param workspace: Workspace object to render
+        :param size: (width, height) of the images in pixels
+        :param field_of_view: vertical field of view of the camera (degrees)
+        :param near: distance from the camera to the near clipping plane,
+        triangles closer than this are not drawn
+        :param far: distance from the camera to the far clipping plane
+        :param background: RGB background color with values 0.0 - 1.0
+        :return: OffscreenRenderer object
+        """
+
+        self.workspace = workspace
+        self.size = (int(size[0]), int(size[1]))
+        self.field_of_view = field_of_view
+        self.near = near
+        self.far = far
+        self.background = float_(background).reshape(3)
+        self.view = self.get_initial_view()
+
+    def get_initial_view(self):
+        """
+        Get the view of BaseViewer.initial_view, looking down at the
+        workspace from a distance of three times its largest dimension
+        :return: float[4x4] transform from world to camera coordinates
+        """
+        ws_max_dimension = absolute(concatenate((
+            self.workspace.bounds_x,
+            self.workspace.bounds_y,
+            self.workspace.bounds_z,
+        ))).max()
+        return _chain(
+            _translation(0.0, 0.0, -3.0*ws_max_dimension),
+            _rotation(90.0, 0),
+            _rotation(180.0, 1),
+            _rotation(30.0, 2),
+            _translation(0.0, 0.0, -self.workspace.bounds_z[1]/2.0),
+        )
+
+    def look_at(self, eye, target, up=(0.0, 0.0, 1.0)):
+        """
+        Point the camera at a target.
+        :param eye: float[3] position of the camera
+        :param target: float[3] position the camera looks at
+        :param up: float[3] direction that is up in the image
+        """
+        eye = float_(eye)
+        forward = float_(target) - eye
+        forward /= (forward**2).sum()**0.5
+        right = _cross(forward, float_(up))
+        right /= (right**2).sum()**0.5
+        self.view = identity(4)
+        self.view[0, 0:3] = right
+        self.view[1, 0:3] = _cross(right, forward)
+        self.view[2, 0:3] = -forward
+        self.view[0:3, 3] = -dot(self.view[0:3, 0:3], eye)
+
+    def render(self):
+        """
+        Render the workspace with all bodies at their current transforms.
+        :return: uint8[height x width x 3] RGB image
+        """
+        image, depth = self._clear()
+        self._draw(self.workspace.get_bodies(), image, depth)
+        return self._to_image(image)
+
+    def render_states(self, robot_name, q):
+        """
+        Render one frame per joint configuration of a robot. Everything but
+        the robot is rasterized once and only the links of the robot are
+        drawn for each frame. The robot is moved back to its state when
+        done.
+        :param robot_name: name of the robot to move
+        :param q: float[N x num_links] joint configurations
+        :return: uint8[N x height x width x 3] RGB images
+        """
+
+        robot = self.workspace.robots[robot_name]
+        q = robot.check_q_batch(q)
+        links = set(id(link) for link in robot.links)
+        static = [body for body in self.workspace.get_bodies()
+                  if id(body) not in links]
+        static_image, static_depth = self._clear()
+        self._draw(static, static_image, static_depth)
+
+        width, height = self.size
+        frames = empty((q.shape[0], height, width, 3), dtype=uint8)
+        state = robot.state.copy()
+        try:
+            for k in range(q.shape[0]):
+                robot.move_joints(q[k])
+                image = static_image.copy()
+                self._draw(robot.links, image, static_depth.copy())
+                frames[k] = self._to_image(image)
+        finally:
+            robot.move_joints(state)
+        return frames
+
+    def render_trajectory(self, robot_name, trajectory, rate):
+        """
+        Render a trajectory of a robot as video frames.
+        :param robot_name: name of the robot that follows the trajectory
+        :param trajectory: joint space Trajectory object (see
+        armech.core.trajectory)
+        :param rate: frames per second
+        :return: uint8[N x height x width x 3] RGB images, one per sample of
+        Trajectory.sample_rate
+        """
+        _, q, _, _ = trajectory.sample_rate(rate)
+        return self.render_states(robot_name, q)
+
+    def _clear(self):
+        """Background color and depth buffers of one image."""
+        width, height = self.size
+        image = empty((width*height, 3))
+        image[:] = self.background
+        return image, full(width*height, inf)
+
+    def _to_image(self, image):
+        """Convert a color buffer to an 8 bit image."""
+        width, height = self.size
+        return uint8(clip(image, 0.0, 1.0)*255.0 + 0.5).reshape(
+            (height, width, 3)
+        )
+
+    def _draw(self, bodies, image, depth):
+        """Rasterize the triangles of bodies into color and depth buffers."""
+
+        width, height = self.size
+        focal = 1.0/tan(radians(self.field_of_view)/2.0)
+        light = asarray(self.workspace.position_light[0:3], dtype=float)
+        light_norm = (light**2).sum()**0.5
+        if light_norm > 0.0:
+            light = light/light_norm
+
+        points = []
+        depths = []
+        colors = []
+        for body in bodies:
+            if not body.has_graphics:
+                continue
+
+            # Corners and normals in camera coordinates
+            transform = dot(self.view, body.get_model_matrix().T)
+            vertices = dot(transform[0:3, 0:3], body.vertices) + \
+                transform[0:3, 3:4]
+            corners = vertices[:, body.faces].transpose((2, 1, 0))
+            normals = dot(transform[0:3, 0:3], body.face_normals).T
+
+            # Project, triangles crossing the near plane or beyond the far
+            # plane are left out
+            distance = -corners[..., 2]
+            visible = (distance.min(axis=1) >= self.near) & \
+                (distance.max(axis=1) <= self.far)
+            corners = corners[visible]
+            distance = distance[visible]
+            ndc = corners[..., 0:2]*focal/distance[..., newaxis]
+            ndc[..., 0] *= float(height)/width
+
+            # Back face culling, front faces are counter clockwise
+            edge_1 = ndc[:, 1] - ndc[:, 0]
+            edge_2 = ndc[:, 2] - ndc[:, 0]
+            front = edge_1[:, 0]*edge_2[:, 1] - edge_1[:, 1]*edge_2[:, 0] > 0
+            if not front.any():
+                continue
+
+            # Flat shading with a directional light fixed to the camera
+            intensity = AMBIENT + maximum(
+                dot(normals[visible][front], light), 0.0
+            )
+            pixels = empty(ndc[front].shape)
+            pixels[..., 0] = (ndc[front][..., 0] + 1.0)*width/2.0
+            pixels[..., 1] = (1.0 - ndc[front][..., 1])*height/2.0
+            points.append(pixels)
+            depths.append(-1.0/distance[front])
+            colors.append(body.face_color*intensity[:, newaxis])
+
+        if points:
+            _rasterize(concatenate(points), concatenate(depths),
+                       concatenate(colors), width, height, image, depth)
+
+
+def write_ppm(file_name, image):
+    """
+    Write an image to a binary .ppm file, e.g. to turn rendered frames into
+    a video with an external encoder
+    :param file_name: name of the file to write
+    :param image: uint8[height x width x 3] RGB image
+    """
+    image = asarray(image, dtype=uint8)
+    with open(file_name, 'wb') as ppm_file:
+        ppm_file.write('P6\n{} {}\n255\n'.format(
+            image.shape[1], image.shape[0]
+        ).encode('ascii'))
+        ppm_file.write(image.tobytes())
+
+
+def _rasterize(points, depths, colors, width, height, image, depth):
+    """
+    Fill triangles into color and depth buffers. The pixel centers in the
+    bounding box of every triangle are tested with barycentric coordinates
+    in batches of at most MAX_FRAGMENTS, the depth test keeps the nearest
+    fragment of each pixel.
+    :param points: float[T x 3 x 2] corners in pixel coordinates
+    :param depths: float[T x 3] depth values of the corners, smaller is
+    closer and they are interpolated linearly in the image (e.g. -1/z)
+    :param colors: float[T x 3] RGB colors of the triangles
+    :param width: image width in pixels
+    :param height: image height in pixels
+    :param image: float[height*width x 3] color buffer
+    :param depth: float[height*width] depth buffer
+    """
+
+    # Pixels with their centers in the bounding boxes
+    lower = int_(ceil(points.min(axis=1) - 0.5))
+    upper = int_(floor(points.max(axis=1) - 0.5))
+    lower = maximum(lower, 0)
+    upper = minimum(upper, (width - 1, height - 1))
+    box_width = maximum(upper[:, 0] - lower[:, 0] + 1, 0)
+    n_pixels = box_width*maximum(upper[:, 1] - lower[:, 1] + 1, 0)
+    area = (points[:, 1, 0] - points[:, 0, 0]) * \
+        (points[:, 2, 1] - points[:, 0, 1]) - \
+        (points[:, 1, 1] - points[:, 0, 1]) * \
+        (points[:, 2, 0] - points[:, 0, 0])
+    keep = (n_pixels > 0) & (area != 0.0)
+    points = points[keep]
+    depths = depths[keep]
+    colors = colors[keep]
+    lower = lower[keep]
+    box_width = box_width[keep]
+    n_pixels = n_pixels[keep]
+    area = area[keep]
+
+    # Batches of whole triangles
+    ends = cumsum(n_pixels)
+    start = 0
+    while start < points.shape[0]:
+        first = ends[start] - n_pixels[start]
+        stop = max(int(searchsorted(ends, first + MAX_FRAGMENTS, 'right')),
+                   start + 1)
+        triangles = arange(start, stop)
+        counts = n_pixels[start:stop]
+        triangle = repeat(triangles, counts)
+        local = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+        x = lower[triangle, 0] + local % box_width[triangle]
+        y = lower[triangle, 1] + local//box_width[triangle]
+
+        # Barycentric coordinates of the pixel centers
+        corners = points[triangle]
+        center_x = x + 0.5
+        center_y = y + 0.5
+        weights = zeros((triangle.shape[0], 3))
+        for k in range(3):
+            a = corners[:, (k + 1) % 3]
+            b = corners[:, (k + 2) % 3]
+            weights[:, k] = ((b[:, 0] - a[:, 0])*(center_y - a[:, 1]) -
+                             (b[:, 1] - a[:, 1])*(center_x - a[:, 0]))
+        weights /= area[triangle, newaxis]
+        inside = (weights >= 0.0).all(axis=1)
+
+        # Depth test
+        triangle = triangle[inside]
+        pixel = y[inside]*width + x[inside]
+        fragment_depth = (weights[inside]*depths[triangle]).sum(axis=1)
+        minimum.at(depth, pixel, fragment_depth)
+        nearest = fragment_depth <= depth[pixel]
+        image[pixel[nearest]] = colors[triangle[nearest]]
+        start = stop
+
+
+def _chain(*transforms):
+    """Product of 4x4 transforms, applied from the right like OpenGL."""
+    result = identity(4)
+    for transform in transforms:
+        result = dot(result, transform)
+    return result
+
+
+def _translation(x, y, z):
+    """4x4 translation, see glTranslatef."""
+    transform = identity(4)
+    transform[0:3, 3] = (x, y, z)
+    return transform
+
+
+def _rotation(angle, axis):
+    """4x4 rotation about a coordinate axis (0, 1 or 2) by an angle in
+    degrees, see glRotatef."""
+    transform = identity(4)
+    c = cos(radians(angle))
+    s = sin(radians(angle))
+    i, j = (axis + 1) % 3, (axis + 2) % 3
+    transform[i, i] = transform[j, j] = c
+    transform[j, i] = s
+    transform[i, j] = -s
+    return transform
+
+
+def _cross(a, b):
+    """Cross product of two 3 element vectors."""
+    return float_((a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2],
+                   a[0]*b[1] - a[1]*b[0]))
@@ -5,6 +5,8 @@
 
 from numpy import pi, sin, cos
 from .graphicalbody import GraphicalBody
+from armech.core.collision import box_signed_distance, \
+    cylinder_signed_distance
 
 
 class Box(GraphicalBody):
@@ -72,6 +74,18 @@ class Box(GraphicalBody):
 
         self.set_graphics(vertices, faces, face_color)
 
+    def get_signed_distance(self, points):
+        """
+        Get the signed distances of points to the solid box, negative inside
+        :param points: float[Nx3] points in body coordinates
+        :return: float[N] signed distances
+        """
+        return box_signed_distance(
+            points,
+            (self.bounds_x[0], self.bounds_y[0], self.bounds_z[0]),
+            (self.bounds_x[1], self.bounds_y[1], self.bounds_z[1])
+        )
+
 
 class Cylinder(GraphicalBody):
 
@@ -87,6 +101,8 @@ class Cylinder(GraphicalBody):
         """
 
         super(Cylinder, self).__init__()
+        self.height = height
+        self.radius = radius
 
         # Calculate the number of points in each circle
         n_circ_pnts = 4 + 4*n_points
@@ -119,6 +135,16 @@ class Cylinder(GraphicalBody):
         # Initialize geometry
         self.set_graphics(vertices, faces, face_color)
 
+    def get_signed_distance(self, points):
+        """
+        Get the signed distances of points to the solid cylinder, negative
+        inside. The mesh is inscribed in the cylinder, so the distance to the
+        mesh is never smaller.
+        :param points: float[Nx3] points in body coordinates
+        :return: float[N] signed distances
+        """
+        return cylinder_signed_distance(points, self.height, self.radius)
+
 
 # TODO: class Sphere(GraphicalBody):
 # TODO: class Cone(GraphicalBody):
@@ -0,0 +1,100 @@
+# staticbatch.py
+#
+# Geometry of bodies that do not move, merged into one vertex buffer. The
+# vertices and normals are transformed to world coordinates once and every
+# vertex carries the color of its body, so any number of static bodies is
+# drawn with a single draw call (see Workspace.render_all).
+
+from numpy import empty, float32, concatenate, dot
+from OpenGL.GL import glEnableClientState, glDisableClientState, \
+    glVertexPointer, glNormalPointer, glColorPointer, glDrawArrays, \
+    GL_COLOR_ARRAY, GL_FLOAT, GL_TRIANGLES
+from OpenGL.arrays.vbo import VBO
+
+
+class StaticBatch:
+
+    def __init__(self, bodies):
+        """
+        Merge the geometry of bodies at their current transforms
+        :param bodies: list of GraphicalBody objects
+        :return: StaticBatch object
+        """
+
+        self.bodies = list(bodies)
+        self.versions = get_versions(bodies)
+        arrays = [get_world_render_array(body)
+                  for body in bodies if body.has_graphics]
+        if arrays:
+            self.data = concatenate(arrays)
+        else:
+            self.data = empty((0, 9), dtype=float32)
+        self.n_vertices = self.data.shape[0]
+        self.vertex_buffer = None
+
+    def is_current(self, bodies):
+        """
+        Check if the batch still shows bodies as they are
+        :param bodies: list of GraphicalBody objects
+        :return: bool, False if a body was added, removed, moved or changed
+        color since the batch was made
+        """
+        # Bodies are compared by identity, an id can be reused once a
+        # removed body is released
+        return len(bodies) == len(self.bodies) and \
+            all(body is old for body, old in zip(bodies, self.bodies)) and \
+            get_versions(bodies) == self.versions
+
+    def release_graphics(self):
+        """
+        Forget the vertex buffer, it is uploaded again on the next render
+        """
+        self.vertex_buffer = None
+
+    def render(self):
+        """
+        Draw all triangles of the batch with one draw call. The vertex and
+        normal client arrays must be enabled (see Workspace.render_all).
+        """
+        if self.n_vertices == 0:
+            return
+        if self.vertex_buffer is None:
+            self.vertex_buffer = VBO(self.data)
+        vertex_buffer = self.vertex_buffer
+        vertex_buffer.bind()
+        glEnableClientState(GL_COLOR_ARRAY)
+        try:
+            glVertexPointer(3, GL_FLOAT, 36, vertex_buffer)
+            glNormalPointer(GL_FLOAT, 36, vertex_buffer + 12)
+            glColorPointer(3, GL_FLOAT, 36, vertex_buffer + 24)
+            glDrawArrays(GL_TRIANGLES, 0, self.n_vertices)
+        finally:
+            glDisableClientState(GL_COLOR_ARRAY)
+            vertex_buffer.unbind()
+
+
+def get_versions(bodies):
+    """
+    Get the state a batch of bodies depends on
+    :param bodies: list of GraphicalBody objects
+    :return: list of (transform version, face color) of the bodies
+    """
+    return [(body.transform_version, body.face_color.tobytes())
+            for body in bodies]
+
+
+def get_world_render_array(body):
+    """
+    Get the render array of a body (see GraphicalBody.get_render_array) in
+    world coordinates with the body color added to every vertex
+    :param body: GraphicalBody object with graphics
+    :return: float32[n_faces*3 x 9] array of (x, y, z, nx, ny, nz, r, g, b)
+    rows
+    """
+    local = body.get_render_array()
+    data = empty((local.shape[0], 9), dtype=float32)
+    data[:, 0:3] = dot(local[:, 0:3], body.rotation.T) + \
+        body.translation[:, 0]
+    data[:, 3:6] = dot(local[:, 3:6], body.rotation.T)
+    data[:, 6:9] = body.face_color
+    return data
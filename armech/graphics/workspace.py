@@ -3,11 +3,16 @@
 # Workspace object that is a rectangular room which can be populated with
 # robots, graspable objects and obstacles.
 
-from OpenGL.GL import glBegin, glEnd, GL_TRIANGLES
+from OpenGL.GL import glEnableClientState, glDisableClientState, \
+    GL_VERTEX_ARRAY, GL_NORMAL_ARRAY
 
+from armech.config import GRAVITY
 from armech.graphics.graphicalbody import GraphicalBody
 from armech.graphics.shapes import Box
+from armech.graphics.staticbatch import StaticBatch
 from armech.core.seriallink import SerialLink
+from armech.core.collision import sweep_and_prune, bodies_collide, \
+    check_poses
 
 
 class Workspace(Box):
@@ -40,6 +45,14 @@ class Workspace(Box):
         self.graspable_objects = {}
         self.robots = {}
 
+        # Incremented whenever a body is added or removed
+        self.structure_version = 0
+
+        # Bodies drawn from the merged static batch (see get_static_batch),
+        # the bodies that moved after they were batched
+        self._static_batch = None
+        self._moving = set()
+
         # Light position
         position_x_light = (bounds_x[0] + bounds_x[0])/2.0
         position_y_light = (bounds_y[0] + bounds_y[0])/2.0
@@ -66,6 +79,7 @@ class Workspace(Box):
 
         # Add the obstacle to the obstacles dictionary
         self.obstacles[name] = obstacle
+        self.structure_version += 1
 
     def remove_obstacle(self, name):
         """
@@ -73,6 +87,7 @@ class Workspace(Box):
         :param name: name of the obstacle to remove
         """
         self.obstacles.pop(name)
+        self.structure_version += 1
 
     def add_graspable_object(self, name, graspable_object):
         """
@@ -91,6 +106,7 @@ class Workspace(Box):
 
         # Add the graspable object to the dictionary
         self.graspable_objects[name] = graspable_object
+        self.structure_version += 1
 
     def remove_graspable_object(self, name):
         """
@@ -98,6 +114,7 @@ class Workspace(Box):
         :param name: name of the graspable object to remove
         """
         self.graspable_objects.pop(name)
+        self.structure_version += 1
 
     def add_robot(self, name, robot):
         """
@@ -114,6 +131,7 @@ class Workspace(Box):
 
         # Add the robot to the workspace
         self.robots[name] = robot
+        self.structure_version += 1
 
     def remove_robot(self, name):
         """
@@ -121,19 +139,289 @@ class Workspace(Box):
         :param name: name of the robot to remove
         """
         self.robots.pop(name)
+        self.structure_version += 1
+
+    def get_bodies(self):
+        """
+        Get all the graphical bodies in the workspace, including the
+        workspace itself and the links of the robots
+        :return: list of GraphicalBody objects
+        """
+        bodies = [self]
+        bodies.extend(self.obstacles.values())
+        bodies.extend(self.graspable_objects.values())
+        for robot in self.robots.values():
+            bodies.extend(robot.links)
+        return bodies
+
+    def get_scene_version(self):
+        """
+        Get a value that changes whenever a body is moved, added or removed,
+        e.g. to only render a new frame when the scene changed
+        :return: tuple of the structure version and the transform versions
+        of all bodies
+        """
+        return (self.structure_version,) + tuple(
+            body.transform_version for body in self.get_bodies()
+        )
+
+    def get_static_bodies(self, robot_name):
+        """
+        Get the bodies a robot is checked against, the obstacles, the
+        graspable objects and the links of the other robots
+        :param robot_name: name of the robot
+        :return: dictionary of GraphicalBody objects by a unique key of the
+        form 'obstacles/<name>', 'graspable_objects/<name>' or
+        'robots/<name>/<link index>'
+        """
+        bodies = {}
+        for name, obstacle in self.obstacles.items():
+            bodies['obstacles/' + name] = obstacle
+        for name, graspable_object in self.graspable_objects.items():
+            bodies['graspable_objects/' + name] = graspable_object
+        for name, robot in self.robots.items():
+            if name != robot_name:
+                for k, link in enumerate(robot.links):
+                    bodies['robots/{}/{}'.format(name, k)] = link
+        return bodies
+
+    def get_collision_pairs(self, robot_name=None):
+        """
+        Get the pairs of bodies whose bounding boxes overlap at their current
+        transforms (broad phase). Robot links are paired with the obstacles,
+        the graspable objects and the links of other robots. Links of the
+        same robot and the workspace walls are not checked.
+        :param robot_name: name of the robot to check, if None all robots
+        are checked
+        :return: list of (link, body) GraphicalBody pairs
+        """
+
+        # Bodies and a group per body, static bodies are group -1 and each
+        # checked robot is its own group
+        entries = [(body, -1) for body in self.obstacles.values()]
+        entries.extend((body, -1) for body in self.graspable_objects.values())
+        for k, (name, robot) in enumerate(sorted(self.robots.items())):
+            group = k if robot_name in (None, name) else -1
+            entries.extend((link, group) for link in robot.links)
+        bodies = [body for body, _ in entries if body.has_graphics]
+        groups = [group for body, group in entries if body.has_graphics]
+        if not bodies:
+            return []
+
+        # Sweep and prune over the world boxes of the bodies
+        bounds = [body.bvh.get_bounds(body.rotation, body.translation[:, 0])
+                  for body in bodies]
+        pairs = sweep_and_prune([lower for lower, _ in bounds],
+                                [upper for _, upper in bounds])
+
+        # Keep pairs with a checked robot link and a body of another group
+        collision_pairs = []
+        for i, j in pairs:
+            if groups[i] == groups[j] or max(groups[i], groups[j]) < 0:
+                continue
+            if groups[i] < groups[j]:
+                i, j = j, i
+            collision_pairs.append((bodies[i], bodies[j]))
+        return collision_pairs
+
+    def get_collisions(self, robot_name=None):
+        """
+        Get the pairs of bodies that are in contact at their current
+        transforms, see get_collision_pairs for the bodies that are checked.
+        Robot links are placed by SerialLink.move_joints.
+        :param robot_name: name of the robot to check, if None all robots
+        are checked
+        :return: list of (link, body) GraphicalBody pairs in contact
+        """
+        return [(link, body)
+                for link, body in self.get_collision_pairs(robot_name)
+                if bodies_collide(link, body)]
+
+    def in_collision(self, robot_name=None):
+        """
+        Check if a robot is in contact with anything in the workspace, stops
+        at the first contact found.
+        :param robot_name: name of the robot to check, if None all robots
+        are checked
+        :return: bool, True if there is a contact
+        """
+        return any(bodies_collide(link, body)
+                   for link, body in self.get_collision_pairs(robot_name))
+
+    def in_collision_batch(self, robot_name, q, distances=False,
+                           n_processes=None, exact=True, bodies=None):
+        """
+        Check many joint configurations of a robot for collisions without
+        moving it. The link poses of all configurations come from one
+        batched forward kinematics pass and are checked against the
+        obstacles, the graspable objects and the links of the other robots
+        at their current transforms (see armech.core.collision.check_poses).
+        :param robot_name: name of the robot to check
+        :param q: float[N x num_links] joint configurations
+        :param distances: bool, if True also get the minimum distance of
+        each configuration to the other bodies
+        :param n_processes: int, if given the configurations are split
+        across a pool of this many processes
+        :param exact: bool, if False only the bounding sphere proxies of the
+        links are checked against the bodies, using the exact signed
+        distance of Box and Cylinder shapes. The result is conservative and
+        the distances are lower bounds.
+        :param bodies: optional list of GraphicalBody objects to check
+        against instead of everything else in the workspace
+        :return: bool[N] mask of the configurations in collision, and if
+        distances is True float[N] minimum distances
+        """
+
+        # Poses of the links with graphics for all configurations
+        robot = self.robots[robot_name]
+        _, frames = robot.get_tool_trans_batch(
+            q, local=False, link_frames=True
+        )
+        links = [k for k, link in enumerate(robot.links)
+                 if link.has_graphics]
+        frames = frames[:, links]
+
+        # Everything else is fixed
+        if bodies is None:
+            bodies = list(self.get_static_bodies(robot_name).values())
+        bodies = [body for body in bodies if body.has_graphics]
+
+        return check_poses(
+            [robot.links[k].bvh for k in links],
+            frames[:, :, 0:3, 0:3], frames[:, :, 0:3, 3],
+            [body.bvh for body in bodies],
+            [body.rotation for body in bodies],
+            [body.translation[:, 0] for body in bodies],
+            distances, n_processes,
+            [getattr(body, 'get_signed_distance', None) for body in bodies],
+            exact
+        )
+
+    def step(self, q, qd=None, qdd=None, gravity=GRAVITY,
+             check_collisions=True, pool=None):
+        """
+        Advance the robots of the workspace by one step. Each robot is moved
+        to its new joint state and its joint torques are calculated, then
+        all robots are checked for collisions at their new poses with one
+        broad phase for the whole workspace. Without a pool the robots are
+        advanced one after the other in this process. With a WorkspacePool
+        the kinematics, the dynamics and the narrow phase collision checks
+        are spread over its worker processes, with the same results.
+        :param q: dictionary of joint states by robot name, robots that are
+        not in it keep their state
+        :param qd: optional dictionary of joint velocities by robot name
+        :param qdd: optional dictionary of joint accelerations by robot name,
+        the torques of the robots in q, qd and qdd are calculated
+        :param gravity: 3 element gravitational acceleration in global
+        coordinates
+        :param check_collisions: bool, set to False to skip the collision
+        checks
+        :param pool: optional WorkspacePool of this workspace (see
+        armech.graphics.workspacepool), reuse it across steps
+        :return: dictionary of [4x4] tool transforms and dictionary of
+        [num_links] joint torques by name of the moved robots, and a
+        dictionary of the (link, body) pairs in contact by robot name
+        """
+
+        # Kinematics and dynamics
+        if pool is not None:
+            tool_transforms, torques = pool.advance(q, qd, qdd, gravity)
+        else:
+            tool_transforms = {}
+            torques = {}
+            for name, robot in self.robots.items():
+                if name not in q:
+                    continue
+                robot.move_joints(q[name])
+                tool_transforms[name] = robot.tool_transform.copy()
+                if qd is not None and qdd is not None and name in qd and \
+                        name in qdd:
+                    torques[name] = robot.get_joint_torques(
+                        robot.state, qd[name], qdd[name], gravity
+                    )
+        if not check_collisions:
+            return tool_transforms, torques, {}
+
+        # Narrow phase of the broad phase pairs, in the order of the robots
+        owners = {}
+        for name, robot in self.robots.items():
+            owners.update((id(link), name) for link in robot.links)
+        robot_pairs = dict((name, []) for name in self.robots)
+        for link, body in self.get_collision_pairs():
+            robot_pairs[owners[id(link)]].append((link, body))
+        pairs = [pair for name in self.robots for pair in robot_pairs[name]]
+        if pool is not None:
+            contacts = pool.check_pairs(pairs)
+        else:
+            contacts = [bodies_collide(link, body) for link, body in pairs]
+
+        collisions = dict((name, []) for name in self.robots)
+        for (link, body), contact in zip(pairs, contacts):
+            if contact:
+                collisions[owners[id(link)]].append((link, body))
+                if id(body) in owners:
+                    collisions[owners[id(body)]].append((body, link))
+        return tool_transforms, torques, collisions
+
+    def release_graphics(self):
+        """
+        Forget the vertex buffers of all bodies, call when the OpenGL context
+        they were uploaded to is destroyed
+        """
+        for body in self.get_bodies():
+            body.release_graphics()
+        if self._static_batch is not None:
+            self._static_batch.release_graphics()
+
+    def get_static_batch(self):
+        """
+        Get the batch of the workspace and the obstacles that did not move.
+        A body that moved since it was batched is taken out of the batch and
+        from then on rendered on its own, the batch is only merged again
+        when its bodies changed.
+        :return: StaticBatch object and list of the obstacles not in it
+        """
+
+        candidates = [self]
+        candidates.extend(self.obstacles.values())
+        batch = self._static_batch
+        if batch is not None:
+            for body, version in zip(batch.bodies, batch.versions):
+                if version[0] != body.transform_version:
+                    self._moving.add(body)
+        self._moving.intersection_update(candidates)
+        static = [body for body in candidates if body not in self._moving]
+        if batch is None or not batch.is_current(static):
+            batch = self._static_batch = StaticBatch(static)
+        return batch, [body for body in candidates if body in self._moving]
 
-    def render_all(self):
+    def render_all(self, frustum=None):
         """
-        Renders all the objects in the workspace to an OpenGL canvas
+        Renders all the objects in the workspace to an OpenGL canvas, the
+        bodies that do not move are drawn from one merged static batch
+        :param frustum: optional Frustum object of the camera, the other
+        bodies are then skipped when they are out of view and drawn at the
+        level of detail that fits their size on the screen
         """
 
-        # Render all faces
-        glBegin(GL_TRIANGLES)
-        self.render_faces()
-        for obstacle in self.obstacles.values():
-            obstacle.render_faces()
-        for graspable_object in self.graspable_objects.values():
-            graspable_object.render_faces()
+        # Render all faces, the static batch and each other body is one draw
+        # call from its vertex buffer
+        static_batch, bodies = self.get_static_batch()
+        bodies.extend(self.graspable_objects.values())
         for robot in self.robots.values():
-            robot.render_links()
-        glEnd()
\ No newline at end of file
+            bodies.extend(robot.links)
+        if frustum is None:
+            levels = [0]*len(bodies)
+        else:
+            visible, levels = frustum.get_visibility(bodies)
+            bodies = [body for body, show in zip(bodies, visible) if show]
+            levels = levels[visible]
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        try:
+            static_batch.render()
+            for body, level in zip(bodies, levels):
+                body.render_faces(level)
+        finally:
+            glDisableClientState(GL_NORMAL_ARRAY)
+            glDisableClientState(GL_VERTEX_ARRAY)
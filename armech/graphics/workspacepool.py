@@ -0,0 +1,272 @@
+# workspacepool.py
+#
+# Persistent worker processes for Workspace.step. Every worker gets a copy of
+# the robots and the other bodies of a workspace once, when the pool starts.
+# Each step only the joint states, the link frames, tool transforms and joint
+# torques and the poses of the other bodies go through shared memory, so the
+# robots are spread over the CPU cores without being copied again.
+
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import ndarray, cumsum, concatenate, prod
+
+from armech.config import GRAVITY
+from armech.core.collision import bodies_collide
+
+# Copies of the bodies and views of the shared arrays in a worker process,
+# see _start_worker
+_worker = {}
+
+
+class WorkspacePool:
+
+    def __init__(self, workspace, n_processes=None):
+        """
+        Start worker processes for Workspace.step. The robots, obstacles and
+        graspable objects of the workspace are copied to the workers once,
+        so the pool must be started again after bodies are added or removed
+        or their geometry, DH parameters or mass properties changed. Moving
+        the bodies is fine, their poses are sent every step. Close the pool
+        when done (or use it as a context manager).
+        :param workspace: Workspace object
+        :param n_processes: number of worker processes, defaults to the
+        number of CPUs
+        :return: WorkspacePool object
+        """
+
+        self.workspace = workspace
+        self.structure_version = workspace.structure_version
+        self.n_processes = n_processes or cpu_count()
+        self.names = list(workspace.robots)
+        self.robots = [workspace.robots[name] for name in self.names]
+        self.bodies = list(workspace.obstacles.values())
+        self.bodies.extend(workspace.graspable_objects.values())
+
+        # Rows of the links and bodies in the shared arrays, the pool keeps
+        # references to the bodies so their ids are not reused
+        self.offsets = _get_offsets(self.robots)
+        self._link_rows = {}
+        for robot, offset in zip(self.robots, self.offsets):
+            self._link_rows.update((id(link), offset + k)
+                                   for k, link in enumerate(robot.links))
+        self._body_rows = dict((id(body), j)
+                               for j, body in enumerate(self.bodies))
+
+        # Shared arrays, then the workers
+        self.layout = _get_layout(len(self.robots), self.offsets[-1],
+                                  len(self.bodies))
+        self._memory = SharedMemory(create=True,
+                                    size=_get_size(self.layout))
+        self.arrays = _get_arrays(self._memory.buf, self.layout)
+        self._pool = Pool(self.n_processes, _start_worker, (
+            self._memory.name, self.layout, self.robots, self.bodies
+        ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+        self.arrays = None
+        self._memory.close()
+        self._memory.unlink()
+
+    def advance(self, q, qd=None, qdd=None, gravity=GRAVITY):
+        """
+        Move robots and calculate their joint torques on the workers, then
+        give the robots of the workspace the link frames the workers found
+        (see SerialLink.set_link_frames). Each worker gets a contiguous
+        share of the robots and writes to their own rows only, so the
+        results do not depend on the order the workers finish in.
+        :param q: dictionary of joint states by robot name
+        :param qd: optional dictionary of joint velocities by robot name
+        :param qdd: optional dictionary of joint accelerations by robot name
+        :param gravity: 3 element gravitational acceleration in global
+        coordinates
+        :return: dictionary of [4x4] tool transforms and dictionary of
+        [num_links] joint torques by robot name, see Workspace.step
+        """
+
+        self._check_workspace()
+        arrays = self.arrays
+        tasks = []
+        for r, (name, robot) in enumerate(zip(self.names, self.robots)):
+            if name not in q:
+                continue
+            rows = slice(self.offsets[r], self.offsets[r + 1])
+            arrays['q'][rows] = robot.check_q(q[name])
+            dynamics = qd is not None and qdd is not None and \
+                name in qd and name in qdd
+            if dynamics:
+                arrays['qd'][rows] = robot.check_q(qd[name])
+                arrays['qdd'][rows] = robot.check_q(qdd[name])
+            tasks.append((r, dynamics))
+        self._pool.map(_advance, [(chunk, gravity) for chunk in
+                                  _split(tasks, self.n_processes) if chunk])
+
+        tool_transforms = {}
+        torques = {}
+        for r, dynamics in tasks:
+            name = self.names[r]
+            rows = slice(self.offsets[r], self.offsets[r + 1])
+            self.robots[r].set_link_frames(arrays['q'][rows].copy(),
+                                           arrays['frames'][rows],
+                                           arrays['tools'][r])
+            tool_transforms[name] = arrays['tools'][r].copy()
+            if dynamics:
+                torques[name] = arrays['torques'][rows].copy()
+        return tool_transforms, torques
+
+    def check_pairs(self, pairs):
+        """
+        Check pairs of bodies for contact on the workers (see
+        collision.bodies_collide), at the current transforms of the bodies
+        in the workspace
+        :param pairs: list of (link, body) pairs from
+        Workspace.get_collision_pairs
+        :return: list of bool, True for the pairs in contact
+        """
+
+        self._check_workspace()
+        arrays = self.arrays
+        for robot, offset in zip(self.robots, self.offsets):
+            arrays['frames'][offset:offset + robot.num_links] = \
+                robot.link_transforms.transpose((2, 0, 1))
+        for pose, body in zip(arrays['body_poses'], self.bodies):
+            pose[0:3, 0:3] = body.rotation
+            pose[0:3, 3] = body.translation[:, 0]
+
+        # A pair is (row of the link, True if the body is a link, row of
+        # the body)
+        rows = []
+        for link, body in pairs:
+            if id(body) in self._body_rows:
+                rows.append((self._link_rows[id(link)], False,
+                             self._body_rows[id(body)]))
+            else:
+                rows.append((self._link_rows[id(link)], True,
+                             self._link_rows[id(body)]))
+        contacts = self._pool.map(
+            _check, [chunk for chunk in _split(rows, self.n_processes)
+                     if chunk]
+        )
+        return [contact for chunk in contacts for contact in chunk]
+
+    def _check_workspace(self):
+        """Raise an error if the pool no longer matches its workspace."""
+        if self._pool is None:
+            raise ValueError('The pool is closed')
+        if self.workspace.structure_version != self.structure_version:
+            raise ValueError(
+                'Bodies were added to or removed from the workspace since '
+                'the pool was started, start a new WorkspacePool'
+            )
+
+
+def _get_offsets(robots):
+    """First row of each robot in the shared link arrays, and the number of
+    rows at the end."""
+    return concatenate(((0,), cumsum([robot.num_links for robot in robots],
+                                     dtype=int)))
+
+
+def _get_layout(n_robots, n_links, n_bodies):
+    """Names and shapes of the shared float arrays."""
+    return (
+        ('q', (n_links,)),
+        ('qd', (n_links,)),
+        ('qdd', (n_links,)),
+        ('frames', (n_links, 4, 4)),
+        ('tools', (n_robots, 4, 4)),
+        ('torques', (n_links,)),
+        ('body_poses', (n_bodies, 4, 4)),
+    )
+
+
+def _get_size(layout):
+    """Size of the shared memory for a layout in bytes, at least one
+    element."""
+    return 8*max(sum(int(prod(shape)) for _, shape in layout), 1)
+
+
+def _get_arrays(buffer, layout):
+    """Float arrays of a layout one after the other in a buffer."""
+    arrays = {}
+    offset = 0
+    for name, shape in layout:
+        arrays[name] = ndarray(shape, float, buffer, offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+
+def _split(items, n_parts):
+    """Split a list into n_parts contiguous parts of about the same
+    length."""
+    n_items = len(items)
+    return [items[k*n_items//n_parts:(k + 1)*n_items//n_parts]
+            for k in range(n_parts)]
+
+
+def _start_worker(memory_name, layout, robots, bodies):
+    """Keep the copies of the bodies and attach the shared arrays in a
+    worker process."""
+    memory = SharedMemory(memory_name)
+    _worker.update(
+        memory=memory,
+        arrays=_get_arrays(memory.buf, layout),
+        robots=robots,
+        offsets=_get_offsets(robots),
+        links=[link for robot in robots for link in robot.links],
+        bodies=bodies,
+    )
+
+
+def _advance(task):
+    """Move a share of the robots and calculate their joint torques, the
+    results are written to their rows of the shared arrays."""
+    chunk, gravity = task
+    arrays = _worker['arrays']
+    offsets = _worker['offsets']
+    for r, dynamics in chunk:
+        robot = _worker['robots'][r]
+        rows = slice(offsets[r], offsets[r + 1])
+        robot.move_joints(arrays['q'][rows].copy())
+        arrays['frames'][rows] = robot.link_transforms.transpose((2, 0, 1))
+        arrays['tools'][r] = robot.tool_transform
+        if dynamics:
+            arrays['torques'][rows] = robot.get_joint_torques(
+                robot.state, arrays['qd'][rows], arrays['qdd'][rows],
+                gravity
+            )
+
+
+def _check(rows):
+    """Check a share of the collision pairs, see WorkspacePool.check_pairs.
+    Each body is placed at its shared pose once."""
+    arrays = _worker['arrays']
+    placed = {}
+
+    def place(is_link, row):
+        if (is_link, row) not in placed:
+            if is_link:
+                body, pose = _worker['links'][row], arrays['frames'][row]
+            else:
+                body, pose = _worker['bodies'][row], arrays['body_poses'][row]
+            body.set_transform(rotation=pose[0:3, 0:3],
+                               translation=pose[0:3, 3])
+            placed[(is_link, row)] = body
+        return placed[(is_link, row)]
+
+    return [bodies_collide(place(True, link_row), place(is_link, row))
+            for link_row, is_link, row in rows]
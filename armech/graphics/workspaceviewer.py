@@ -2,28 +2,74 @@
 #
 # Classes for viewing and navigating the workspace in 3D
 
-from numpy import max, concatenate, absolute
+from threading import Thread, RLock
+from time import perf_counter, sleep
+
+from numpy import max, concatenate, absolute, dot
 from OpenGL.GL import glTranslatef, glRotatef, glClear, glEnable, glLightfv, \
-    glColorMaterial, glCullFace, \
+    glColorMaterial, glCullFace, glGetDoublev, \
     GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_LIGHTING, GL_LIGHT0, \
     GL_POSITION, GL_COLOR_MATERIAL, GL_FRONT, GL_AMBIENT_AND_DIFFUSE, \
-    GL_CULL_FACE, GL_BACK, GL_DEPTH_TEST
+    GL_CULL_FACE, GL_BACK, GL_DEPTH_TEST, GL_MODELVIEW_MATRIX, \
+    GL_PROJECTION_MATRIX
 from OpenGL.GLU import gluPerspective
 from OpenGL.GLUT import glutInit
 import pygame
-from pygame import display, time
+from pygame import display
 from pygame.locals import DOUBLEBUF, OPENGL, QUIT
 
+from armech.graphics.frustum import Frustum
 from armech.graphics.workspace import Workspace
 
 
+class FrameScheduler:
+    """
+    Paces a loop to a fixed rate with deadlines instead of fixed sleeps, the
+    time spent between two calls to wait is taken off the sleep. A loop that
+    falls more than a period behind skips the missed frames instead of
+    rushing to catch up.
+    """
+
+    def __init__(self, rate, clock=perf_counter, sleep_function=sleep):
+        """
+        Create a scheduler, the first deadline is one period from now
+        :param rate: frames per second
+        :param clock: function returning the time in seconds
+        :param sleep_function: function sleeping a number of seconds
+        :return: FrameScheduler object
+        """
+        self.period = 1.0/rate
+        self.clock = clock
+        self.sleep = sleep_function
+        self.start = clock()
+        self.deadline = self.start + self.period
+        self.dropped_frames = 0
+
+    def wait(self):
+        """
+        Sleep until the next deadline
+        :return: time of the deadline that was waited for
+        """
+        now = self.clock()
+        if now > self.deadline + self.period:
+            missed = int((now - self.deadline)/self.period)
+            self.dropped_frames += missed
+            self.deadline += missed*self.period
+        if now < self.deadline:
+            self.sleep(self.deadline - now)
+        deadline = self.deadline
+        self.deadline += self.period
+        return deadline
+
+
 class BaseViewer:
     """
     Basic viewer that provides simple initial_view and update_view functions
     that can be overwritten by subclasses to get more advanced functionality
     """
-    # Update at 30 frames per second
-    UPDATE_PERIOD = 1000//30
+    # Frames per second, a frame is only rendered when the view or the scene
+    # changed
+    FRAME_RATE = 30.0
 
     def __init__(self, workspace):
         """
@@ -49,6 +95,10 @@ class BaseViewer:
         # Register the cb_quit callback
         self.register_callback(QUIT, None, self.cb_quit)
 
+        # Held while rendering, threads that move bodies (see play) hold it
+        # so a frame never shows a half updated robot
+        self.lock = RLock()
+
     def register_callback(self, event_type, event_key, function):
         """ Registers a callback function to the Viewer.
 
@@ -98,17 +148,23 @@ class BaseViewer:
         when inheriting this class to get different response to user input
 
         :param rate: degrees per frame to rotate
+        :return: False if the view did not change, so the frame is only
+        rendered when the scene changed
 
         Note:
             If overriding this function, make sure that it only takes **kwargs
-            as an argument.
+            as an argument. Any return value other than False (including
+            None) renders the frame.
         """
 
         # Get rate or set default
         rate = kwargs.get('rate', 0.4)
 
         # Rotate view
+        if rate == 0.0:
+            return False
         glRotatef(rate, 0.0, 0.0, 1.0)
+        return True
 
     def do_callbacks(self, events):
         """
@@ -139,9 +195,60 @@ class BaseViewer:
         pygame.quit()
         self.exit_flag = True
 
+    @staticmethod
+    def get_frustum(window_size):
+        """
+        Get the frustum of the current OpenGL camera
+        :param window_size: (x, y) size of the viewing window in pixels
+        :return: Frustum object
+        """
+        # OpenGL matrices are column major
+        return Frustum(
+            dot(glGetDoublev(GL_PROJECTION_MATRIX).T,
+                glGetDoublev(GL_MODELVIEW_MATRIX).T),
+            window_size
+        )
+
+    def play(self, robot_name, trajectory, rate=None, loop=False):
+        """
+        Play a trajectory in real time on a background thread, independent
+        of the frames shown by show. The thread ends with the trajectory, or
+        when the viewer is closed if loop is True.
+        :param robot_name: name of the robot that follows the trajectory
+        :param trajectory: joint space Trajectory object (see
+        armech.core.trajectory)
+        :param rate: joint state updates per second, FRAME_RATE if None
+        :param loop: bool, start over at the end of the trajectory
+        :return: the started threading.Thread
+        """
+        robot = self.workspace.robots[robot_name]
+        scheduler = FrameScheduler(
+            self.FRAME_RATE if rate is None else rate
+        )
+
+        def advance():
+            while not self.exit_flag:
+                t = scheduler.wait() - scheduler.start
+                if loop and trajectory.duration > 0.0:
+                    t %= trajectory.duration
+                q, _, _ = trajectory.sample(t)
+                with self.lock:
+                    robot.move_joints(q[0])
+                if t >= trajectory.duration and not loop:
+                    break
+
+        with self.lock:
+            robot.move_joints(trajectory.sample(0.0)[0][0])
+        thread = Thread(target=advance, daemon=True)
+        thread.start()
+        return thread
+
     def show(self, window_size=(800, 600), **kwargs):
         """
-        Open a window showing the scene.
+        Open a window showing the scene. Frames are paced by a FrameScheduler
+        at FRAME_RATE and a frame is only rendered when the view changed, an
+        event arrived or a body of the workspace moved. Bodies out of view
+        are culled and distant ones are drawn at a lower level of detail.
         :param window_size: (x, y) size of the viewing window in pixels
         :param kwargs: kwargs to pass to the update function
         """
@@ -168,20 +275,28 @@ class BaseViewer:
         # Place the light
         glLightfv(GL_LIGHT0, GL_POSITION, self.workspace.position_light)
 
-        # Display the workspace
+        # Display the workspace, vertex buffers from an earlier window are
+        # not valid in the new context
+        self.workspace.release_graphics()
         self.initial_view()
-        self.workspace.render_all()
+        scene_version = None
 
         # Start event loop
+        scheduler = FrameScheduler(self.FRAME_RATE)
         while not self.exit_flag:
             events = pygame.event.get()
             self.do_callbacks(events)
-            if not self.exit_flag:
-                self.update_view(**kwargs)
-                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-                self.workspace.render_all()
-                display.flip()
-                time.wait(self.UPDATE_PERIOD)
+            if self.exit_flag:
+                break
+            with self.lock:
+                view_changed = self.update_view(**kwargs) is not False
+                version = self.workspace.get_scene_version()
+                if view_changed or events or version != scene_version:
+                    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                    self.workspace.render_all(self.get_frustum(window_size))
+                    display.flip()
+                    scene_version = version
+            scheduler.wait()
 
 
 # TODO: add a WorkspaceViewer class that accepts user input to rotate view
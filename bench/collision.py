@@ -0,0 +1,64 @@
+## collision.py
+#
+# Benchmark for collision checking. Reports the number of joint
+# configurations checked per second when moving the robot to each one and
+# when checking all of them as one batch.
+#
+# Run from the repository root with: python -m bench.collision
+
+from time import perf_counter
+
+from numpy import pi
+from numpy.random import RandomState
+
+from armech.demo.robot import Simple3DOF
+from armech.graphics.shapes import Box, Cylinder
+from armech.graphics.workspace import Workspace
+
+
+def workspace():
+    """Simple3DOF robot between a box and a cylinder."""
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    box = Box((-0.05, 0.05), (-0.05, 0.05), (-0.05, 0.05))
+    box.set_transform(translation=(0.7, 0.04, 0.1))
+    ws.add_obstacle('box', box)
+    cylinder = Cylinder(0.6, 0.1, 4)
+    cylinder.set_transform(translation=(0.0, 0.5, 0.4))
+    ws.add_obstacle('cylinder', cylinder)
+    return ws
+
+
+def bench_move(ws, q):
+    """Move the robot to each configuration and check it."""
+    robot = ws.robots['Simple3DOF']
+    start = perf_counter()
+    for q_k in q:
+        robot.move_joints(q_k)
+        ws.in_collision()
+    elapsed = perf_counter() - start
+    print('move_joints    configurations={:<6} {:>9.0f} checks/s'.format(
+        q.shape[0], q.shape[0]/elapsed))
+
+
+def bench_batch(ws, q, distances=False, n_processes=None, exact=True):
+    """Check all configurations as one batch."""
+    start = perf_counter()
+    ws.in_collision_batch('Simple3DOF', q, distances, n_processes, exact)
+    elapsed = perf_counter() - start
+    print('batch          configurations={:<6} {:>9.0f} checks/s  '
+          'distances={} processes={} exact={}'.format(
+              q.shape[0], q.shape[0]/elapsed, distances, n_processes, exact))
+
+
+if __name__ == '__main__':
+    ws = workspace()
+    q = RandomState(0).uniform(-pi, pi, (10000, 3))
+    bench_move(ws, q[0:1000])
+    bench_batch(ws, q)
+    bench_batch(ws, q, n_processes=4)
+    bench_batch(ws, q[0:200], distances=True)
+    bench_batch(ws, q, exact=False)
+    bench_batch(ws, q, distances=True, exact=False)
@@ -0,0 +1,65 @@
+## ikine.py
+#
+# Benchmark for the numerical inverse kinematics solver. Reports the number
+# of solves per second for batches of random reachable targets and for
+# warm started trajectory tracking.
+#
+# Run from the repository root with: python -m bench.ikine
+
+from time import perf_counter
+
+from numpy import pi, linspace
+from numpy.random import RandomState
+
+from armech.config import JOINT_REVOLUTE
+from armech.core.ikine import IKSolver
+from armech.core.linkdh import LinkDH
+from armech.core.seriallink import SerialLink
+from armech.demo.robot import Simple3DOF
+
+
+def puma560():
+    """Kinematic model of a 6 DOF PUMA 560 style arm (no graphics)."""
+    return SerialLink([
+        LinkDH(JOINT_REVOLUTE, 0.0, pi/2, 0.672),
+        LinkDH(JOINT_REVOLUTE, 0.4318, 0.0, 0.0),
+        LinkDH(JOINT_REVOLUTE, 0.0203, -pi/2, 0.15005),
+        LinkDH(JOINT_REVOLUTE, 0.0, pi/2, 0.4318),
+        LinkDH(JOINT_REVOLUTE, 0.0, -pi/2, 0.0),
+        LinkDH(JOINT_REVOLUTE, 0.0, 0.0, 0.0),
+    ], name='puma560')
+
+
+def bench_batch(robot, n_targets, n_seeds):
+    """Solve a batch of random reachable targets."""
+    solver = IKSolver(robot, n_seeds=n_seeds, random_seed=0)
+    q = RandomState(1).uniform(-pi, pi, (n_targets, robot.num_links))
+    targets = robot.get_tool_trans_batch(q)
+    start = perf_counter()
+    _, success = solver.solve(targets)
+    elapsed = perf_counter() - start
+    print('{:>10} batch  targets={:<6} seeds={:<3} {:>9.0f} solves/s  '
+          'success={:.1%}'.format(robot.name, n_targets, n_seeds,
+                                  n_targets/elapsed, success.mean()))
+
+
+def bench_track(robot, n_steps):
+    """Track a smooth trajectory with warm starts."""
+    solver = IKSolver(robot, random_seed=0)
+    q0 = RandomState(2).uniform(-pi/2, pi/2, robot.num_links)
+    q = q0 + linspace(0.0, 0.5, n_steps)[:, None]
+    targets = robot.get_tool_trans_batch(q)
+    start = perf_counter()
+    results = list(solver.track(targets, q0=q0))
+    elapsed = perf_counter() - start
+    success = sum(result[1] for result in results)/float(n_steps)
+    print('{:>10} track  steps={:<8}          {:>9.0f} solves/s  '
+          'success={:.1%}'.format(robot.name, n_steps, n_steps/elapsed,
+                                  success))
+
+
+if __name__ == '__main__':
+    for robot in (Simple3DOF(), puma560()):
+        for n_targets in (1, 100, 10000):
+            bench_batch(robot, n_targets, 8)
+        bench_track(robot, 1000)
@@ -0,0 +1,74 @@
+## workspace.py
+#
+# Benchmark for Workspace.step. Reports the number of robot steps (forward
+# kinematics, inverse dynamics and collision checks of one robot) per second
+# for a cell of robots, advanced in this process and on worker pools of
+# increasing size up to the number of CPUs.
+#
+# Run from the repository root with: python -m bench.workspace
+
+from multiprocessing import cpu_count
+from time import perf_counter
+
+from numpy import pi
+from numpy.random import RandomState
+
+from armech.demo.robot import Simple3DOF
+from armech.graphics.shapes import Box
+from armech.graphics.workspace import Workspace
+from armech.graphics.workspacepool import WorkspacePool
+
+
+def workspace(n_robots):
+    """Grid of Simple3DOF robots with physics and a box next to each."""
+    ws = Workspace((-5.0, 5.0), (-5.0, 5.0), (0.0, 2.0))
+    random = RandomState(0)
+    for k in range(n_robots):
+        x = 1.2*(k % 8) - 4.2
+        y = 1.2*(k//8) - 4.2
+        robot = Simple3DOF()
+        robot.set_global_transform(translation=(x, y, 0.0))
+        for link in robot.links:
+            link.set_physics(random.uniform(1.0, 3.0),
+                             random.uniform(-0.05, 0.05, 3),
+                             random.uniform(0.01, 0.02, 3),
+                             (0.0, 0.0, 0.0))
+        ws.add_robot('robot_{}'.format(k), robot)
+        box = Box((-0.1, 0.1), (-0.1, 0.1), (0.0, 0.4))
+        box.set_transform(translation=(x + 0.5, y, 0.0))
+        ws.add_obstacle('box_{}'.format(k), box)
+    return ws
+
+
+def states(ws, n_steps):
+    """Random joint states, velocities and accelerations of every robot for
+    each step."""
+    random = RandomState(1)
+    return [tuple(dict((name, random.uniform(-pi, pi, 3))
+                       for name in ws.robots) for _ in range(3))
+            for _ in range(n_steps)]
+
+
+def bench_step(ws, steps, pool=None):
+    """Advance all robots through the steps."""
+    ws.step(*steps[0], pool=pool)
+    start = perf_counter()
+    for q, qd, qdd in steps:
+        ws.step(q, qd, qdd, pool=pool)
+    elapsed = perf_counter() - start
+    print('robots={:<4} processes={:<4} {:>9.0f} robot steps/s'.format(
+        len(ws.robots), pool.n_processes if pool else '-',
+        len(steps)*len(ws.robots)/elapsed))
+
+
+if __name__ == '__main__':
+    ws = workspace(32)
+    steps = states(ws, 20)
+    bench_step(ws, steps)
+    n_processes = 1
+    while True:
+        with WorkspacePool(ws, n_processes) as pool:
+            bench_step(ws, steps, pool)
+        if n_processes >= cpu_count():
+            break
+        n_processes = min(2*n_processes, cpu_count())
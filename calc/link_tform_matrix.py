@@ -24,15 +24,16 @@ tform_1 = Matrix([
 ])
 
 # Second, calculate the transform from the axis of the joint to the end of
-# the joint;
+# the joint (LinkDH.body_transform);
 tform_2 = Matrix([
-    [1, 0,           0,          a],
-    [0, cos(alpha),  sin(alpha), 0],
-    [0, -sin(alpha), cos(alpha), 0],
-    [0, 0,           0,          1],
+    [1, 0,          0,           a],
+    [0, cos(alpha), -sin(alpha), 0],
+    [0, sin(alpha), cos(alpha),  0],
+    [0, 0,          0,           1],
 ])
 
-# Calculate the overall transform and display
+# Calculate the overall transform and display, this is the closed form used
+# by DHChain.get_link_transforms
 tform = tform_1 * tform_2
 pprint(tform_1)
 pprint(tform_2)
@@ -2,12 +2,28 @@
 #
 # tests to show that the graphics are working properly
 
-from numpy import float_, pi
-from numpy.testing import assert_array_almost_equal
+from numpy import float_, pi, ones, einsum, sort, arange, meshgrid, tan, \
+    concatenate, zeros, dot
+from numpy.linalg import norm
+from numpy.random import RandomState
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+from pytest import raises
 
 from armech.graphics.workspace import Workspace
+from armech.graphics.workspacepool import WorkspacePool
+from armech.graphics.graphicalbody import GraphicalBody
 from armech.graphics.shapes import Box, Cylinder
+from armech.graphics.meshio import read_obj, load_obj, load_obj_lods
+from armech.graphics.meshlod import decimate, LOD_LEVELS
+from armech.graphics.frustum import Frustum
+from armech.core.collision import triangles_intersect, sweep_and_prune, \
+    meshes_distance
+from armech.core.planning import KDTree, RRTConnect, PRM, EDGE_UNKNOWN
+from armech.core.trajectory import TrapezoidalTrajectory
+from armech.graphics.offscreen import OffscreenRenderer, write_ppm, \
+    _rotation
 from test.testviewer import UserYesNoTestViewer
+from armech.graphics.workspaceviewer import BaseViewer, FrameScheduler
 from armech.demo.robot import Simple3DOF
 
 
@@ -63,3 +79,603 @@ def test_simple3dof_displays_correctly():
     ws.add_robot('Simple3DOF', robot)
     view = UserYesNoTestViewer(ws, "Is the Simple 3 DOF robot displayed correctly?")
     view.show()
+
+
+def test_world_vertices_follow_transform():
+
+    # World geometry is only calculated when it is used
+    box = Box((0.0, 1.0), (0.0, 2.0), (0.0, 3.0))
+    box.set_transform(rotation=((0.0, -1.0, 0.0),
+                                (1.0, 0.0, 0.0),
+                                (0.0, 0.0, 1.0)),
+                      translation=(1.0, 0.0, 0.0))
+    assert_array_almost_equal(box.world_vertices[:, 6], (-1.0, 1.0, 3.0))
+    assert_array_almost_equal(box.world_face_normals[:, 2], (1.0, 0.0, 0.0))
+    box.set_transform(translation=(0.0, 0.0, 1.0))
+    assert_array_almost_equal(box.world_vertices[:, 6], (-2.0, 1.0, 4.0))
+
+
+def test_obj_face_formats_and_cache(tmpdir):
+
+    # A quad with normals and texture coordinates, and a triangle using
+    # negative (relative) indices
+    obj_file = tmpdir.join('mesh.obj')
+    obj_file.write('\n'.join((
+        'v 0 0 0', 'v 1 0 0', 'v 1 1 0', 'v 0 1 0',
+        'vt 0 0', 'vn 0 0 1',
+        'f 1/1/1 2/1/1 3/1/1 4/1/1',
+        'f -4//1 -2//1 -1//1',
+    )))
+    vertices, faces, normals, face_normals = read_obj(str(obj_file))
+    assert_array_equal(faces, ((0, 1, 2), (0, 2, 3), (0, 2, 3)))
+    assert_array_equal(face_normals, ((0, 0, 0), (0, 0, 0), (0, 0, 0)))
+    assert_array_almost_equal(normals, ((0.0, 0.0, 1.0),))
+
+    # The second load is read from the cache
+    load_obj(str(obj_file))
+    assert tmpdir.join('mesh.obj.npz').check()
+    cached = load_obj(str(obj_file))
+    assert_array_almost_equal(cached[0], vertices)
+    assert_array_equal(cached[1], faces)
+
+
+def test_obj_objects_and_mixed_formats(tmpdir):
+
+    # Two objects with relative indices, indented and tab separated
+    # statements
+    obj_file = tmpdir.join('objects.obj')
+    obj_file.write('\n'.join((
+        'o first', 'v 0 0 0', 'v 1 0 0', '  v 0 1 0', 'f -3 -2 -1',
+        'o second', 'v\t0 0 1', 'v 1 0 1', 'v 0 1 1', 'vn 0 0 1',
+        'f\t-3//-1 -2//-1 -1//-1',
+    )))
+    vertices, faces, _, face_normals = read_obj(str(obj_file))
+    assert vertices.shape == (6, 3)
+    assert_array_equal(faces, ((0, 1, 2), (3, 4, 5)))
+    assert_array_equal(face_normals, ((-1, -1, -1), (0, 0, 0)))
+
+    # Faces with different vertex formats
+    obj_file.write('\n'.join((
+        'v 0 0 0', 'v 1 0 0', 'v 0 1 0', 'v 1 1 0', 'vn 0 0 1',
+        'f 1 2 3', 'f 1//1 2//1 4//1', 'f 2/1/1 4 3/1',
+    )))
+    _, faces, _, face_normals = read_obj(str(obj_file))
+    assert_array_equal(faces, ((0, 1, 2), (0, 1, 3), (1, 3, 2)))
+    assert_array_equal(face_normals,
+                       ((-1, -1, -1), (0, 0, 0), (0, -1, -1)))
+
+    # Index 0 and indices out of range are errors
+    for face in ('f 0 1 2', 'f 1 2 5', 'f -1 -2 -5'):
+        obj_file.write('\n'.join(('v 0 0 0', 'v 1 0 0', 'v 0 1 0', face)))
+        with raises(ValueError):
+            read_obj(str(obj_file))
+
+
+def test_degenerate_faces_and_smooth_normals():
+
+    # The second triangle has zero area
+    body = GraphicalBody()
+    body.set_graphics(
+        ((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (2.0, 0.0, 0.0)),
+        ((0, 1, 2), (0, 1, 3)),
+        smooth_normals=True
+    )
+    assert_array_equal(body.degenerate_faces, (False, True))
+    assert_array_almost_equal(body.face_normals.T, ((0, 0, 1), (0, 0, 0)))
+    assert_array_almost_equal(body.vertex_normals.T,
+                              ((0, 0, 1), (0, 0, 1), (0, 0, 1), (0, 0, 0)))
+
+    # Vertex normals of a box point away from the center
+    box = Box((-1.0, 1.0), (-1.0, 1.0), (-1.0, 1.0))
+    box.set_graphics(box.vertices.T, box.faces.T, smooth_normals=True)
+    assert (einsum('ij,ij->j', box.vertex_normals, box.vertices) > 0).all()
+    assert_array_almost_equal(norm(box.vertex_normals, axis=0), ones(8))
+    assert_array_almost_equal(box.bounds_z, (-1.0, 1.0))
+
+
+def test_triangle_intersection():
+
+    triangle = float_(((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0)))
+    others = float_((
+        # Crossing, separated, coplanar overlapping, coplanar separated and
+        # touching at a vertex
+        ((0.2, 0.2, -1.0), (0.2, 0.2, 1.0), (0.3, -1.0, 0.0)),
+        ((0.2, 0.2, 0.5), (0.2, 0.2, 1.0), (0.3, -1.0, 0.5)),
+        ((0.2, 0.2, 0.0), (2.0, 0.2, 0.0), (0.2, 2.0, 0.0)),
+        ((1.0, 1.0, 0.0), (2.0, 1.0, 0.0), (1.0, 2.0, 0.0)),
+        ((1.0, 0.0, 0.0), (2.0, 0.0, 1.0), (2.0, 1.0, 0.0)),
+    ))
+    assert_array_equal(
+        triangles_intersect(float_([triangle]*5), others),
+        (True, False, True, False, True)
+    )
+    assert_array_equal(
+        sweep_and_prune(((0, 0, 0), (2, 2, 2), (0.5, 0.5, 0.5)),
+                        ((1, 1, 1), (3, 3, 3), (1.5, 1.5, 1.5))),
+        ((0, 2),)
+    )
+
+
+def test_workspace_collisions():
+
+    # Put a box at the tool of the robot and another one out of reach
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    box = Box((-0.05, 0.05), (-0.05, 0.05), (-0.05, 0.05))
+    box.set_transform(translation=(0.7, 0.04, 0.1))
+    ws.add_obstacle('box', box)
+    far_box = Box((-0.05, 0.05), (-0.05, 0.05), (-0.05, 0.05))
+    far_box.set_transform(translation=(0.9, 0.9, 1.5))
+    ws.add_obstacle('far_box', far_box)
+
+    assert ws.get_collisions() == [(robot.links[2], box)]
+    assert ws.in_collision('Simple3DOF')
+    robot.move_joints([pi/2, 0.0, 0.0])
+    assert not ws.in_collision()
+
+
+def test_workspace_collisions_batch():
+
+    # Batch results match moving the robot to each configuration
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    box = Box((-0.05, 0.05), (-0.05, 0.05), (-0.05, 0.05))
+    box.set_transform(translation=(0.7, 0.04, 0.1))
+    ws.add_obstacle('box', box)
+    q = float_((
+        (0.0, 0.0, 0.0),
+        (pi/2, 0.0, 0.0),
+        (0.1, 0.2, -0.3),
+        (0.0, 0.3, -0.6),
+    ))
+    collision, distance = ws.in_collision_batch('Simple3DOF', q,
+                                                distances=True)
+    for k in range(q.shape[0]):
+        robot.move_joints(q[k])
+        assert collision[k] == ws.in_collision()
+        assert_array_almost_equal(distance[k], min(
+            meshes_distance(link.bvh, link.rotation, link.translation[:, 0],
+                            box.bvh, box.rotation, box.translation[:, 0])
+            for link in robot.links
+        ))
+    assert collision[0] and not collision[1]
+    assert distance[0] == 0.0 and distance[1] > 0.0
+
+
+def test_proxy_spheres_and_signed_distances():
+
+    # Primitive signed distances, negative inside
+    box = Box((-1.0, 1.0), (-1.0, 1.0), (-1.0, 1.0))
+    cylinder = Cylinder(2.0, 0.5)
+    points = float_(((0.0, 0.0, 0.0), (2.0, 0.0, 0.0), (2.0, 2.0, 0.0)))
+    assert_array_almost_equal(box.get_signed_distance(points),
+                              (-1.0, 1.0, 2**0.5))
+    assert_array_almost_equal(cylinder.get_signed_distance(points),
+                              (-0.5, 1.5, 8**0.5 - 0.5))
+
+    # The spheres contain all vertices of a mesh
+    robot = Simple3DOF()
+    for link in robot.links:
+        bvh = link.bvh
+        assert 0 < bvh.sphere_radii.size <= 16
+        distance = norm(link.vertices.T[:, None] - bvh.sphere_centers,
+                        axis=2) - bvh.sphere_radii
+        assert (distance.min(axis=1) <= 1e-12).all()
+
+    # Proxy results are conservative
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    cylinder = Cylinder(0.6, 0.1, 4)
+    cylinder.set_transform(translation=(0.0, 0.5, 0.4))
+    ws.add_obstacle('cylinder', cylinder)
+    q = RandomState(0).uniform(-pi, pi, (200, 3))
+    collision, distance = ws.in_collision_batch('Simple3DOF', q, True)
+    proxy_collision, proxy_distance = ws.in_collision_batch(
+        'Simple3DOF', q, True, exact=False
+    )
+    assert collision.any()
+    assert (proxy_collision | ~collision).all()
+    assert (proxy_distance <= distance + 1e-12).all()
+
+
+def test_motion_planning(tmpdir):
+
+    # The arm has to lift over a wall between the start and the goal
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    wall = Box((-0.05, 0.05), (-0.02, 0.02), (0.0, 0.35))
+    wall.set_transform(translation=(0.5, 0.0, 0.0))
+    ws.add_obstacle('wall', wall)
+    q_start = float_((-0.4, 0.0, 0.0))
+    q_goal = float_((0.4, 0.0, 0.0))
+
+    def assert_path_free(path):
+        assert_array_almost_equal(path[[0, -1]], (q_start, q_goal))
+        checker = RRTConnect(ws, 'Simple3DOF', resolution=0.01)
+        assert not checker.in_collision(path).any()
+        assert checker.edges_free(path[:-1], path[1:]).all()
+
+    assert not RRTConnect(ws, 'Simple3DOF').edges_free(q_start, q_goal)[0]
+    assert_path_free(
+        RRTConnect(ws, 'Simple3DOF', random_seed=0).plan(q_start, q_goal)
+    )
+
+    # Nearest neighbors of the KD-tree match brute force
+    points = RandomState(0).uniform(size=(500, 3))
+    distances, indices = KDTree(points).query(points[0:20], 4)
+    brute = norm(points[0:20, None] - points, axis=2)
+    assert_array_equal(indices, brute.argsort(axis=1)[:, 0:4])
+    assert_array_almost_equal(distances, sort(brute, axis=1)[:, 0:4])
+
+    # The roadmap is reused after saving and loading it
+    prm = PRM(ws, 'Simple3DOF', random_seed=0)
+    prm.build(300)
+    path = prm.plan(q_start, q_goal)
+    assert_path_free(path)
+    file_name = str(tmpdir.join('roadmap.npz'))
+    prm.save(file_name)
+    prm = PRM.load(file_name, ws, 'Simple3DOF')
+    assert (prm.edge_states != EDGE_UNKNOWN).any()
+    assert_array_almost_equal(prm.plan(q_start, q_goal), path)
+
+    # Blocking the path is repaired, and removing the block frees it again
+    robot.move_joints(path[len(path)//2])
+    block = Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1))
+    block.set_transform(translation=robot.tool_transform[0:3, 3])
+    ws.add_obstacle('block', block)
+    assert_path_free(prm.plan(q_start, q_goal))
+    assert not prm.node_free.all()
+    ws.remove_obstacle('block')
+    assert prm.update() and prm.node_free.all()
+    assert_array_almost_equal(prm.plan(q_start, q_goal), path)
+
+
+def test_robots_share_link_meshes():
+
+    robots = [Simple3DOF() for _ in range(3)]
+    robots[1].set_global_transform(translation=(0.5, 0.0, 0.0))
+    for links in zip(*(robot.links for robot in robots)):
+        assert all(link.mesh is links[0].mesh for link in links)
+        assert links[0].bvh is links[1].bvh
+        assert links[0].vertices is links[2].vertices
+        assert not links[0].vertices.flags.writeable
+
+    # Only the pose belongs to the body
+    link = robots[1].links[0]
+    assert_array_almost_equal(
+        link.world_vertices - robots[0].links[0].world_vertices,
+        ones((3, link.n_vertices))*((0.5,), (0.0,), (0.0,))
+    )
+
+    # Setting new geometry does not touch the shared mesh
+    link.set_graphics(2.0*link.vertices.T, link.faces.T)
+    assert link.mesh is not robots[0].links[0].mesh
+    assert_array_almost_equal(robots[0].links[0].vertices,
+                              robots[2].links[0].vertices)
+
+
+def test_offscreen_rendering(tmpdir):
+
+    ws = Workspace((-0.5, 0.5), (-0.5, 0.5), (0.0, 1.0),
+                   face_color=(0.8, 0.8, 0.8))
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0, 0, 0.1])
+    ws.add_robot('Simple3DOF', robot)
+    renderer = OffscreenRenderer(ws, size=(160, 120))
+    image = renderer.render()
+    assert image.shape == (120, 160, 3)
+    assert (image != 0).any() and (image == 0).any()
+
+    # Batched frames match single renders and leave the robot where it was
+    q = float_([[0.0, 0.0, 0.0], [pi/2, -pi/2, pi/2], [pi, -pi/4, 0.0]])
+    frames = renderer.render_states('Simple3DOF', q)
+    assert frames.shape == (3, 120, 160, 3)
+    assert (frames[0] != frames[1]).any()
+    assert_array_equal(frames[0], image)
+    assert_array_equal(robot.state, (0.0, 0.0, 0.0))
+    robot.move_joints(q[2])
+    assert_array_equal(renderer.render(), frames[2])
+
+    # A yellow obstacle in front of the camera
+    renderer.look_at((2.0, 0.0, 0.5), (0.0, 0.0, 0.5))
+    box = Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1),
+              face_color=(1.0, 1.0, 0.0))
+    box.set_transform(translation=(1.0, 0.0, 0.5))
+    ws.add_obstacle('box', box)
+    image = renderer.render()
+    assert image[60, 80, 0] > 0 and image[60, 80, 0] == image[60, 80, 1]
+    assert image[60, 80, 2] == 0
+
+    trajectory = TrapezoidalTrajectory(q[0], q[1], 3*[2.0], 3*[4.0])
+    frames = renderer.render_trajectory('Simple3DOF', trajectory, 10.0)
+    assert frames.shape[0] == trajectory.sample_rate(10.0)[0].shape[0]
+    write_ppm(str(tmpdir.join('frame.ppm')), frames[-1])
+    with open(str(tmpdir.join('frame.ppm')), 'rb') as ppm_file:
+        assert ppm_file.read(15) == b'P6\n160 120\n255\n'
+
+
+def test_offscreen_camera_rotations():
+
+    # glRotatef(30, ...) about the x, y and z axes
+    c, s = 0.75**0.5, 0.5
+    expected = (
+        ((1.0, 0.0, 0.0), (0.0, c, -s), (0.0, s, c)),
+        ((c, 0.0, s), (0.0, 1.0, 0.0), (-s, 0.0, c)),
+        ((c, -s, 0.0), (s, c, 0.0), (0.0, 0.0, 1.0)),
+    )
+    for axis in range(3):
+        rotation = _rotation(30.0, axis)
+        assert_array_almost_equal(rotation[0:3, 0:3], expected[axis])
+        assert_array_equal(rotation[3], (0.0, 0.0, 0.0, 1.0))
+        assert_array_equal(rotation[0:3, 3], (0.0, 0.0, 0.0))
+
+
+def test_frame_scheduler_and_playback():
+
+    # Deadlines do not drift with the time spent between frames
+    now = [0.0]
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    scheduler = FrameScheduler(10.0, clock=lambda: now[0],
+                               sleep_function=fake_sleep)
+    now[0] += 0.03
+    assert abs(scheduler.wait() - 0.1) < 1e-12
+    assert abs(sleeps[-1] - 0.07) < 1e-12
+    now[0] += 0.08
+    assert abs(scheduler.wait() - 0.2) < 1e-12
+    assert abs(sleeps[-1] - 0.02) < 1e-12
+
+    # A late frame skips the missed deadlines
+    now[0] += 0.45
+    assert abs(scheduler.wait() - 0.6) < 1e-12
+    assert scheduler.dropped_frames == 3
+    assert abs(scheduler.wait() - 0.7) < 1e-12
+
+    # The scene version changes when a body moves
+    ws = Workspace((-0.5, 0.5), (-0.5, 0.5), (0.0, 1.0))
+    robot = Simple3DOF()
+    ws.add_robot('Simple3DOF', robot)
+    version = ws.get_scene_version()
+    assert ws.get_scene_version() == version
+    robot.move_joints([0.1, 0.0, 0.0])
+    assert ws.get_scene_version() != version
+
+    # Replacing a released body by a new one, which may get its id
+    ws.add_obstacle('a', Box((-0.1, 0.1), (-0.1, 0.1), (0.0, 0.2)))
+    version = ws.get_scene_version()
+    ws.remove_obstacle('a')
+    ws.add_obstacle('b', Box((-0.1, 0.1), (-0.1, 0.1), (0.0, 0.2)))
+    assert ws.get_scene_version() != version
+
+    # Playback runs on its own thread in real time
+    trajectory = TrapezoidalTrajectory((0.0, 0.0, 0.0), (0.2, -0.1, 0.1),
+                                       3*[2.0], 3*[4.0])
+    viewer = BaseViewer(ws)
+    thread = viewer.play('Simple3DOF', trajectory, rate=100.0)
+    thread.join(5.0)
+    assert not thread.is_alive()
+    assert_array_almost_equal(robot.state, (0.2, -0.1, 0.1))
+
+
+def test_static_batch_tracks_moving_bodies():
+
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    boxes = [Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1),
+                 face_color=(1.0, 0.0, 0.0)) for _ in range(3)]
+    for k, box in enumerate(boxes):
+        box.set_transform(translation=(0.5*k, 0.0, 0.5))
+        ws.add_obstacle('box_{}'.format(k), box)
+    ws.add_robot('Simple3DOF', Simple3DOF())
+
+    # One batch of the workspace and obstacles in world coordinates
+    batch, moving = ws.get_static_batch()
+    assert moving == []
+    assert batch.n_vertices == 3*(ws.n_faces + 3*boxes[0].n_faces)
+    corners = boxes[2].world_vertices[:, boxes[2].faces].transpose((2, 1, 0))
+    assert_array_almost_equal(batch.data[-3*boxes[2].n_faces:, 0:3],
+                              corners.reshape((-1, 3)))
+    assert_array_equal(batch.data[-1, 6:9], (1.0, 0.0, 0.0))
+
+    # Robots moving does not touch the batch
+    ws.robots['Simple3DOF'].move_joints([0.3, 0.2, 0.1])
+    assert ws.get_static_batch()[0] is batch
+
+    # A moved obstacle leaves the batch once and is rendered on its own
+    boxes[1].set_transform(translation=(0.0, 0.5, 0.5))
+    batch, moving = ws.get_static_batch()
+    assert moving == [boxes[1]]
+    assert batch.n_vertices == 3*(ws.n_faces + 2*boxes[0].n_faces)
+    boxes[1].set_transform(translation=(0.0, 0.6, 0.5))
+    assert ws.get_static_batch() == (batch, moving)
+
+    # Changes to the batched bodies merge it again
+    boxes[0].face_color = float_((0.0, 0.0, 1.0))
+    assert ws.get_static_batch()[0] is not batch
+    ws.remove_obstacle('box_1')
+    ws.add_obstacle('box_3', Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1)))
+    batch, moving = ws.get_static_batch()
+    assert moving == []
+    assert batch.n_vertices == 3*(ws.n_faces + 3*boxes[0].n_faces)
+
+
+def test_static_batch_remove_then_add():
+
+    # The removed box is released before the new one is made, so the new box
+    # may get the same id
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    ws.add_obstacle('a', Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1)))
+    batch, _ = ws.get_static_batch()
+    ws.remove_obstacle('a')
+    box = Box((-0.1, 0.1), (-0.1, 0.1), (-0.1, 0.1))
+    box.set_transform(translation=(0.5, 0.0, 0.5))
+    ws.add_obstacle('b', box)
+
+    new_batch, moving = ws.get_static_batch()
+    assert new_batch is not batch
+    assert moving == []
+    corners = box.world_vertices[:, box.faces].transpose((2, 1, 0))
+    assert_array_almost_equal(new_batch.data[-3*box.n_faces:, 0:3],
+                              corners.reshape((-1, 3)))
+
+
+def test_mesh_levels_of_detail(tmpdir, monkeypatch):
+
+    # A 160 x 160 grid of squares in the xy plane
+    x, y = meshgrid(arange(161.0), arange(161.0), indexing='ij')
+    vertices = concatenate((x.reshape((-1, 1)), y.reshape((-1, 1)),
+                            zeros((161**2, 1))), axis=1)
+    corner = (161*arange(160)[:, None] + arange(160)).reshape(-1)
+    faces = concatenate((
+        float_((corner, corner + 161, corner + 162)).T,
+        float_((corner, corner + 162, corner + 1)).T,
+    )).astype(int)
+    coarse_vertices, coarse_faces = decimate(vertices, faces, 4.0)
+    assert coarse_faces.shape[0] < faces.shape[0]//4
+    assert coarse_faces.max() == coarse_vertices.shape[0] - 1
+    assert (coarse_vertices.min(axis=0) >= 0.0).all()
+    assert (coarse_vertices.max(axis=0) <= 160.0).all()
+    # The triangles still face up
+    v = coarse_vertices[coarse_faces]
+    assert ((v[:, 1, 0] - v[:, 0, 0])*(v[:, 2, 1] - v[:, 0, 1]) -
+            (v[:, 1, 1] - v[:, 0, 1])*(v[:, 2, 0] - v[:, 0, 0]) > 0).all()
+
+    # The levels are cached next to the .obj file
+    obj_file = tmpdir.join('grid.obj')
+    obj_text = '\n'.join(
+        ['v {} {} {}'.format(*vertex) for vertex in vertices] +
+        ['f {} {} {}'.format(*(face + 1)) for face in faces]
+    )
+    obj_file.write(obj_text)
+    lods = load_obj_lods(str(obj_file))
+    assert tmpdir.join('grid.obj.lod.npz').check()
+    assert len(lods) == LOD_LEVELS
+    assert all(lods[k + 1][1].shape[0] < lods[k][1].shape[0]
+               for k in range(LOD_LEVELS - 1))
+    for lod, cached in zip(lods, load_obj_lods(str(obj_file))):
+        assert_array_almost_equal(cached[0], lod[0])
+        assert_array_equal(cached[1], lod[1])
+
+    # Bodies share the levels of their mesh
+    body = GraphicalBody()
+    body.load_obj(str(obj_file))
+    assert len(body.mesh.lods) == LOD_LEVELS
+    assert body.mesh.get_lod(0) is body.mesh
+    assert body.mesh.get_lod(LOD_LEVELS + 5) is body.mesh.lods[-1]
+
+    # Without the cache the source is still parsed only once
+    calls = []
+
+    def counted_read_obj(obj_file_name):
+        calls.append(obj_file_name)
+        return read_obj(obj_file_name)
+
+    monkeypatch.setattr('armech.graphics.meshio.read_obj', counted_read_obj)
+    uncached_file = tmpdir.join('uncached.obj')
+    uncached_file.write(obj_text)
+    body = GraphicalBody()
+    body.load_obj(str(uncached_file), use_cache=False)
+    assert calls == [str(uncached_file)]
+    assert len(body.mesh.lods) == LOD_LEVELS
+    assert not tmpdir.join('uncached.obj.npz').check()
+
+
+def test_frustum_culling():
+
+    # A camera at x = 5 looking at the origin
+    ws = Workspace((-1.0, 1.0), (-1.0, 1.0), (0.0, 2.0))
+    renderer = OffscreenRenderer(ws, size=(400, 300))
+    renderer.look_at((5.0, 0.0, 0.0), (0.0, 0.0, 0.0))
+    near, far, focal = 0.1, 100.0, 1.0/tan(pi/8)
+    projection = float_((
+        (focal*300/400, 0.0, 0.0, 0.0),
+        (0.0, focal, 0.0, 0.0),
+        (0.0, 0.0, (far + near)/(near - far), 2*far*near/(near - far)),
+        (0.0, 0.0, -1.0, 0.0),
+    ))
+    frustum = Frustum(dot(projection, renderer.view), (400, 300))
+
+    positions = ((0.0, 0.0, 0.0), (10.0, 0.0, 0.0), (0.0, 50.0, 0.0),
+                 (-60.0, 0.0, 0.0), (0.0, 2.3, 0.0), (-200.0, 0.0, 0.0))
+    boxes = []
+    for position in positions:
+        box = Box((-0.5, 0.5), (-0.5, 0.5), (-0.5, 0.5))
+        box.set_transform(translation=position)
+        boxes.append(box)
+    visible, levels = frustum.get_visibility(boxes)
+    # Behind the camera, far to the side and beyond the far plane are culled,
+    # a box partly in view is kept
+    assert_array_equal(visible, (True, False, False, True, True, False))
+    assert levels[0] < levels[3] <= LOD_LEVELS
+    assert levels[1] == 0
+
+
+def test_workspace_step():
+
+    ws = Workspace((-2.0, 2.0), (-2.0, 2.0), (0.0, 2.0))
+    random = RandomState(3)
+    for k in range(4):
+        robot = Simple3DOF()
+        robot.set_global_transform(translation=(0.25*k - 0.4, 0.0, 0.0))
+        for link in robot.links:
+            link.set_physics(random.uniform(1.0, 3.0),
+                             random.uniform(-0.05, 0.05, 3),
+                             random.uniform(0.01, 0.02, 3),
+                             random.uniform(-0.001, 0.001, 3))
+        ws.add_robot('robot_{}'.format(k), robot)
+    obstacle = Box((-0.1, 0.1), (-0.1, 0.1), (0.0, 0.5))
+    obstacle.set_transform(translation=(0.0, 0.3, 0.0))
+    ws.add_obstacle('obstacle', obstacle)
+
+    q = dict((name, random.uniform(-1.0, 1.0, 3)) for name in ws.robots)
+    qd = dict((name, random.uniform(-1.0, 1.0, 3)) for name in ws.robots)
+    qdd = dict((name, random.uniform(-1.0, 1.0, 3)) for name in ws.robots)
+    del q['robot_3']
+    tools, torques, collisions = ws.step(q, qd, qdd)
+
+    # Same as moving and checking the robots one by one
+    assert sorted(tools) == sorted(torques) == \
+        ['robot_0', 'robot_1', 'robot_2']
+    for name in q:
+        robot = ws.robots[name]
+        assert_array_almost_equal(robot.state, q[name])
+        assert_array_almost_equal(
+            tools[name], robot.get_tool_trans(q[name], local=False)
+        )
+        expected = robot.get_joint_torques(q[name], qd[name], qdd[name])
+        assert (abs(expected) > 1e-3).any()
+        assert_array_almost_equal(torques[name], expected)
+    assert_array_equal(ws.robots['robot_3'].state, (0.0, 0.0, 0.0))
+    assert any(collisions.values())
+    for name in ws.robots:
+        assert sorted((id(a), id(b)) for a, b in collisions[name]) == \
+            sorted((id(a), id(b)) for a, b in ws.get_collisions(name))
+
+    # A worker pool gives the same results in the same order, and moves the
+    # robots of the workspace
+    ws.robots['robot_0'].move_joints((0.0, 0.0, 0.0))
+    with WorkspacePool(ws, 2) as pool:
+        pool_tools, pool_torques, pool_collisions = ws.step(
+            q, qd, qdd, pool=pool
+        )
+        ws.add_obstacle('box', Box((-0.1, 0.1), (-0.1, 0.1), (0.0, 0.5)))
+        with raises(ValueError):
+            ws.step(q, pool=pool)
+    for name in q:
+        assert_array_equal(pool_tools[name], tools[name])
+        assert_array_equal(pool_torques[name], torques[name])
+    assert_array_equal(ws.robots['robot_0'].state, q['robot_0'])
+    assert_array_equal(ws.robots['robot_0'].tool_transform, tools['robot_0'])
+    for name in ws.robots:
+        assert [(id(a), id(b)) for a, b in pool_collisions[name]] == \
+            [(id(a), id(b)) for a, b in collisions[name]]
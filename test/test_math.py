@@ -3,8 +3,22 @@
 # Test function for making sure all the robot math is correct
 #
 
+from numpy import pi, dot, zeros, arange, append, identity, float_, \
+    einsum
+from numpy.random import RandomState
+from pytest import raises
 from numpy.testing import assert_array_almost_equal
 
+from armech.config import JOINT_REVOLUTE, JOINT_PRISMATIC, GRAVITY
+from armech.core.linkdh import LinkDH
+from armech.core.seriallink import SerialLink
+from armech.core.codegen import generate_kinematics
+from armech.core.ikine import IKSolver
+from armech.core.dynamics import mass_matrix, forward_dynamics
+from armech.core.simulation import Simulator
+from armech.core.reachability import ReachabilityMap
+from armech.core.trajectory import CartesianTrajectory, QuinticTrajectory, \
+    TrapezoidalTrajectory, SplineTrajectory
 from armech.demo.robot import Simple3DOF
 
 def test_simple3dof_forward_kinematics():
@@ -23,4 +37,446 @@ def test_simple3dof_forward_kinematics():
 
     assert_array_almost_equal(
         robot.get_tool_trans(q), end, 4
-    )
\ No newline at end of file
+    )
+
+def test_simple3dof_batch_forward_kinematics():
+
+    # get the robot
+    robot = Simple3DOF()
+    robot.set_global_transform(translation=[0.1, -0.2, 0.3])
+
+    # Batch results must match the single configuration function
+    q = RandomState(0).uniform(-pi, pi, (20, robot.num_links))
+    tools, frames = robot.get_tool_trans_batch(q, local=False,
+                                               link_frames=True)
+    for k in range(q.shape[0]):
+        assert_array_almost_equal(
+            tools[k], robot.get_tool_trans(q[k], local=False)
+        )
+        robot.move_joints(q[k])
+        assert_array_almost_equal(
+            frames[k], robot.link_transforms.transpose((2, 0, 1))
+        )
+
+
+def test_link_transform_kernels():
+
+    # Closed form kernels must match the state and body transforms
+    links = [
+        LinkDH(JOINT_REVOLUTE, 0.3, pi/3, 0.1, 0.2),
+        LinkDH(JOINT_PRISMATIC, -0.2, -pi/4, 0.5, 0.7),
+    ]
+    q = RandomState(1).uniform(-1.0, 1.0, 10)
+    for link in links:
+        transforms = link.get_link_transforms(q)
+        for k in range(q.shape[0]):
+            expected = dot(link.state_transform(q[k]), link.body_transform)
+            assert_array_almost_equal(link.get_link_transform(q[k]), expected)
+            assert_array_almost_equal(transforms[k], expected)
+
+    # The kernels of a link read its row of the robot chain
+    robot = SerialLink(links)
+    out = zeros((4, 4))
+    state_out = zeros((4, 4))
+    assert links[1].get_link_transform(q[0], out, state_out) is out
+    expected = robot.chain.get_link_transforms((q[0], q[0]))[1]
+    assert_array_almost_equal(out, expected)
+    assert_array_almost_equal(state_out, links[1].state_transform(q[0]))
+
+
+def test_link_chain_views():
+
+    # The links of a robot are views onto the arrays of its chain
+    links = [
+        LinkDH(JOINT_REVOLUTE, 0.3, pi/3, 0.1, 0.2, joint_limits=(-1, 1)),
+        LinkDH(JOINT_PRISMATIC, -0.2, -pi/4, 0.5, 0.7),
+    ]
+    links[0].set_physics(2.0, (0.1, 0.0, 0.0), (1.0, 2.0, 3.0),
+                         (0.0, 0.0, 0.0))
+    expected = [link.get_link_transforms((0.3, -0.4)) for link in links]
+    robot = SerialLink(links)
+    assert robot.chain.a.shape == (2,) and robot.chain.a.flags.c_contiguous
+    assert_array_almost_equal(robot.chain.theta, (0.2, 0.7))
+    assert_array_almost_equal(robot.get_joint_limits(), ((-1, 1), (-1, 1)))
+    assert_array_almost_equal(
+        robot.chain.get_link_transforms(((0.3, 0.3), (-0.4, -0.4))),
+        float_(expected).transpose((1, 0, 2, 3))
+    )
+
+    # Changing a link changes the kinematics of the robot
+    tool = robot.get_tool_trans((0.3, 0.3))
+    links[1].d = 0.6
+    assert robot.chain.d[1] == 0.6
+    assert_array_almost_equal(
+        robot.get_tool_trans((0.3, 0.2)), tool
+    )
+    links[0].alpha = 0.0
+    assert_array_almost_equal(robot.chain.body_transforms[0],
+                              links[0].body_transform)
+    assert_array_almost_equal(links[0].body_transform[1:3, 1:3], identity(2))
+
+    # So are their mass properties, which are kept when the link is attached
+    assert list(robot.chain.has_physics) == [True, False]
+    assert robot.chain.masses[0] == 2.0
+    assert_array_almost_equal(robot.chain.inertias[0].diagonal(),
+                              (1.0, 2.0, 3.0))
+    links[1].set_physics(3.0, (0.0, 0.2, 0.0), (1.0, 1.0, 1.0),
+                         (0.0, 0.0, 0.0))
+    assert links[1].has_physics and robot.chain.has_physics[1]
+    assert_array_almost_equal(robot.chain.centers_of_mass[1], (0.0, 0.2, 0.0))
+    assert links[1].center_of_mass.shape == (3, 1)
+
+
+def numerical_jacobian(robot, q, step=1e-6):
+    """Finite difference geometric jacobian of the tool, for checking"""
+    tool = robot.get_tool_trans(q)
+    jacobian = zeros((6, robot.num_links))
+    for k in range(robot.num_links):
+        dq = zeros(robot.num_links)
+        dq[k] = step
+        d_tool = (robot.get_tool_trans(q + dq) - tool)/step
+        jacobian[0:3, k] = d_tool[0:3, 3]
+        d_rotation = dot(d_tool[0:3, 0:3], tool[0:3, 0:3].T)
+        jacobian[3:6, k] = (d_rotation[2, 1], d_rotation[0, 2],
+                            d_rotation[1, 0])
+    return jacobian
+
+
+def test_generated_kinematics(tmpdir):
+
+    # A robot with both joint types
+    robot = SerialLink([
+        LinkDH(JOINT_REVOLUTE, 0.1, pi/2, 0.2, 0.3),
+        LinkDH(JOINT_PRISMATIC, 0.0, -pi/2, 0.1, pi/2),
+        LinkDH(JOINT_REVOLUTE, 0.3, pi/4, -0.05, 0.0),
+    ])
+    kinematics = generate_kinematics(robot, str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
+
+    q = RandomState(2).uniform(-1.0, 1.0, (5, robot.num_links))
+    assert_array_almost_equal(
+        kinematics.tool_trans(q), robot.get_tool_trans_batch(q)
+    )
+    tools, jacobians = kinematics.tool_trans_jacobian(q)
+    for k in range(q.shape[0]):
+        assert_array_almost_equal(
+            kinematics.jacobian(q[k]), numerical_jacobian(robot, q[k]), 5
+        )
+        assert_array_almost_equal(jacobians[k], kinematics.jacobian(q[k]))
+
+    # Every cache directory gets its own copy of the module
+    other_dir = tmpdir.mkdir('other')
+    generate_kinematics(robot, str(other_dir))
+    assert len(other_dir.listdir()) == 1
+
+
+def test_inverse_kinematics():
+
+    # Full pose targets for a 6 DOF arm that are known to be reachable
+    robot = SerialLink([
+        LinkDH(JOINT_REVOLUTE, 0.0, pi/2, 0.672),
+        LinkDH(JOINT_REVOLUTE, 0.4318, 0.0, 0.0),
+        LinkDH(JOINT_REVOLUTE, 0.0203, -pi/2, 0.15005),
+        LinkDH(JOINT_REVOLUTE, 0.0, pi/2, 0.4318),
+        LinkDH(JOINT_REVOLUTE, 0.0, -pi/2, 0.0),
+        LinkDH(JOINT_REVOLUTE, 0.0, 0.0, 0.0),
+    ])
+    solver = IKSolver(robot, random_seed=0)
+    q = RandomState(3).uniform(-pi, pi, (20, robot.num_links))
+    targets = robot.get_tool_trans_batch(q)
+    solutions, success = solver.solve(targets)
+    assert success.all()
+    assert_array_almost_equal(robot.get_tool_trans_batch(solutions), targets)
+
+    # Warm started tracking stays on the trajectory
+    path = robot.get_tool_trans_batch(q[0] + zeros((10, 1)) +
+                                      0.01*arange(10)[:, None])
+    for target, (solution, success) in zip(path, solver.track(path, q[0])):
+        assert success
+        assert_array_almost_equal(robot.get_tool_trans(solution), target)
+
+
+def test_simple3dof_inverse_kinematics_position():
+
+    # The 3 DOF robot only solves for the tool position by default
+    robot = Simple3DOF()
+    solver = IKSolver(robot, random_seed=0)
+    target = robot.get_tool_trans([0.3, -0.5, 1.2])
+    solution, success = solver.solve(target)
+    assert success
+    assert_array_almost_equal(
+        robot.get_tool_trans(solution)[0:3, 3], target[0:3, 3]
+    )
+
+
+def test_geometric_jacobian():
+
+    # A robot with both joint types that is rotated in the world
+    robot = SerialLink([
+        LinkDH(JOINT_PRISMATIC, 0.0, pi/2, 0.2, 0.0),
+        LinkDH(JOINT_REVOLUTE, 0.3, -pi/3, 0.1, 0.4),
+        LinkDH(JOINT_REVOLUTE, 0.25, 0.0, 0.0, 0.0),
+    ], global_rotation=[[0, -1, 0], [1, 0, 0], [0, 0, 1]],
+       global_translation=[1.0, 2.0, 0.5])
+    q = RandomState(4).uniform(-1.0, 1.0, (5, robot.num_links))
+
+    jacobians, tools = robot.get_jacobian_batch(q)
+    for k in range(q.shape[0]):
+        expected = numerical_jacobian(robot, q[k])
+        assert_array_almost_equal(jacobians[k], expected, 5)
+        assert_array_almost_equal(tools[k], robot.get_tool_trans(q[k]))
+
+        # The frames stored by move_joints give the same results
+        robot.move_joints(q[k])
+        jacobian, tool = robot.get_jacobian()
+        assert_array_almost_equal(jacobian, expected, 5)
+        assert_array_almost_equal(tool, tools[k])
+        jacobian, tool = robot.get_jacobian(local=False)
+        assert_array_almost_equal(
+            jacobian, robot.get_jacobian(q[k], local=False)[0]
+        )
+        assert_array_almost_equal(jacobian[0:3], dot(
+            robot.global_rotation, expected[0:3]
+        ), 5)
+
+
+def dynamics_test_robot():
+    """A small robot with both joint types and physical properties"""
+    links = [
+        LinkDH(JOINT_REVOLUTE, 0.1, pi/2, 0.3, 0.0),
+        LinkDH(JOINT_PRISMATIC, 0.2, -pi/2, 0.1, 0.3),
+        LinkDH(JOINT_REVOLUTE, 0.4, pi/3, 0.0, 0.0),
+    ]
+    random = RandomState(5)
+    for link in links:
+        link.set_physics(random.uniform(1.0, 3.0),
+                         random.uniform(-0.2, 0.2, 3),
+                         random.uniform(0.05, 0.1, 3),
+                         random.uniform(-0.01, 0.01, 3))
+    return SerialLink(links, global_rotation=[[1, 0, 0], [0, 0, -1],
+                                              [0, 1, 0]])
+
+
+def numerical_mass_matrix(robot, q, step=1e-6):
+    """Mass matrix from the kinetic energy of the links, for checking"""
+    mass_matrix = zeros((robot.num_links, robot.num_links))
+    _, frames = robot.get_tool_trans_batch(q[None], local=False,
+                                           link_frames=True)
+    for k, link in enumerate(robot.links):
+        rotation = frames[0, k, 0:3, 0:3]
+        center = dot(frames[0, k], append(link.center_of_mass, 1.0))
+        jv = zeros((3, robot.num_links))
+        jw = zeros((3, robot.num_links))
+        for j in range(robot.num_links):
+            dq = zeros(robot.num_links)
+            dq[j] = step
+            _, moved = robot.get_tool_trans_batch((q + dq)[None],
+                                                  local=False,
+                                                  link_frames=True)
+            moved_center = dot(moved[0, k], append(link.center_of_mass, 1.0))
+            jv[:, j] = ((moved_center - center)/step)[0:3]
+            d_rotation = dot((moved[0, k, 0:3, 0:3] - rotation)/step,
+                             rotation.T)
+            jw[:, j] = (d_rotation[2, 1], d_rotation[0, 2], d_rotation[1, 0])
+        inertia = dot(dot(rotation, link.inertia_matrix), rotation.T)
+        mass_matrix += link.mass*dot(jv.T, jv) + dot(dot(jw.T, inertia), jw)
+    return mass_matrix
+
+
+def test_inverse_dynamics():
+
+    robot = dynamics_test_robot()
+    random = RandomState(6)
+    q = random.uniform(-1.0, 1.0, robot.num_links)
+    qd = random.uniform(-1.0, 1.0, robot.num_links)
+    qdd = random.uniform(-1.0, 1.0, robot.num_links)
+    no_gravity = (0.0, 0.0, 0.0)
+
+    # Inertial part matches the kinetic energy of the links
+    def mass_matrix(q):
+        return robot.get_joint_torques_batch(
+            q + zeros((robot.num_links, 1)), zeros((robot.num_links, 3)),
+            identity(robot.num_links), no_gravity
+        ).T
+    assert_array_almost_equal(mass_matrix(q), numerical_mass_matrix(robot, q),
+                              5)
+
+    # Gravity part is the gradient of the potential energy
+    def potential(q):
+        _, frames = robot.get_tool_trans_batch(q[None], local=False,
+                                               link_frames=True)
+        return sum(
+            -link.mass*dot(GRAVITY, dot(frames[0, k],
+                                        append(link.center_of_mass, 1.0))[0:3])
+            for k, link in enumerate(robot.links)
+        )
+    step = 1e-6
+    gradient = [(potential(q + step*e) - potential(q))/step
+                for e in identity(robot.num_links)]
+    assert_array_almost_equal(robot.get_joint_torques(q, zeros(3), zeros(3)),
+                              gradient, 4)
+
+    # Velocity part from the derivatives of the mass matrix
+    d_mass = [(mass_matrix(q + step*e) - mass_matrix(q))/step
+              for e in identity(robot.num_links)]
+    coriolis = sum(d_mass[k]*qd[k] for k in range(robot.num_links)).dot(qd) \
+        - 0.5*float_([qd.dot(d_mass[k]).dot(qd)
+                      for k in range(robot.num_links)])
+    assert_array_almost_equal(
+        robot.get_joint_torques(q, qd, zeros(3), no_gravity), coriolis, 4
+    )
+
+    # Full torques and batch evaluation
+    torques = robot.get_joint_torques(q, qd, qdd)
+    assert_array_almost_equal(
+        torques, dot(mass_matrix(q), qdd) + coriolis + gradient, 4
+    )
+    assert_array_almost_equal(
+        robot.get_joint_torques_batch([q, q], [qd, qd], [qdd, qdd]),
+        [torques, torques]
+    )
+
+
+def test_forward_dynamics_and_simulation():
+
+    robot = dynamics_test_robot()
+    random = RandomState(7)
+    q = random.uniform(-1.0, 1.0, (4, robot.num_links))
+    qd = random.uniform(-1.0, 1.0, (4, robot.num_links))
+    qdd = random.uniform(-1.0, 1.0, (4, robot.num_links))
+
+    # Forward dynamics inverts the inverse dynamics
+    torques = robot.get_joint_torques_batch(q, qd, qdd)
+    assert_array_almost_equal(forward_dynamics(robot, q, qd, torques), qdd)
+
+    # Without torques or friction the total energy is conserved
+    def energy(q, qd):
+        kinetic = 0.5*einsum('ni,nij,nj->n', qd, mass_matrix(robot, q), qd)
+        _, frames = robot.get_tool_trans_batch(q, local=False,
+                                               link_frames=True)
+        potential = zeros(q.shape[0])
+        for k, link in enumerate(robot.links):
+            center = dot(frames[:, k], append(link.center_of_mass, 1.0))
+            potential -= link.mass*dot(center[:, 0:3], GRAVITY)
+        return kinetic + potential
+    simulator = Simulator(robot, 0.001)
+    _, q_history, qd_history = simulator.simulate(q, qd, 200)
+    assert_array_almost_equal(energy(q_history[-1], qd_history[-1]),
+                              energy(q, qd), 4)
+
+    # Each instance in the batch is simulated independently
+    _, q_final, qd_final = simulator.simulate(q[2:3], qd[2:3], 200,
+                                              record=False)
+    assert_array_almost_equal(q_final[0], q_history[-1, 2])
+    assert_array_almost_equal(qd_final[0], qd_history[-1, 2])
+
+    # Links without mass properties give a singular mass matrix
+    massless = Simple3DOF()
+    with raises(ValueError):
+        forward_dynamics(massless, zeros((1, 3)), zeros((1, 3)),
+                         zeros((1, 3)))
+
+
+def test_joint_trajectories():
+
+    q0 = float_((0.0, 0.0, 0.0))
+    q1 = float_((1.0, -2.0, 0.5))
+    waypoints = float_(((0.0, 0.0), (1.0, 0.5), (0.5, 2.0), (0.0, 0.0)))
+    trajectories = (
+        QuinticTrajectory(q0, q1, max_velocity=1.0, max_acceleration=2.0),
+        TrapezoidalTrajectory(q0, q1, 1.0, 2.0),
+        SplineTrajectory(waypoints, max_velocity=1.0, max_acceleration=2.0),
+    )
+
+    # Rest to rest quintic: peak velocity 1.875*distance/T
+    assert_array_almost_equal(trajectories[0].duration, 3.75)
+    # Trapezoid: 2 s cruise at the velocity limit plus 0.5 s of ramps
+    assert_array_almost_equal(trajectories[1].duration, 2.5)
+
+    for trajectory in trajectories:
+        t, q, qd, qdd = trajectory.sample_rate(1000.0)
+        assert t[-1] == trajectory.duration
+        assert (abs(qd) <= 1.0 + 1e-9).all()
+        assert (abs(qdd) <= 2.0 + 1e-9).all()
+        assert_array_almost_equal(qd[[0, -1]], zeros((2, q.shape[1])))
+        # Velocities match the positions
+        assert_array_almost_equal(
+            (q[2:] - q[:-2])/(t[2:] - t[:-2])[:, None], qd[1:-1], 3
+        )
+    assert_array_almost_equal(trajectories[0].sample(10.0)[0], [q1])
+    assert_array_almost_equal(trajectories[1].sample(10.0)[0], [q1])
+
+    # The spline passes through the waypoints
+    spline = trajectories[2]
+    assert_array_almost_equal(spline.sample(spline.times)[0], waypoints)
+
+    # End velocities are kept and the limits still hold
+    spline = SplineTrajectory(((0.0,), (-0.5,), (0.0,)), max_velocity=1.0,
+                              max_acceleration=2.0, qd0=1.0, qd1=-1.0)
+    t, q, qd, qdd = spline.sample_rate(1000.0)
+    assert_array_almost_equal(qd[[0, -1], 0], (1.0, -1.0))
+    assert (abs(qd) <= 1.0 + 1e-8).all()
+    assert (abs(qdd) <= 2.0 + 1e-8).all()
+    with raises(ValueError):
+        SplineTrajectory(((0.0,), (0.5,), (1.0,)), max_velocity=1.0,
+                         max_acceleration=2.0, qd0=3.0)
+
+
+def test_cartesian_trajectory():
+
+    robot = Simple3DOF()
+    q0 = float_((0.2, -0.5, 0.8))
+    start = robot.get_tool_trans(q0)
+    end = robot.get_tool_trans((0.6, -0.3, 0.4))
+    trajectory = CartesianTrajectory(start, end, 0.2, 1.0)
+    assert_array_almost_equal(trajectory.sample(0.0)[0], start)
+    assert_array_almost_equal(trajectory.sample(trajectory.duration)[0], end)
+
+    # The joint setpoints are solved as they are consumed and keep the tool
+    # on the line
+    solver = IKSolver(robot, random_seed=0)
+    t = []
+    q = []
+    for t_k, q_k, success in trajectory.stream_joints(solver, 100.0, q0=q0):
+        assert success
+        t.append(t_k)
+        q.append(q_k)
+    assert t[-1] == trajectory.duration
+    assert_array_almost_equal(q[0], q0)
+    assert_array_almost_equal(
+        robot.get_tool_trans_batch(float_(q))[:, 0:3, 3],
+        trajectory.sample(t)[:, 0:3, 3], 5
+    )
+
+
+def test_reachability_map(tmpdir):
+
+    robot = Simple3DOF()
+    directory = str(tmpdir.join('simple3dof'))
+    reachability = ReachabilityMap.build(robot, directory, voxel_size=0.1,
+                                         n_samples=20000, random_seed=0)
+    assert reachability.counts.sum() == 20000
+    reachability = ReachabilityMap(directory)
+
+    # Lookups follow the mounting of the robot
+    robot.set_global_transform(translation=(1.0, 2.0, 3.0))
+    q = float_((0.3, 0.2, -0.4))
+    point = robot.get_tool_trans(q, local=False)[0:3, 3]
+    assert reachability.is_reachable(point, robot.global_transform())[0]
+    assert not reachability.is_reachable(point)[0]
+    assert not reachability.is_reachable((0.0, 0.0, 2.0))[0]
+
+    # Seeds reach the voxel and warm start the inverse kinematics
+    seeds = reachability.get_seeds(point, robot.global_transform())
+    assert 0 < seeds.shape[0] <= 4
+    voxels = reachability.get_voxels(
+        robot.get_tool_trans_batch(seeds, local=False)[:, 0:3, 3],
+        robot.global_transform()
+    )
+    assert (voxels == reachability.get_voxels(
+        point, robot.global_transform()
+    )).all()
+    _, success = IKSolver(robot, n_seeds=1).solve(
+        robot.get_tool_trans(q, local=False), q0=seeds[0], local=False
+    )
+    assert success